@@ -13,7 +13,7 @@ from library import *
 try:
     import psycopg2
 except ImportError:
-    utility.terminal_msg(0, "Psycopg2 must be installed to use this script.")
+    psycopg2 = None
 
 
 # non-primary keys should be using Integer instead of Serial as we don't either want or need them to auto-increase.
@@ -43,17 +43,32 @@ table_array = [("CREATE TABLE public.products ("
                 "    PRIMARY KEY ({RPM_ID}),"
                 "    FOREIGN KEY ({VERS_ID}) REFERENCES versions ({VERS_ID}) ON DELETE CASCADE"
                 ");"),
+               # what an executable is made of, shared by the execs rows of every version it's in.
+               # Deleting a version leaves its contents, rpm_uploader.roll_back deletes the ones no execs row refers to any more.
+               ("CREATE TABLE public.exec_contents ("
+                "    {CONTENT_ID}     SERIAL,"
+                "    {CONTENT_KEY}    TEXT NOT NULL,"
+                "    PRIMARY KEY ({CONTENT_ID}),"
+                "    UNIQUE ({CONTENT_KEY})"
+                ");"),
                ("CREATE TABLE public.execs ("
                 "    {EXEC_ID}        SERIAL,"
                 "    {RPM_ID}         INTEGER CHECK({RPM_ID} > 0),"
                 "    {EXEC}           TEXT,"
+                "    {BUILD_ID}       TEXT,"
+                "    {EXEC_PATH}      TEXT,"
+                "    {SONAME}         TEXT,"
+                "    {ELF_CLASS}      SMALLINT,"
+                "    {CONTENT_ID}     INTEGER,"
                 "    PRIMARY KEY ({EXEC_ID}),"
-                "    FOREIGN KEY ({RPM_ID}) REFERENCES rpms ({RPM_ID}) ON DELETE CASCADE"
+                "    FOREIGN KEY ({RPM_ID}) REFERENCES rpms ({RPM_ID}) ON DELETE CASCADE,"
+                "    FOREIGN KEY ({CONTENT_ID}) REFERENCES exec_contents ({CONTENT_ID})"
                 ");"),
                ("CREATE TABLE public.aliases ("
                 "    {ALIAS_ID}        SERIAL,"
                 "    {EXEC_ID}         INTEGER CHECK({EXEC_ID} > 0),"
                 "    {ALIAS}           TEXT,"
+                "    {ALIAS_PATH}      TEXT,"
                 "    PRIMARY KEY ({ALIAS_ID}),"
                 "    FOREIGN KEY ({EXEC_ID}) REFERENCES execs ({EXEC_ID}) ON DELETE CASCADE"
                 ");"),
@@ -61,6 +76,7 @@ table_array = [("CREATE TABLE public.products ("
                 "    {RPATH_ID}  SERIAL,"
                 "    {EXEC_ID}   INTEGER CHECK({EXEC_ID} > 0),"
                 "    {RPATH}     TEXT,"
+                "    {RUNPATH}   BOOLEAN,"
                 "    PRIMARY KEY ({RPATH_ID}),"
                 "    FOREIGN KEY ({EXEC_ID}) REFERENCES execs ({EXEC_ID}) ON DELETE CASCADE"
                 ");"),
@@ -78,12 +94,24 @@ table_array = [("CREATE TABLE public.products ("
                 "    FOREIGN KEY ({DEP_ID}) REFERENCES deps ({DEP_ID}),"
                 "    FOREIGN KEY ({R_EXEC_ID}) REFERENCES execs ({EXEC_ID})"
                 ");"),
+               ("CREATE TABLE public.symbols ("
+                "    {SYMBOL_ID}    SERIAL,"
+                "    {SYMBOL_NAME}  TEXT NOT NULL,"
+                "    PRIMARY KEY ({SYMBOL_ID}),"
+                "    UNIQUE ({SYMBOL_NAME})"
+                ");"),
+               # func and callee_func are the names tables made before the symbols table have. They're left NULL now,
+               # as is exec_id, from before the symbols of an executable belonged to its content.
                ("CREATE TABLE public.decl_funcs ("
                 "    {DECL_ID}    SERIAL,"
                 "    {EXEC_ID}    INTEGER CHECK({EXEC_ID} > 0),"
+                "    {CONTENT_ID} INTEGER,"
+                "    {SYMBOL_ID}  INTEGER,"
                 "    {FUNC}       TEXT,"
                 "    PRIMARY KEY ({DECL_ID}),"
-                "    FOREIGN KEY ({EXEC_ID}) REFERENCES execs ({EXEC_ID}) ON DELETE CASCADE"
+                "    FOREIGN KEY ({EXEC_ID}) REFERENCES execs ({EXEC_ID}) ON DELETE CASCADE,"
+                "    FOREIGN KEY ({CONTENT_ID}) REFERENCES exec_contents ({CONTENT_ID}) ON DELETE CASCADE,"
+                "    FOREIGN KEY ({SYMBOL_ID}) REFERENCES symbols ({SYMBOL_ID})"
                 ");"),
                ("CREATE TABLE public.def_funcs ("
                 "    {DEF_ID}     SERIAL,"
@@ -102,53 +130,146 @@ table_array = [("CREATE TABLE public.products ("
                ("CREATE TABLE public.callee_funcs ("
                 "    {CALLEE_ID}    SERIAL,"
                 "    {DECL_ID}      INTEGER CHECK({DECL_ID} > 0),"
+                "    {C_SYMBOL_ID}  INTEGER,"
                 "    {C_FUNC}       TEXT,"
                 "    PRIMARY KEY ({CALLEE_ID}),"
-                "    FOREIGN KEY ({DECL_ID}) REFERENCES decl_funcs ({DECL_ID}) ON DELETE CASCADE"
+                "    FOREIGN KEY ({DECL_ID}) REFERENCES decl_funcs ({DECL_ID}) ON DELETE CASCADE,"
+                "    FOREIGN KEY ({C_SYMBOL_ID}) REFERENCES symbols ({SYMBOL_ID})"
                 ");")]
 
-def main():
+# changes to tables created by an earlier version of this script, in the order they were made.
+# Each one has to be safe to run again, since --migrate runs all of them.
+migration_array = [("ALTER TABLE public.execs ADD COLUMN IF NOT EXISTS {BUILD_ID} TEXT;"),
+                   ("CREATE INDEX IF NOT EXISTS execs_{BUILD_ID}_idx ON public.execs ({BUILD_ID});"),
+                   ("ALTER TABLE public.execs ADD COLUMN IF NOT EXISTS {EXEC_PATH} TEXT;"),
+                   ("ALTER TABLE public.execs ADD COLUMN IF NOT EXISTS {SONAME} TEXT;"),
+                   ("ALTER TABLE public.aliases ADD COLUMN IF NOT EXISTS {ALIAS_PATH} TEXT;"),
+                   ("ALTER TABLE public.rpaths ADD COLUMN IF NOT EXISTS {RUNPATH} BOOLEAN;"),
+                   ("CREATE TABLE IF NOT EXISTS public.iso_fingerprints ("
+                    "    {FINGERPRINT}    TEXT,"
+                    "    {VERS_ID}        INTEGER CHECK({VERS_ID} > 0),"
+                    "    {ISO_NAME}       TEXT,"
+                    "    {ISO_SIZE}       BIGINT,"
+                    "    {PVD_HASH}       TEXT,"
+                    "    {METADATA_HASH}  TEXT,"
+                    "    {SAMPLE_HASH}    TEXT,"
+                    "    PRIMARY KEY ({FINGERPRINT}),"
+                    "    FOREIGN KEY ({VERS_ID}) REFERENCES versions ({VERS_ID}) ON DELETE CASCADE"
+                    ");"),
+                   # rpm_uploader holds a version back from readers while its shards are uploaded
+                   ("ALTER TABLE public.versions ADD COLUMN IF NOT EXISTS {READY} BOOLEAN NOT NULL DEFAULT TRUE;"),
+                   # symbol names are stored once in the symbols table, and referred to by id
+                   ("CREATE TABLE IF NOT EXISTS public.symbols ("
+                    "    {SYMBOL_ID}    SERIAL,"
+                    "    {SYMBOL_NAME}  TEXT NOT NULL,"
+                    "    PRIMARY KEY ({SYMBOL_ID}),"
+                    "    UNIQUE ({SYMBOL_NAME})"
+                    ");"),
+                   ("ALTER TABLE public.decl_funcs ADD COLUMN IF NOT EXISTS {SYMBOL_ID} INTEGER REFERENCES symbols ({SYMBOL_ID});"),
+                   ("ALTER TABLE public.callee_funcs ADD COLUMN IF NOT EXISTS {C_SYMBOL_ID} INTEGER REFERENCES symbols ({SYMBOL_ID});"),
+                   ("INSERT INTO public.symbols ({SYMBOL_NAME}) "
+                    "SELECT {FUNC} FROM public.decl_funcs WHERE {FUNC} IS NOT NULL "
+                    "UNION SELECT {C_FUNC} FROM public.callee_funcs WHERE {C_FUNC} IS NOT NULL "
+                    "ON CONFLICT ({SYMBOL_NAME}) DO NOTHING;"),
+                   ("UPDATE public.decl_funcs SET {FUNC} = NULL, "
+                    "{SYMBOL_ID} = (SELECT s.{SYMBOL_ID} FROM public.symbols s WHERE s.{SYMBOL_NAME} = decl_funcs.{FUNC}) "
+                    "WHERE {FUNC} IS NOT NULL;"),
+                   ("UPDATE public.callee_funcs SET {C_FUNC} = NULL, "
+                    "{C_SYMBOL_ID} = (SELECT s.{SYMBOL_ID} FROM public.symbols s WHERE s.{SYMBOL_NAME} = callee_funcs.{C_FUNC}) "
+                    "WHERE {C_FUNC} IS NOT NULL;"),
+                   ("CREATE INDEX IF NOT EXISTS decl_funcs_{SYMBOL_ID}_idx ON public.decl_funcs ({SYMBOL_ID});"),
+                   ("CREATE INDEX IF NOT EXISTS callee_funcs_{C_SYMBOL_ID}_idx ON public.callee_funcs ({C_SYMBOL_ID});"),
+                   # the symbols of an executable belong to its content, which the execs of every version with it share.
+                   # Executables uploaded before get a content of their own each, keyed by their exec_id.
+                   ("CREATE TABLE IF NOT EXISTS public.exec_contents ("
+                    "    {CONTENT_ID}     SERIAL,"
+                    "    {CONTENT_KEY}    TEXT NOT NULL,"
+                    "    PRIMARY KEY ({CONTENT_ID}),"
+                    "    UNIQUE ({CONTENT_KEY})"
+                    ");"),
+                   ("ALTER TABLE public.execs ADD COLUMN IF NOT EXISTS {CONTENT_ID} INTEGER REFERENCES exec_contents ({CONTENT_ID});"),
+                   ("ALTER TABLE public.decl_funcs ADD COLUMN IF NOT EXISTS {CONTENT_ID} INTEGER REFERENCES exec_contents ({CONTENT_ID}) ON DELETE CASCADE;"),
+                   ("INSERT INTO public.exec_contents ({CONTENT_KEY}) "
+                    "SELECT 'exec:' || {EXEC_ID} FROM public.execs WHERE {CONTENT_ID} IS NULL "
+                    "ON CONFLICT ({CONTENT_KEY}) DO NOTHING;"),
+                   ("UPDATE public.execs SET "
+                    "{CONTENT_ID} = (SELECT c.{CONTENT_ID} FROM public.exec_contents c WHERE c.{CONTENT_KEY} = 'exec:' || execs.{EXEC_ID}) "
+                    "WHERE {CONTENT_ID} IS NULL;"),
+                   ("UPDATE public.decl_funcs SET "
+                    "{CONTENT_ID} = (SELECT e.{CONTENT_ID} FROM public.execs e WHERE e.{EXEC_ID} = decl_funcs.{EXEC_ID}) "
+                    "WHERE {CONTENT_ID} IS NULL;"),
+                   ("CREATE INDEX IF NOT EXISTS execs_{CONTENT_ID}_idx ON public.execs ({CONTENT_ID});"),
+                   ("CREATE INDEX IF NOT EXISTS decl_funcs_{CONTENT_ID}_idx ON public.decl_funcs ({CONTENT_ID});"),
+                   ("ALTER TABLE public.execs ADD COLUMN IF NOT EXISTS {ELF_CLASS} SMALLINT;"),
+                   # set in the transaction that adds a content's symbols. The contents there already had theirs.
+                   ("ALTER TABLE public.exec_contents ADD COLUMN IF NOT EXISTS {COMPLETE} BOOLEAN NOT NULL DEFAULT TRUE;"),
+                   # when the hold on a version that isn't ready runs out (seconds since the epoch), unless the upload renews it.
+                   # Versions left unready before this have none, and are taken over by the next upload of them.
+                   ("ALTER TABLE public.versions ADD COLUMN IF NOT EXISTS {HELD_UNTIL} DOUBLE PRECISION;")]
+
+def main(migrate = False, conn = None):
+    '''
+    @param
+    conn    a connection to create the tables through, e.g. a sqlite_db stand-in. By default the database in the config.
+    '''
+    # the migrations bring new tables up to date as well, so they always run after creating them
+    statements = migration_array
+    if not migrate:
+        statements = table_array + migration_array
+
     # putting the column names into the array of formatted create statement strings (table_array)
     f_array = [
         x.format(
             PROD_ID=PROD_ID, PROD=PROD,
-            VERS_ID=VERS_ID, VERS=VERS,
+            VERS_ID=VERS_ID, VERS=VERS, READY=READY, HELD_UNTIL=HELD_UNTIL,
             RPM_ID=RPM_ID, RPM=RPM, RELEASE=RELEASE, RPM_V=RPM_V,
             X86_64=X86_64, I686=I686, PPC=PPC, NOARCH=NOARCH, OTHERARCH=OTHERARCH,
-            EXEC_ID=EXEC_ID, EXEC=EXEC,
-            RPATH_ID=RPATH_ID, RPATH=RPATH,
+            EXEC_ID=EXEC_ID, EXEC=EXEC, BUILD_ID=BUILD_ID, EXEC_PATH=EXEC_PATH, SONAME=SONAME, ELF_CLASS=ELF_CLASS,
+            CONTENT_ID=CONTENT_ID, CONTENT_KEY=CONTENT_KEY, COMPLETE=COMPLETE,
+            RPATH_ID=RPATH_ID, RPATH=RPATH, RUNPATH=RUNPATH,
             DEP_ID=DEP_ID, DEP=DEP, STATIC=STATIC, 
             R_EXEC_ID=R_EXEC_ID,
+            SYMBOL_ID=SYMBOL_ID, SYMBOL_NAME=SYMBOL_NAME,
             DECL_ID=DECL_ID, FUNC=FUNC,
             DEF_ID=DEF_ID, BIND=BIND,
             AT_ID=AT_ID, AT=AT,
-            CALLEE_ID=CALLEE_ID, C_FUNC=C_FUNC,
-            ALIAS_ID=ALIAS_ID, ALIAS=ALIAS
-        ) for x in table_array
+            CALLEE_ID=CALLEE_ID, C_FUNC=C_FUNC, C_SYMBOL_ID=C_SYMBOL_ID,
+            ALIAS_ID=ALIAS_ID, ALIAS=ALIAS, ALIAS_PATH=ALIAS_PATH,
+            FINGERPRINT=FINGERPRINT, ISO_NAME=ISO_NAME, ISO_SIZE=ISO_SIZE,
+            PVD_HASH=PVD_HASH, METADATA_HASH=METADATA_HASH, SAMPLE_HASH=SAMPLE_HASH
+        ) for x in statements
     ]
 
-    # Define our connection string
-    conn_string = get_conn_str()
+    close_conn = False
+    if conn is None:
+        if psycopg2 is None:
+            terminal_msg(0, "Psycopg2 must be installed to use this script.")
+
+        # Define our connection string
+        conn_string = get_conn_str()
 
-    # print the connection string we will use to connect
-    terminal_msg(2, "Connecting to database\n\t-> %s" % (conn_string))
+        # print the connection string we will use to connect
+        terminal_msg(2, "Connecting to database\n\t-> %s" % (conn_string))
 
-    
-    # get a connection, if a connect cannot be made an exception will be raised here
-    conn = psycopg2.connect(conn_string)
-    terminal_msg(2, "Connected!\n")
+        # get a connection, if a connect cannot be made an exception will be raised here
+        conn = psycopg2.connect(conn_string)
+        close_conn = True
+        terminal_msg(2, "Connected!\n")
 
     for table in f_array:
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute(table)
-        except psycopg2.ProgrammingError as e:
-            raise e
+        with conn.cursor() as cursor:
+            cursor.execute(table)
         conn.commit()
-    conn.close()
+    if close_conn:
+        conn.close()
 
 if __name__ == "__main__":
 
     p = ArgumentParser(description=__doc__)
 
-    main()
\ No newline at end of file
+    p.add_argument("-m", "--migrate", action="store_true",
+                   help="Only apply the changes made since the tables were created to an existing database.")
+
+    args = p.parse_args()
+
+    main(args.migrate)
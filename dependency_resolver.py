@@ -4,13 +4,30 @@ import os
 import sys
 import pprint
 import argparse
-import psycopg2
 import configparser
 
 from library import *
 
-# get connection string from config
-conn_string = get_conn_str()
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# a function returning a new connection, in place of connecting to the database
+# in the config; the pipeline benchmark sets it to connect to a sqlite file
+connect = None
+
+
+def db_connect():
+    '''
+    @return
+    a new connection to the database
+    '''
+    if connect:
+        return connect()
+    if psycopg2 is None:
+        terminal_msg(0, "Psycopg2 must be installed to use this script.")
+    return psycopg2.connect(get_conn_str())
 
 
 def safe_execsql(sql, args = None):
@@ -31,7 +48,7 @@ def safe_execsql(sql, args = None):
         raise Exception("The arguments for sql is not passed with a tuple.")
     
     # establish connection
-    conn = psycopg2.connect(conn_string)
+    conn = db_connect()
 
     # init variable
     res = []
@@ -88,7 +105,7 @@ def safe_execsql_gen(sql, fetch = 150, args = None):
         raise Exception("Parameter fetch shall be an integer that is not lesser or equal to zero.")
     
     # establish connection
-    conn = psycopg2.connect(conn_string)
+    conn = db_connect()
 
     # init variable
     res = []
@@ -128,13 +145,17 @@ def safe_execsql_gen(sql, fetch = 150, args = None):
 
 
 
-def resolve_deps(product, version, debug = True):
+def resolve_deps(product, version, debug = True, unrecorded_only = False):
     '''
     Update columns in resolved_deps_execs table to store the resolved r_exec_id of a dep_id. 
     This script is designed to run frequently whenever database data are added or modified.
 
     Note that more than one r_exec_id may be resolved for one dep_id. Since the program does not have enough capability to do more than name matching, incorrect entries must be manually removed by admins.
+
+    @param
+    unrecorded_only     only match the dependencies of executables without a recorded install path, the ones resolve_deps_exact() can't resolve
     '''
+    unrecorded = " AND e2.path IS NULL" if unrecorded_only else ""
 
     if not debug:
         # insert all entries under certain prod/vers found in execs table that have a name and version/product match with dependencies in deps table
@@ -142,7 +163,7 @@ def resolve_deps(product, version, debug = True):
                                  "SELECT DISTINCT e1.exec_id, d2.dep_id FROM execs e1 " + \
                                  "JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                  "JOIN deps d2 ON e1.exec ILIKE concat('%', d2.dep, '%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                 "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND p1.product = %s AND v1.version = %s; "
+                                 "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready AND p1.product = %s AND v1.version = %s" + unrecorded + "; "
 
         
         # insert all entries under certain prod/vers found in aliases table that have a name and version/product match with dependencies in deps table
@@ -150,7 +171,7 @@ def resolve_deps(product, version, debug = True):
                                    "SELECT DISTINCT e1.exec_id, d2.dep_id FROM aliases a1 " + \
                                    "JOIN execs e1 ON a1.exec_id = e1.exec_id JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                    "JOIN deps d2 ON a1.alias ILIKE concat('%', d2.dep, '%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                   "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND p1.product = %s AND v1.version = %s; "
+                                   "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready AND p1.product = %s AND v1.version = %s" + unrecorded + "; "
         
         # execute queries to insert
         safe_execsql(sql_insert_execs_match, (product, version))
@@ -162,14 +183,14 @@ def resolve_deps(product, version, debug = True):
         sql_select_execs_match = "SELECT DISTINCT e1.exec_id, d2.dep_id FROM execs e1 " + \
                                  "JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                  "JOIN deps d2 ON e1.exec ILIKE concat('%%', d2.dep, '%%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                 "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND p1.product = %s AND v1.version = %s; "
+                                 "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready AND p1.product = %s AND v1.version = %s" + unrecorded + "; "
 
         
         # select all entries under certain prod/vers found in aliases table that have a name and version/product match with dependencies in deps table
         sql_select_aliases_match = "SELECT DISTINCT e1.exec_id, d2.dep_id FROM aliases a1 " + \
                                    "JOIN execs e1 ON a1.exec_id = e1.exec_id JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                    "JOIN deps d2 ON a1.alias ILIKE concat('%%', d2.dep, '%%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                   "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND p1.product = %s AND v1.version = %s; "
+                                   "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready AND p1.product = %s AND v1.version = %s" + unrecorded + "; "
         
 
         # insert a single row of data entry (takes 4 params)
@@ -204,13 +225,167 @@ def resolve_deps(product, version, debug = True):
        
     
 
+# the directories ld.so falls back to after the rpaths and ld.so.cache, for 64 and 32 bit objects
+DEFAULT_LIB_DIRS = {True: ("/lib64", "/usr/lib64"),
+                    False: ("/lib", "/usr/lib")}
+
+
+def expand_search_path(search_path, origin, lib64):
+    '''
+    Split an RPATH/RUNPATH entry into directories, expanding $ORIGIN and $LIB the way ld.so does.
+
+    @param
+    search_path     the colon separated entry, e.g. "$ORIGIN/../lib:/opt/foo/lib"
+    origin          the directory the object with the entry is installed in
+    lib64           whether the object is 64 bit
+
+    @return
+    list of normalized directories
+    '''
+    lib = "lib64" if lib64 else "lib"
+    dirs = []
+    for d in search_path.split(":"):
+        if not d:
+            continue
+        d = d.replace("${ORIGIN}", origin).replace("$ORIGIN", origin)
+        d = d.replace("${LIB}", lib).replace("$LIB", lib)
+        dirs.append(os.path.normpath(d))
+    return dirs
+
+
+def library_search_dirs(exec_path, rpaths, runpaths, lib64):
+    '''
+    The directories ld.so searches, in order, for the dependencies of an object:
+    its DT_RPATH (ignored when it has a DT_RUNPATH), its DT_RUNPATH, then the default directories.
+    LD_LIBRARY_PATH and the rpaths of the objects that loaded this one aren't known here and are left out.
+    '''
+    origin = os.path.dirname(exec_path)
+    dirs = []
+    if not runpaths:
+        for rpath in rpaths:
+            dirs.extend(expand_search_path(rpath, origin, lib64))
+    for runpath in runpaths:
+        dirs.extend(expand_search_path(runpath, origin, lib64))
+    dirs.extend(DEFAULT_LIB_DIRS[lib64])
+    return dirs
+
+
+def find_library(dep, search_dirs, path_index, soname_index):
+    '''
+    Emulate ld.so looking up one DT_NEEDED entry.
+
+    @param
+    dep             the DT_NEEDED entry
+    search_dirs     from library_search_dirs()
+    path_index      dict of install path -> exec_id, for the executables and aliases (symlinks) of a version
+    soname_index    dict of DT_SONAME -> set of exec_id
+
+    @return
+    the exec_id of the library, or None
+    '''
+    if "/" in dep:
+        # used as a path as is
+        return path_index.get(os.path.normpath(dep))
+
+    for d in search_dirs:
+        exec_id = path_index.get(os.path.join(d, dep))
+        if exec_id:
+            return exec_id
+
+    # stands in for ld.so.cache, which also covers the directories from /etc/ld.so.conf.d.
+    # Only trusted when one library of the version has that soname.
+    candidates = soname_index.get(dep, ())
+    if len(candidates) == 1:
+        return next(iter(candidates))
+    return None
+
+
+def resolve_deps_exact(product, version):
+    '''
+    Resolve the dependencies of a product version to exactly one exec_id each, using the
+    install paths, rpaths and sonames recorded by rpm_db_builder instead of name matching.
+    Every dependency is looked up in dicts built from the version's executables, so it's one
+    pass over the deps table.
+
+    Executables uploaded from JSON files without install paths can't be found this way;
+    resolve_deps() with unrecorded_only still handles those.
+
+    The lib64 or lib default directories are picked by the ELF class rpm_db_builder recorded
+    for each executable, or by the rpm's architecture for executables uploaded without one.
+
+    @return
+    the number of dependencies of executables without a recorded install path
+    '''
+    version_joins = "JOIN rpms r ON e.rpm_id = r.rpm_id JOIN versions v ON r.vers_id = v.vers_id JOIN products p ON v.prod_id = p.prod_id " + \
+                    "WHERE p.product = %s AND v.version = %s AND v.ready"
+
+    sql_select_execs = "SELECT e.exec_id, e.path, e.soname FROM execs e " + version_joins + ";"
+    sql_select_aliases = "SELECT a.exec_id, a.path FROM aliases a JOIN execs e ON a.exec_id = e.exec_id " + version_joins + ";"
+    sql_select_rpaths = "SELECT rp.exec_id, rp.rpath, rp.runpath FROM rpaths rp JOIN execs e ON rp.exec_id = e.exec_id " + version_joins + ";"
+    sql_select_deps = "SELECT d.dep_id, d.dep, e.exec_id, e.path, e.elf_class, r.x86_64 FROM deps d JOIN execs e ON d.exec_id = e.exec_id " + version_joins + ";"
+
+    sql_insert_match = "INSERT INTO resolved_deps_execs(r_exec_id, dep_id) SELECT %s, %s " + \
+                       "WHERE NOT EXISTS (SELECT * FROM resolved_deps_execs WHERE r_exec_id = %s AND dep_id = %s);"
+
+    args = (product, version)
+
+    path_index = {}
+    soname_index = {}
+    for exec_id, exec_path, soname in safe_execsql(sql_select_execs, args):
+        if exec_path:
+            path_index[exec_path] = exec_id
+        if soname:
+            soname_index.setdefault(soname, set()).add(exec_id)
+    for exec_id, alias_path in safe_execsql(sql_select_aliases, args):
+        if alias_path:
+            path_index.setdefault(alias_path, exec_id)
+
+    rpaths = {}
+    runpaths = {}
+    for exec_id, rpath, runpath in safe_execsql(sql_select_rpaths, args):
+        if runpath:
+            runpaths.setdefault(exec_id, []).append(rpath)
+        else:
+            rpaths.setdefault(exec_id, []).append(rpath)
+
+    resolved = []
+    unresolved = 0
+    no_path = 0
+    search_dirs = {}
+    for row in safe_execsql_gen(sql_select_deps, 500, args):
+        if not row:
+            continue
+        dep_id, dep, exec_id, exec_path, elf_class, x86_64 = row
+        if not exec_path:
+            no_path += 1
+            continue
+        if exec_id not in search_dirs:
+            lib64 = elf_class == 64 if elf_class else bool(x86_64)
+            search_dirs[exec_id] = library_search_dirs(exec_path, rpaths.get(exec_id, []), runpaths.get(exec_id, []), lib64)
+
+        r_exec_id = find_library(dep, search_dirs[exec_id], path_index, soname_index)
+        if r_exec_id:
+            resolved.append((r_exec_id, dep_id, r_exec_id, dep_id))
+        else:
+            unresolved += 1
+
+    conn = db_connect()
+    with conn:
+        with conn.cursor() as cur:
+            cur.executemany(sql_insert_match, resolved)
+    conn.close()
+
+    terminal_msg(2, "Resolved %d dependencies of %s %s, %d could not be resolved, %d have no install path." % (len(resolved), product, version, unresolved, no_path))
+    return no_path
+
+
 def resolve_deps_complete():
     # insert all entries found in execs table that have a name and version/product match with dependencies in deps table
     sql_insert_execs_match = "INSERT INTO resolved_deps_execs(r_exec_id, dep_id) " + \
                                 "SELECT DISTINCT e1.exec_id, d2.dep_id FROM execs e1 " + \
                                 "JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                 "JOIN deps d2 ON e1.exec ILIKE concat('%', d2.dep, '%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id; "
+                                "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready; "
 
 
     # insert all entries found in aliases table that have a name and version/product match with dependencies in deps table
@@ -218,7 +393,7 @@ def resolve_deps_complete():
                                 "SELECT DISTINCT e1.exec_id, d2.dep_id FROM aliases a1 " + \
                                 "JOIN execs e1 ON a1.exec_id = e1.exec_id JOIN rpms r1 ON e1.rpm_id = r1.rpm_id JOIN versions v1 ON r1.vers_id = v1.vers_id JOIN products p1 ON v1.prod_id = p1.prod_id " + \
                                 "JOIN deps d2 ON a1.alias ILIKE concat('%', d2.dep, '%') JOIN execs e2 ON d2.exec_id = e2.exec_id JOIN rpms r2 ON e2.rpm_id = r2.rpm_id JOIN versions v2 ON r2.vers_id = v2.vers_id JOIN products p2 ON v2.prod_id = p2.prod_id " + \
-                                "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id; "
+                                "WHERE v1.vers_id = v2.vers_id AND p1.prod_id = p2.prod_id AND v1.ready; "
     
     # execute queries to insert
     safe_execsql(sql_insert_execs_match)
@@ -262,10 +437,17 @@ if __name__ == "__main__":
                     help = "The version number, including the release number, of the product to examine. MUST be specified with exact number.")
     p.add_argument("-a", "--all", action = "store_true",
                     help = "Resolve all existed products/versions in database.")
+    p.add_argument("-e", "--exact", action = "store_true",
+                    help = "Resolve each dependency to the one library ld.so would load, from the install paths, rpaths and sonames in the database.")
     args = p.parse_args()
 
     # execute
-    if args.all:
+    if args.exact and args.all:
+        for product, version in safe_execsql("SELECT p.product, v.version FROM versions v JOIN products p ON v.prod_id = p.prod_id WHERE v.ready;"):
+            resolve_deps_exact(product, version)
+    elif args.exact and args.product_name and args.version_number:
+        resolve_deps_exact(args.product_name, args.version_number)
+    elif args.all:
         resolve_deps_complete()
     elif args.product_name and args.version_number:
         resolve_deps(args.product_name, args.version_number)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+assembly_benchmark times assemblyparser on generated "objdump -d" output, so
+changes to the parsing can be measured on disassembly of any shape and size.
+Each run appends its timings and peak memory to a JSON file, where they can be
+compared with earlier runs.
+"""
+import os
+import time
+import random
+import tracemalloc
+from json import dumps, loads
+from argparse import ArgumentParser
+
+import assemblyparser
+from lib import *
+
+
+# a few instructions that aren't calls, with their encodings
+FILLER_INSTRUCTIONS = [("55", "push   %rbp"),
+                       ("48 89 e5", "mov    %rsp,%rbp"),
+                       ("48 83 ec 10", "sub    $0x10,%rsp"),
+                       ("89 7d fc", "mov    %edi,-0x4(%rbp)"),
+                       ("8b 45 fc", "mov    -0x4(%rbp),%eax"),
+                       ("85 c0", "test   %eax,%eax"),
+                       ("74 05", "je     {next:x} <{function}+0x{offset:x}>"),
+                       ("0f 1f 44 00 00", "nopl   0x0(%rax,%rax,1)"),
+                       ("c9", "leave"),
+                       ("c3", "ret")]
+
+
+def function_name(rng, n, mangled_fraction):
+    '''
+    A C name, or with the given probability a mangled C++ one
+    '''
+    if rng.random() < mangled_fraction:
+        namespace = "ns%d" % (n % 17)
+        name = "method%d" % n
+        return "_ZN%d%s%d%sEv" % (len(namespace), namespace, len(name), name)
+    return "function_%d" % n
+
+
+def generate_disassembly(sections = 1, functions = 1000, instructions = 40, call_density = 0.1,
+                         plt_stubs = 100, mangled_fraction = 0.2, seed = 0):
+    '''
+    Generate "objdump -d" output for a made-up executable.
+
+    @param
+    sections            the number of .text-like sections the functions are spread over
+    functions           the number of functions in those sections
+    instructions        the number of instructions in each function
+    call_density        the fraction of instructions that are calls
+    plt_stubs           the number of .plt stubs, which calls go to as often as to the functions
+    mangled_fraction    the fraction of function (and stub) names that are mangled C++ names
+    seed                for the random number generator, the same parameters and seed give the same text
+
+    @return
+    the disassembly as one string
+    '''
+    rng = random.Random(seed)
+    stub_names = [function_name(rng, n, mangled_fraction) for n in range(plt_stubs)]
+    names = [function_name(rng, n + plt_stubs, mangled_fraction) for n in range(functions)]
+
+    lines = ["", "synthetic.so:     file format elf64-x86-64", ""]
+    address = 0x1000
+    addresses = {}
+
+    def instruction(opcodes, text):
+        nonlocal address
+        lines.append("%8x:\t%-21s\t%s" % (address, opcodes, text))
+        address += len(opcodes.split())
+
+    lines += ["", "Disassembly of section .plt:", ""]
+    for name in stub_names:
+        addresses[name] = address
+        lines += ["", "%016x <%s@plt>:" % (address, name)]
+        instruction("ff 25 e2 2f 00 00", "jmp    *0x2fe2(%rip)")
+        instruction("68 00 00 00 00", "push   $0x0")
+        instruction("e9 e0 ff ff ff", "jmp    1000 <.plt>")
+
+    # lay out the functions first, so calls can go forward as well as backward.
+    # No instruction above is longer than 6 bytes.
+    text_start = address
+    per_section = max(1, -(-functions // max(1, sections)))
+    for n, name in enumerate(names):
+        addresses[name] = text_start + n * instructions * 6
+
+    for n, name in enumerate(names):
+        if n % per_section == 0:
+            section = ".text" if n == 0 else ".text.%d" % (n // per_section)
+            lines += ["", "Disassembly of section %s:" % section, ""]
+        address = addresses[name]
+        start = address
+        lines += ["", "%016x <%s>:" % (address, name)]
+        for i in range(instructions):
+            if rng.random() < call_density:
+                if stub_names and rng.random() < 0.5:
+                    callee = rng.choice(stub_names)
+                    instruction("e8 00 00 00 00", "call   %x <%s@plt>" % (addresses[callee], callee))
+                elif rng.random() < 0.1:
+                    instruction("ff d0", "call   *%rax")
+                else:
+                    callee = rng.choice(names)
+                    instruction("e8 00 00 00 00", "call   %x <%s>" % (addresses[callee], callee))
+            else:
+                opcodes, text = rng.choice(FILLER_INSTRUCTIONS)
+                instruction(opcodes, text.format(next = address + 7, function = name, offset = address + 7 - start))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def benchmark_parse(text, repeat):
+    '''
+    Parse text with AssemblyRaw repeat times.
+
+    @return
+    a dict with the best parse and create_json_data times, and the peak memory of a parse
+    '''
+    parse_times = []
+    json_times = []
+    for _ in range(repeat):
+        # every parse pays for its demangling, as it would in its own worker
+        assemblyparser.cppdemangle.cache_clear()
+        start = time.perf_counter()
+        assembly_obj = assemblyparser.AssemblyRaw(text = text)
+        parsed = time.perf_counter()
+        assembly_obj.create_json_data()
+        parse_times.append(parsed - start)
+        json_times.append(time.perf_counter() - parsed)
+        del assembly_obj
+
+    # measured apart from the timings, tracing slows everything down
+    assemblyparser.cppdemangle.cache_clear()
+    tracemalloc.start()
+    assembly_obj = assemblyparser.AssemblyRaw(text = text)
+    json_data = assembly_obj.create_json_data()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    text_mb = len(text) / float(2 ** 20)
+    return {"parse_time": min(parse_times),
+            "json_time": min(json_times),
+            "peak_bytes": peak,
+            "retained_bytes": retained,
+            "retained_bytes_per_mb": retained / text_mb if text_mb else 0,
+            "mb_per_second": text_mb / min(parse_times) if min(parse_times) else 0,
+            "defined_functions": len(json_data["defined_functions"])}
+
+
+def append_results(filename, results):
+    '''
+    Add results to the list of runs kept in filename
+    '''
+    runs = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            runs = loads(f.read())
+    runs.append(results)
+    with open(filename, "w") as f:
+        f.write(dumps(runs, sort_keys = True, indent = 4))
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-s", "--sections", type=int, default=1,
+                   help="The number of .text sections the functions are spread over.")
+    p.add_argument("-f", "--functions", type=int, default=20000,
+                   help="The number of functions.")
+    p.add_argument("-i", "--instructions", type=int, default=40,
+                   help="The number of instructions in each function.")
+    p.add_argument("-c", "--call-density", type=float, default=0.1,
+                   help="The fraction of instructions that are calls.")
+    p.add_argument("-p", "--plt-stubs", type=int, default=500,
+                   help="The number of .plt stubs.")
+    p.add_argument("-m", "--mangled", type=float, default=0.2,
+                   help="The fraction of names that are mangled C++ names.")
+    p.add_argument("-e", "--seed", type=int, default=0,
+                   help="Seed for generating the disassembly.")
+    p.add_argument("-n", "--repeat", type=int, default=3,
+                   help="Parse the disassembly this many times and keep the best times.")
+    p.add_argument("-l", "--label", type=str, default="",
+                   help="A name for this run, to tell it apart in the results file.")
+    p.add_argument("-w", "--write-text", type=str,
+                   help="Also write the generated disassembly to this file.")
+    p.add_argument("-j", "--json", type=str,
+                   help="Append the results to this JSON file.")
+    args = p.parse_args()
+
+    parameters = {"sections": args.sections,
+                  "functions": args.functions,
+                  "instructions": args.instructions,
+                  "call_density": args.call_density,
+                  "plt_stubs": args.plt_stubs,
+                  "mangled_fraction": args.mangled,
+                  "seed": args.seed}
+    text = generate_disassembly(**parameters)
+    if args.write_text:
+        with open(args.write_text, "w") as f:
+            f.write(text)
+
+    results = benchmark_parse(text, args.repeat)
+    results.update({"label": args.label,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "parameters": parameters,
+                    "text_bytes": len(text)})
+
+    terminal_msg(2, "{text_bytes} bytes of disassembly: parsed in {parse_time:.2f}s ({mb_per_second:.1f} MB/s), "
+                    "create_json_data in {json_time:.2f}s, peak {peak_bytes} bytes, "
+                    "{retained_bytes_per_mb:.0f} bytes kept per MB".format(**results))
+
+    if args.json:
+        append_results(args.json, results)
@@ -1,19 +1,17 @@
 #!/usr/bin/env python3
 
 import re
+from functools import lru_cache
 from json import dumps
 from os import path
+from sys import intern
 from argparse import ArgumentParser
 from subprocess import Popen
 from tempfile import TemporaryFile
 
-try:
-    from functools import reduce
-except:
-    pass
-
 try:
     import cxxfilt
+    @lru_cache(maxsize = 2 ** 16)
     def cppdemangle(s):
         if not s.startswith("_Z"):
             return s
@@ -24,6 +22,7 @@ try:
             except:
                 return s
 except:
+    @lru_cache(maxsize = 2 ** 16)
     def cppdemangle(s):
         #print("running cppdemangle")
         if not s.startswith("_Z"):
@@ -33,6 +32,15 @@ except:
             return result
 
 
+# compiled once rather than for every line of disassembly
+instruction_re = re.compile(r"^\s*(?P<address>\w*):\s*(?P<opcodes>(?P<ignore>[0-9a-f][0-9a-f] )*)\s*"
+                            r"(?P<instruction>$|(?P<instruction_type>[a-z]*)\s*(?P<arguments>.*$))")
+#jump or call instruction match
+jci_re = re.compile(r"(?P<fn_address>[0-9a-f]*)\s*<(?P<fn>[^@+-]*)(?P<section>@[^+-]*)?(?P<fn_offset>[+-][^@]*)?>")
+stanza_re = re.compile("^[0-9a-f]* <")
+file_format_re = re.compile(r"(?P<so_name>.*):\s*file format\s*(?P<file_format>.*)")
+
+
 class ParserError(Exception):
     def __init__(self, _classCaller, thing, line):
         self._classCaller = _classCaller
@@ -75,6 +83,48 @@ def zip_mangled_demangled_funcs(l):
 
     return output_list
 
+def parse_call_arguments(arguments):
+    """
+    We're using this to extract some data about the arguments of a call
+    fn, a function being jumped to
+    fn_address, the address of the function being jumped to
+    fn_offset, the offset in memory of the function being jumped to
+    section, the section (as in foo@plt) the function is found in
+    returns tuple (fn_address, fn, fn_offset, section)
+    """
+    fn = None
+    fn_offset = None
+    section = None
+    fn_address = None
+    jci_parts = jci_re.match(arguments)
+
+    if jci_parts:
+        fn_address = jci_parts.group('fn_address') #offset starts at 1
+        fn = jci_parts.group('fn')
+        if jci_parts.group('section'):
+            section = jci_parts.group('section').replace("@", "")
+        if jci_parts.group('fn_offset'):
+            fn_offset = jci_parts.group('fn_offset')
+    else:
+        fn_offset = arguments
+        fn = "PTR_ARGS"
+        #print ("args: couldn't match *" + arguments + "*")
+
+    return (fn_address, fn, fn_offset, section)
+
+def call_target(inst):
+    """
+    The function an instruction calls, without parsing the rest of it.
+    Most instructions aren't calls, so they're turned away before any regex runs.
+    returns the function name, "PTR_ARGS" for an indirect call, or None if inst isn't a call
+    """
+    if "call" not in inst:
+        return None
+    match = instruction_re.match(inst)
+    if not match or not match.group("instruction_type") or "call" not in match.group("instruction_type"):
+        return None
+    return parse_call_arguments(match.group("arguments"))[1]
+
 class AssemblyInstruction:
     """
     The parsing of an instruction like this
@@ -84,15 +134,15 @@ class AssemblyInstruction:
     or this
     46fe:       90                      nop
     """
+    __slots__ = ("inst_str", "address", "opcodes", "instruction_type", "arguments",
+                 "fn_address", "fn", "fn_offset", "section")
 
     def __init__(self, inst):
-        #The regular expression to match
-        instruction_match = r"^\s*(?P<address>\w*):\s*(?P<opcodes>(?P<ignore>[0-9a-f][0-9a-f] )*)\s*" \
-                            r"(?P<instruction>$|(?P<instruction_type>[a-z]*)\s*(?P<arguments>.*$))"
-        instruction_re = re.compile(instruction_match)
-
         self.inst_str = inst
-        #print (inst)
+        self.fn_address = None
+        self.fn = None
+        self.fn_offset = None
+        self.section = None
 
         match = instruction_re.match(inst)
 
@@ -114,46 +164,7 @@ class AssemblyInstruction:
             self.instruction_type = match.group("instruction_type")
         self.arguments = match.group("arguments")
 
-        def parse_call_arguments(arguments):
-            """
-            We're using this to extract some data about the arguments
-            arg1, the first argument, maybe a register, literal, etc
-            arg2, the second argument, may not exist or same as arg1
-            arg1_calc, the equation (as a string), which calculates an offset of arg1's register/value
-            arg2_calc, the equation (as a string), which calculates an offset of arg2's register/value
-            fn, a function being jumped to
-            fn_offset, the offset in memory of the function being jumped to
-            """
-            fn = None
-            fn_offset = None
-            section = None
-            fn_address = None
-            #print(arguments)
-            jci_string = r"(?P<fn_address>[0-9a-f]*)\s*<(?P<fn>[^@+-]*)(?P<section>@[^+-]*)?(?P<fn_offset>[+-][^@]*)?>" #jump or call instruction match
-            jci_re = re.compile(jci_string)
-            jci_parts = jci_re.match(arguments)
-
-            if jci_parts:
-                fn_address = jci_parts.group('fn_address') #offset starts at 1
-                #print(fn_address)
-                fn = jci_parts.group('fn')
-                #print(fn)
-                if jci_parts.group('section'):
-                    section = jci_parts.group('section').replace("@", "")
-                    #print(section)
-                if jci_parts.group('fn_offset'):
-                    fn_offset = jci_parts.group('fn_offset')
-                    #print(fn_offset)
-            else:
-                fn_offset = arguments
-                fn = "PTR_ARGS"
-                #print ("args: couldn't match *" + arguments + "*")
-
-            return (fn_address, fn, fn_offset, section)
-        #print(self.arguments)
         if "call" in self.instruction_type:
-            #print (self.arguments)
-            #print ( parse_call_arguments(self.arguments))
             self.fn_address, self.fn, self.fn_offset, self.section = parse_call_arguments(self.arguments)
 
     def print_stats(self):
@@ -187,7 +198,14 @@ class AssemblyFunction:
         4424:       ff a3 0c 01 00 00       jmp    *0x10c(%ebx)
         442a:       68 00 02 00 00          push   $0x200
         442f:       e9 e0 fb ff ff          jmp    4014 <_init+0x30>
+
+    Only the call instructions are kept, as the lines objdump printed for them.
+    They're parsed into AssemblyInstructions when grab_call_instructions()
+    asks for them.
     """
+    __slots__ = ("received_instruction", "function_name", "long_name", "callInstructions",
+                 "call_lines", "last_line")
+
     def __init__(self, first_instruction):
         #We begin this class by parsing the first part of the stanza
         # 00004014 <__errno_location@plt-0x10>:
@@ -195,39 +213,45 @@ class AssemblyFunction:
         self.received_instruction = first_instruction
         try:
             self.function_name = "".join([x for x in parts[1] if x not in ("<", ">", ":")])
-            #print(1, self.function_name)
             self.function_name = self.function_name.split("@", 1)[0]
-            #print(2, self.function_name)
             if self.function_name.find("-0x") != -1:
                 self.function_name = self.function_name[:self.function_name.find("-0x")] #Remove offsets
 
-            #print(3, self.function_name)
             if self.function_name.find("+0x") != -1:
                 self.function_name = self.function_name[:self.function_name.find("+0x")]
 
-            #print(4, self.function_name)
-            self.assemblyInstructions = []
+            self.function_name = intern(self.function_name)
             self.callInstructions = set()
+            self.call_lines = []
+            self.last_line = None
             
             self.long_name = cppdemangle(self.function_name)
         except Exception as e:
             print(first_instruction)
             print(parts)
             raise e
-            
+
+    @property
+    def stanzaEnd(self):
+        if self.last_line is None:
+            return None
+        return AssemblyInstruction(self.last_line).address
 
     def add_instruction(self, s):
-        new_inst = AssemblyInstruction(s)
-        self.stanzaEnd = new_inst.address
-        if "call" in new_inst.instruction_type and new_inst.fn != "PTR_ARGS":
-            self.callInstructions.add(new_inst.fn)
+        self.last_line = s
+        fn = call_target(s)
+        if fn is None:
+            return
 
-        self.assemblyInstructions.append(new_inst)
+        self.call_lines.append(s)
+        if fn != "PTR_ARGS":
+            # the same few functions get called from everywhere
+            self.callInstructions.add(intern(fn))
 
     def grab_call_instructions(self, fn = None):
-        return [x for x in self.assemblyInstructions
-                if "call" in x.instruction_type
-                and x.fn != None
+        call_instructions = [AssemblyInstruction(x) for x in self.call_lines]
+        return [x for x in call_instructions
+                if x.fn != None
                 and self.function_name not in x.fn]
 
     def print_stats(self, limit=0):
@@ -259,44 +283,29 @@ class AssemblySection:
         44ea:       68 60 02 00 00          push   $0x260
         44ef:       e9 20 fb ff ff          jmp    4014 <_init+0x30>
     """
-    def __init__(self, name, instructionList):
-        def stanza_start(s):
-            stanza_start_str = "^[0-9a-f]* <"
-            stanza_re = re.compile(stanza_start_str)
-            return stanza_re.match(s)
+    __slots__ = ("section_name", "function_dict", "cur_function")
 
+    def __init__(self, name, instructionList = ()):
+        self.section_name = name
         self.function_dict = {}
-        #print("instruction list is:")
-        #print(instructionList)
-
-        def process_instruction_list(stanza_list, next_instruction):
-            if not next_instruction:
-                #print("returning")
-                return stanza_list
-            elif stanza_start(next_instruction):
-                #Make a new AssemblyFunction and add this to the end of the list
-                #print("examining a stanza start")
-                #print(next_instruction)
-                if stanza_list:
-                    func_name = stanza_list.pop(0)
-                    self.function_dict[func_name] = stanza_list.pop()
-                stanza_list = []
-                next_func = AssemblyFunction(next_instruction)
-                stanza_list.append(next_func.function_name)
-                stanza_list.append(next_func)
-            else:
-                try:
-                    #print("adding a new instruction")
-                    stanza_list[-1].add_instruction(next_instruction)
-                    #print(stanza_list)
-                except Exception as e:
-                    print (stanza_list)
-                    print (next_instruction)
-                    raise e
-            return stanza_list
+        self.cur_function = None
+        for instruction in instructionList:
+            self.add_line(instruction)
 
-        self.section_name = name
-        reduce(process_instruction_list, instructionList, [])
+    def add_line(self, line):
+        """
+        Add a line of the section's disassembly, which either starts a new
+        function or is an instruction of the current one.
+        """
+        if not line:
+            return
+        elif stanza_re.match(line):
+            self.cur_function = AssemblyFunction(line)
+            self.function_dict[self.cur_function.function_name] = self.cur_function
+        elif self.cur_function is not None:
+            self.cur_function.add_instruction(line)
+        else:
+            raise ParserError(type(self).__name__, "instruction outside of a function", line)
 
     def merge_section(self, new_section):
         #A function to merge two sections if they are only different in their offsets
@@ -357,65 +366,83 @@ class AssemblyRaw:
 
     """
 
-    def __init__(self, filename = None, text = None):
-        self.raw_text = None
+    def __init__(self, filename = None, text = None, incremental = False):
+        """
+        Either parse a whole disassembly (from filename or text) right away, or,
+        with incremental set, wait for lines to be handed over through feed()
+        as they arrive and build the defined functions once finish() is called.
+        """
+        self.disassembly_name = None
+        self.file_format = None
+        self.sections = {}
+        self.defined_functions = {}
+
+        self.cur_section = None
+        self.lines_fed = 0
+
+        if incremental:
+            return
+
         if filename:
             with open(filename, 'r') as disassembly_file:
-                self.raw_text = disassembly_file.read()
+                for line in disassembly_file:
+                    self.feed(line.rstrip("\n"))
         elif text:
-            self.raw_text = text
+            for line in text.splitlines():
+                self.feed(line)
+
+        self.finish()
 
-        if not self.raw_text:
+    def feed(self, line):
+        """
+        Parse a single line of "objdump -d" output.
+        """
+        self.lines_fed += 1
+        if not line:
+            return
+        elif "..." in line:
+            return
+        elif "file format" in line:
+            if (self.disassembly_name or self.file_format):
+                raise ParserError(type(self).__name__, "file format", line)
+            else:
+                # Expecting this format
+                # liberrdefs.so:     file format elf32-i386
+                match = file_format_re.match(line)
+                self.disassembly_name = path.basename(match.group('so_name'))
+                self.file_format = match.group('file_format')
+        elif "Disassembly of section " in line:
+            if self.cur_section is not None:
+                #looks like we hit the end of a section, add it to the list
+                section_name = self.cur_section.section_name
+                if section_name in self.sections:
+                    print(("Adding pre-existing section", section_name))
+                self.sections[section_name] = self.cur_section
+
+            #Expecting line like this:
+            #"Disassembly of section .plt:"
+            self.cur_section = AssemblySection(line.split().pop().replace(":", ""))
+        elif self.cur_section is not None:
+            self.cur_section.add_line(line)
+
+    def finish(self):
+        """
+        Close the last section and generate the defined functions.
+        """
+        if not self.lines_fed:
             raise ParserError("AssemblyRaw", "raw_text", "No raw text")
-        else:
-            self.disassembly_name = None
-            self.file_format = None
-            self.sections = {}
-
-            cur_section = None
-            instruction_list = []
-
-            for line in self.raw_text.splitlines():
-                if not line:
-                    continue
-                elif "..." in line:
-                    continue
-                elif "file format" in line:
-                    if (self.disassembly_name or self.file_format):
-                        raise ParserError(type(self).__name__, "file format", line)
-                    else:
-                        # Expecting this format
-                        # liberrdefs.so:     file format elf32-i386
-                        match_string = r"(?P<so_name>.*):\s*file format\s*(?P<file_format>.*)"
-                        match = re.match(match_string, line)
-                        self.disassembly_name = path.basename(match.group('so_name'))
-                        self.file_format = match.group('file_format')
-                elif "Disassembly of section " in line:
-                    if cur_section:
-                        #looks like we hit the end of a section, create a
-                        #SectionCollection Object and add it to the list
-                        new_section = AssemblySection(cur_section, instruction_list)
-                        section_name = new_section.section_name
-                        if section_name in self.sections:
-                            print(("Adding pre-existing section", section_name))
-                        self.sections[section_name] = new_section
-
-                    #Expecting line like this:
-                    #"Disassembly of section .plt:"
-                    cur_section = line.split().pop().replace(":", "")
-                    instruction_list = []
-                else:
-                    instruction_list.append(line)
-            if cur_section:
-                #Create the assembly collection for the last section
-                new_section = AssemblySection(cur_section, instruction_list)
-                section_name = new_section.section_name
-                try:
-                    self.sections[section_name].merge_section(new_section)
-                    print("added pre-existing section")
-                except:
-                    #More likely
-                    self.sections[section_name] = new_section
+
+        if self.cur_section is not None:
+            #Add the last section
+            section_name = self.cur_section.section_name
+            try:
+                self.sections[section_name].merge_section(self.cur_section)
+                print("added pre-existing section")
+            except:
+                #More likely
+                self.sections[section_name] = self.cur_section
+        self.cur_section = None
+
         #Now generate defined functions
         self.defined_functions = {}
 
@@ -435,7 +462,7 @@ class AssemblyRaw:
         print(("File format: %s" % self.file_format))
         print(("Number of sections: %d" % len(self.sections)))
         count = 0
-        for section in self.sections:
+        for section in self.sections.values():
             if limit != 0 and count > limit:
                 break
             section.print_stats(limit = 2*limit)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+async_runner keeps a bounded number of external tools (readelf, objdump,
+rpm2cpio/cpio) running at once from a single event loop. It's used by the
+async engine of rpm_db_builder, where one process drives many tool runs
+instead of waiting on them one at a time.
+"""
+import asyncio
+from os import pipe, close
+from subprocess import DEVNULL
+
+# objdump lines for heavily templated C++ symbols can get very long
+STREAM_LINE_LIMIT = 2 ** 22
+
+# how much of an rpm given as bytes is written to rpm2cpio before waiting for it to catch up
+FEED_CHUNK = 2 ** 20
+
+
+class AsyncCommandRunner:
+    def __init__(self, limit):
+        '''
+        @param
+        limit       the number of subprocesses allowed to run concurrently
+        '''
+        if limit <= 0:
+            raise Exception("AsyncCommandRunner needs a subprocess limit greater than zero.")
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.commands_run = 0
+
+    async def stream(self, args, line_handler, cwd = None):
+        '''
+        Run a command and hand every line of its stdout to line_handler as it
+        arrives, so the output never has to be held as one big string.
+
+        @param
+        args            the command as a list (no shell involved)
+        line_handler    a callable taking a single decoded line without the newline
+        cwd             the working directory for the command
+
+        @return
+        the return code of the command
+        '''
+        async with self.semaphore:
+            proc = await asyncio.create_subprocess_exec(*args, stdout = asyncio.subprocess.PIPE, stderr = DEVNULL,
+                                                        cwd = cwd, limit = STREAM_LINE_LIMIT)
+            async for raw_line in proc.stdout:
+                line_handler(raw_line.decode("utf-8", "replace").rstrip("\n"))
+            self.commands_run += 1
+            return await proc.wait()
+
+    async def extract_rpm(self, rpm_path, dest, members_file = None, rpm_data = None):
+        '''
+        Unpack an rpm into dest with rpm2cpio piped into cpio, without a
+        temporary file in between.
+
+        @param
+        members_file    a file of cpio patterns, one per line. Only the matching members are unpacked.
+        rpm_data        the rpm itself (any bytes-like object), written to rpm2cpio's stdin. rpm_path is then "-".
+
+        @return
+        tuple (rpm2cpio return code, cpio return code)
+        '''
+        cpio_args = ["-idm", "--no-preserve-owner"]
+        if members_file:
+            cpio_args += ["-E", members_file]
+        return await self.rpm2cpio(rpm_path, cpio_args, cwd = dest, rpm_data = rpm_data)
+
+    async def list_rpm(self, rpm_path, line_handler, rpm_data = None):
+        '''
+        Hand every line of "cpio -itv" for the rpm's payload to line_handler.
+
+        @return
+        tuple (rpm2cpio return code, cpio return code)
+        '''
+        return await self.rpm2cpio(rpm_path, ["-itv"], line_handler = line_handler, rpm_data = rpm_data)
+
+    async def feed(self, stdin, data):
+        '''
+        Write data to a subprocess's stdin a chunk at a time, then close it.
+        Slicing a memoryview copies nothing, so a mapped rpm isn't copied out of the mapping first.
+        '''
+        data = memoryview(data)
+        try:
+            for start in range(0, len(data), FEED_CHUNK):
+                stdin.write(data[start:start + FEED_CHUNK])
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # the subprocess stopped reading, its return code tells why
+            pass
+        finally:
+            stdin.close()
+
+    async def rpm2cpio(self, rpm_path, cpio_args, cwd = None, line_handler = None, rpm_data = None):
+        '''
+        Run rpm2cpio piped into cpio with the given arguments. The stdout of
+        cpio goes to line_handler if there is one. rpm2cpio reads rpm_data
+        from its stdin when it's given.
+        '''
+        async with self.semaphore:
+            read_fd, write_fd = pipe()
+            feeding = None
+            try:
+                rpm2cpio = await asyncio.create_subprocess_exec("rpm2cpio", rpm_path, stdout = write_fd, stderr = DEVNULL,
+                                                                stdin = None if rpm_data is None else asyncio.subprocess.PIPE)
+                if rpm_data is not None:
+                    feeding = asyncio.ensure_future(self.feed(rpm2cpio.stdin, rpm_data))
+                cpio = await asyncio.create_subprocess_exec("cpio", *cpio_args, stdin = read_fd,
+                                                            stdout = asyncio.subprocess.PIPE if line_handler else DEVNULL,
+                                                            stderr = DEVNULL, cwd = cwd, limit = STREAM_LINE_LIMIT)
+            finally:
+                # the children hold their own copies of the pipe now
+                close(read_fd)
+                close(write_fd)
+            if line_handler:
+                async for raw_line in cpio.stdout:
+                    line_handler(raw_line.decode("utf-8", "replace").rstrip("\n"))
+            if feeding:
+                await feeding
+            self.commands_run += 2
+            return (await rpm2cpio.wait(), await cpio.wait())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+A multiprocessing queue bounded by the size of what's in it rather than by
+the number of items. Producers block in put() while the queue (including
+items the consumer has taken but not released yet) holds more than the byte
+budget, so a slow consumer can't make finished results pile up in memory.
+"""
+import multiprocessing
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+
+
+class ByteBudgetQueue:
+    def __init__(self, budget, ctx = multiprocessing):
+        '''
+        @param
+        budget      the number of (pickled) bytes allowed in flight
+        ctx         the multiprocessing context the processes sharing the queue are started with
+        '''
+        self.budget = budget
+        self.queue = ctx.Queue()
+        self.condition = ctx.Condition()
+        # only touched while holding the condition
+        self.in_flight = ctx.RawValue("q", 0)
+
+    def put(self, obj):
+        '''
+        Queue obj, blocking while that would take the queue over its budget.
+        An item bigger than the whole budget goes through once the queue is drained.
+        '''
+        data = dumps(obj, HIGHEST_PROTOCOL)
+        size = len(data)
+        with self.condition:
+            while self.in_flight.value and self.in_flight.value + size > self.budget:
+                self.condition.wait()
+            self.in_flight.value += size
+        self.queue.put(data)
+
+    def get(self, block = True, timeout = None):
+        '''
+        Take the next item. Its bytes keep counting against the budget until
+        they're handed back with release(), which lets the consumer hold on to
+        items it hasn't finished with yet.
+
+        @return
+        tuple (item, size to release)
+        '''
+        data = self.queue.get(block, timeout)
+        return loads(data), len(data)
+
+    def release(self, size):
+        with self.condition:
+            self.in_flight.value -= size
+            self.condition.notify_all()
+
+    def bytes_in_flight(self):
+        with self.condition:
+            return self.in_flight.value
@@ -3,13 +3,20 @@
 import re
 import os
 import sys
+import copy
+import time
 import shutil
 import pathlib
 import argparse
+import multiprocessing
+from queue import Queue as ThreadQueue
+from threading import Thread
 
 import iso_parser
 import rpm_db_builder
 import rpm_uploader
+import rpm_store
+import iso_fingerprint
 from lib import *
 
 def search_iso_under_dir(dir_path):
@@ -113,6 +120,182 @@ def validate_args_with_metadata(args, metadata_dir):
             
     return args
 
+def zero_extract(args):
+    '''
+    Whether the rpms are read straight out of the iso instead of being extracted first.
+    parser.py hands wrapper() its own args, without the switch.
+    '''
+    return getattr(args, "zero_extract", False)
+
+def extract_patterns(args):
+    '''
+    The files to extract from an iso: with --zero-extract only the metadata
+    '''
+    return ["metadata.xml"] if zero_extract(args) else iso_parser.DEFAULT_PATTERNS
+
+def store_for(args):
+    '''
+    The rpm store given with --rpm-store, which the rpms of every iso are linked from, or None
+    '''
+    directory = getattr(args, "rpm_store", None)
+    return rpm_store.RpmStore(directory) if directory else None
+
+def call(target, *args, **kwargs):
+    '''
+    Run a step in this process.
+
+    @return
+    0, as the exit code of a step that didn't raise
+    '''
+    target(*args, **kwargs)
+    return 0
+
+def call_in_process(target, *args, **kwargs):
+    '''
+    Run a step in a child process, so steps for several isos can run at once:
+    rpm_db_builder keeps its settings in module globals, and terminal_msg(0) exits.
+
+    The stages call this from threads of their own, and a child forked from a process with
+    threads may start with a lock one of the other threads held. The children are forked
+    from a forkserver instead, which has no threads, so target and args have to pickle.
+
+    @return
+    the exit code of the child process
+    '''
+    p = multiprocessing.get_context("forkserver").Process(target = target, args = args, kwargs = kwargs)
+    p.start()
+    p.join()
+    return p.exitcode
+
+def extract_step(args, run = call, in_progress = None):
+    '''
+    Extract args.iso into args.rpm_output_dir, unless an identical iso (by its fingerprint,
+    under any file name) has been ingested before.
+
+    @param
+    run             call or call_in_process
+    in_progress     dict of fingerprint -> iso, for the isos of a batch. An iso identical to one
+                    earlier in the batch is skipped too, though that one isn't in the database yet.
+
+    @return
+    args updated from the metadata of the iso, or None if the iso was skipped as a duplicate of args.already_ingested
+    '''
+    args.already_ingested = None
+    args.fingerprint = iso_fingerprint.fingerprint(args.iso)
+    if not getattr(args, "reingest", False):
+        args.already_ingested = iso_fingerprint.ingested_as(args.fingerprint)
+        if args.already_ingested:
+            terminal_msg(2, "{} is identical to the iso ingested as {} {}, skipping it.".format(args.iso, *args.already_ingested))
+            return None
+        if in_progress is not None:
+            first = in_progress.setdefault(args.fingerprint[FINGERPRINT], args.iso)
+            if first != args.iso:
+                terminal_msg(2, "{} is identical to {}, skipping it.".format(args.iso, first))
+                return None
+
+    # extract iso
+    if run(iso_parser.iso_process, args.iso, args.rpm_output_dir, extract_patterns(args), store = store_for(args)) != 0:
+        raise Exception("Extracting {} failed.".format(args.iso))
+
+    # validate product/version with information provided in metadata
+    return validate_args_with_metadata(args, args.rpm_output_dir)
+
+def build_step(args, run = call):
+    '''
+    Examine the rpms of the extracted iso into JSON files in args.build_output_dir, and/or the database with --db-sink
+    '''
+    if run(rpm_db_builder.run, args.rpm_output_dir, args.build_worker_dir, args.build_output_dir, args.product_name,
+           args.version_number, args.processes, source_iso = args.iso if zero_extract(args) else None,
+           database_sink = getattr(args, "db_sink", False), write_json = not getattr(args, "no_json", False)) != 0:
+        raise Exception("Examining the rpms of {} failed.".format(args.iso))
+    return args
+
+def upload_step(args, run = call):
+    '''
+    Insert the JSON files into the database, and register the iso's fingerprint.
+    With --db-sink the rpms went into the database as they were examined.
+
+    The fingerprint is only registered once the upload is known to have gone in: a failed
+    upload raises (or exits non-zero in a child process), so the iso is tried again next time.
+    '''
+    if not getattr(args, "db_sink", False):
+        if run(rpm_uploader.upload, args.build_output_dir, bulk = getattr(args, "bulk_upload", False),
+               jobs = getattr(args, "shard_jobs", 1)) != 0:
+            raise Exception("Uploading {} failed.".format(args.iso))
+
+    # so a copy of the iso under another name is recognized
+    iso_fingerprint.register(args.fingerprint, os.path.basename(args.iso), args.product_name, args.version_number)
+    return args
+
+def ingest_iso(args, rpm_output_dir, build_worker_dir, build_output_dir):
+    '''
+    Extract args.iso, examine its rpms and upload the results, one step after the other.
+
+    @return
+    args, updated from the metadata of the iso. args.already_ingested is the (product, version)
+    the iso was skipped as a duplicate of, or None.
+    '''
+    args.rpm_output_dir = rpm_output_dir
+    args.build_worker_dir = build_worker_dir
+    args.build_output_dir = build_output_dir
+
+    if extract_step(args):
+        build_step(args)
+        upload_step(args)
+    return args
+
+def run_stages(items, stages, queue_depth):
+    '''
+    Pass items through a pipeline of stages, where the next item can be in one stage
+    while the one before it is in the next.
+
+    @param
+    items           the args of each iso, for the first stage
+    stages          list of (name, function, jobs). function takes an item and returns it for the
+                    next stage, or None to drop it. Up to jobs items are in the stage at once.
+    queue_depth     the most items left waiting for each stage. An earlier stage stops when it's this far ahead.
+
+    @return
+    list of (stage name, item, exception) for the items a stage failed on
+    '''
+    done = object()
+    queues = [ThreadQueue(maxsize = max(1, queue_depth)) for _ in stages] + [None]
+    failures = []
+
+    def stage_worker(index):
+        name, function, _ = stages[index]
+        while True:
+            item = queues[index].get()
+            if item is done:
+                # for the other threads of the stage
+                queues[index].put(done)
+                return
+            start = time.time()
+            try:
+                item_out = function(item)
+            except (Exception, SystemExit) as e:
+                failures.append((name, item, e))
+                item_out = None
+            terminal_msg(2, "{} {} took {:.1f} seconds".format(name, item.iso, time.time() - start))
+            if item_out is not None and queues[index + 1] is not None:
+                queues[index + 1].put(item_out)
+
+    threads = []
+    for index, (_, _, jobs) in enumerate(stages):
+        threads.append([Thread(target = stage_worker, args = (index,), daemon = True) for _ in range(max(1, jobs))])
+        for t in threads[-1]:
+            t.start()
+
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(done)
+    for index, stage_threads in enumerate(threads):
+        for t in stage_threads:
+            t.join()
+        if queues[index + 1] is not None:
+            queues[index + 1].put(done)
+    return failures
+
 def wrapper(args, option = 1):
     '''
     The wrapper to automate the steps from collecting necessary information from user and iso file, validating input, 
@@ -124,6 +307,9 @@ def wrapper(args, option = 1):
                                     2 ) fixed path lookup under the established directory structure of mount (@ Aug 6th, 2019)
     '''
     
+    # set by ingest_iso() when an iso turns out to be a duplicate
+    args.already_ingested = None
+
     # can do directory form validating (e.g., allow only / or \\)
     # directory formatting (unify format, remove trailing slashes)
     args.output_directory = utility.dir_formatting(args.output_directory)
@@ -151,34 +337,30 @@ def wrapper(args, option = 1):
         if args.directory:
             # retrieve list of isos that needs to be processed.
             iso_list = search_iso_under_dir(args.directory)
+            isos = []
 
             for iso in iso_list:
-                # init iso_args first
-                iso_args = None
-
-                # inherit properties from args
-                iso_args = args
+                # inherit properties from args, a copy for each iso since they're processed at the same time
+                iso_args = copy.copy(args)
                 iso_args.iso = args.directory + "/" + iso
 
                 # update product and version in args to real name 
                 iso_args = real_name_lookup(iso_args, option)
 
                 # append prod/vers extracted from iso filename to the output directories to make them unique. (These may be different from metdata if filename tampered, but an alert will raise) 
-                iso_rpm_output_dir = rpm_output_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
-                iso_build_worker_dir = build_worker_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
-                iso_build_output_dir = build_output_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
-
-                # extract iso
-                iso_parser.iso_process(iso_args.iso, iso_rpm_output_dir)
-
-                # validate product/version with information provided in metadata
-                iso_args = validate_args_with_metadata(iso_args, iso_rpm_output_dir)
-                
-                # build data structure
-                rpm_db_builder.run(iso_rpm_output_dir, iso_build_worker_dir, iso_build_output_dir, iso_args.product_name, iso_args.version_number, iso_args.processes)
-
-                # insert into database 
-                rpm_uploader.upload(iso_build_output_dir)
+                iso_args.rpm_output_dir = rpm_output_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
+                iso_args.build_worker_dir = build_worker_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
+                iso_args.build_output_dir = build_output_dir + "-" + iso_args.product_name + "-" + iso_args.version_number
+                isos.append(iso_args)
+
+            # iso N+1 is extracted while iso N is examined and iso N-1 uploaded
+            in_progress = {}
+            failures = run_stages(isos, [("Extracting", lambda a: extract_step(a, call_in_process, in_progress), args.extract_jobs),
+                                         ("Examining", lambda a: build_step(a, call_in_process), args.build_jobs),
+                                         ("Uploading", lambda a: upload_step(a, call_in_process), args.upload_jobs)],
+                                  args.queue_depth)
+            for stage, iso_args, e in failures:
+                terminal_msg(1, "{} {} failed, it was left out: {}".format(stage, iso_args.iso, e))
 
         elif args.iso:
             # update product and version in args to real name 
@@ -186,17 +368,8 @@ def wrapper(args, option = 1):
 
             # check if iso exists in file system and its suffix
             if os.path.exists(args.iso) and os.path.isfile(args.iso) and os.path.splitext(args.iso)[-1].lower() == ".iso":
-                # extract iso
-                iso_parser.iso_process(args.iso, rpm_output_dir)
-
-                # validate product/version with information provided in metadata
-                args = validate_args_with_metadata(args, rpm_output_dir)
-                
-                # build data structure
-                rpm_db_builder.run(rpm_output_dir, build_worker_dir, build_output_dir, args.product_name, args.version_number, args.processes)
-
-                # insert into database 
-                rpm_uploader.upload(build_output_dir)
+                # extract, examine and upload the iso
+                args = ingest_iso(args, rpm_output_dir, build_worker_dir, build_output_dir)
 
             else:
                 terminal_msg(0, "An invalid path or file has been assigned for ISO.")
@@ -218,17 +391,8 @@ def wrapper(args, option = 1):
             args.iso = get_mount_path(args.mount, args.product_name, args.version_number)
 
             if args.iso:
-                # extract iso
-                iso_parser.iso_process(args.iso, rpm_output_dir)
-
-                # validate product/version with information provided in metadata
-                args = validate_args_with_metadata(args, rpm_output_dir)
-                
-                # build data structure
-                rpm_db_builder.run(rpm_output_dir, build_worker_dir, build_output_dir, args.product_name, args.version_number, args.processes)
-
-                # insert into database 
-                rpm_uploader.upload(build_output_dir)
+                # extract, examine and upload the iso
+                args = ingest_iso(args, rpm_output_dir, build_worker_dir, build_output_dir)
             
             else:
                 terminal_msg(2, "{} {} skipped due to no iso found under the correlated mount path.".format(args.product_name, args.version_number))
@@ -285,6 +449,14 @@ if __name__ == "__main__":
     p.add_argument("-pc", "--processes", metavar="<amount>", type=int, default=5,
                     help = "The number of processes to spawn that can be utilized to examine rpm files. " + \
                         "(default 10, suggested threshold x where x <= how many GBs of RAM available)")
+    p.add_argument("-ej", "--extract-jobs", metavar="<amount>", type=int, default=1,
+                    help = "With -d, the number of isos extracted at once.")
+    p.add_argument("-bj", "--build-jobs", metavar="<amount>", type=int, default=1,
+                    help = "With -d, the number of isos whose rpms are examined at once, each with -pc processes.")
+    p.add_argument("-uj", "--upload-jobs", metavar="<amount>", type=int, default=1,
+                    help = "With -d, the number of isos uploaded to the database at once.")
+    p.add_argument("-qd", "--queue-depth", metavar="<amount>", type=int, default=1,
+                    help = "With -d, the most isos waiting between one step and the next. Extracting stops when it gets this far ahead.")
     p.add_argument("-o", "--output-directory", metavar = "<path>", type = str, default = "./output/",
                     help = "A directory to place the output. <cwd>/output is created if not specified.")
 
@@ -297,6 +469,21 @@ if __name__ == "__main__":
     p.add_argument("-v", "--version-number", metavar = "<x.x.x.x-#.#.#>", type = str,
                     help = "The version number, including the release number, of the product to examine. MUST be specified when -m switch is set.")
                    
+    p.add_argument("-z", "--zero-extract", action = "store_true",
+                   help = "Examine the rpms where they are in the iso instead of extracting them to the output directory first.")
+    p.add_argument("-s", "--rpm-store", metavar = "<path>", type = str,
+                   help = "Keep a single copy of each rpm in this directory, however many isos it's on, and link the rpms of each iso to it. " + \
+                          "Best on the same filesystem as the output directory, so they can be hardlinks.")
+    p.add_argument("-b", "--bulk-upload", action = "store_true",
+                   help = "Upload the rows with COPY instead of inserting them one at a time.")
+    p.add_argument("-ds", "--db-sink", action = "store_true",
+                   help = "Add the rpms to the database as they're examined, instead of uploading the JSON files after.")
+    p.add_argument("-nj", "--no-json", action = "store_true",
+                   help = "With --db-sink, don't write the JSON files as well.")
+    p.add_argument("-sj", "--shard-jobs", metavar="<amount>", type=int, default=1,
+                   help = "The number of JSON files of an iso uploaded at once, each over a connection of its own.")
+    p.add_argument("-r", "--reingest", action = "store_true",
+                   help = "Process the iso even if one identical to it (by its fingerprint, whatever its name) has been ingested before.")
     p.add_argument("-c", "--clean-output-directory", action = "store_true",
                    help = "Cleanup the output directory before writing to it.")
     p.add_argument("-w", "--wipe-program-output", action = "store_true",
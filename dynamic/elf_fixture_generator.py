@@ -0,0 +1,834 @@
+#!/usr/bin/env python3
+"""
+elf_fixture_generator writes made-up ELF executables and shared libraries,
+32 or 64-bit, without a compiler or linker. They have what rpm_db_builder
+looks at: NEEDED, SONAME and RPATH/RUNPATH entries, versioned dynamic
+symbols, a GNU build-id and functions that really call each other. Packages
+of them are written as directory trees, cpio archives or rpms, so the whole
+builder can be run (and benchmarked) on a corpus of any size and shape
+without the rpms of a real product.
+
+The rpms have the lead, signature header, header and gzipped cpio payload
+of a real rpm, with the file list in the header, but they aren't signed.
+The rpms of a corpus can also be put on an ISO 9660 image with Rock Ridge
+names, like a product ISO.
+"""
+import os
+import re
+from os import path
+import gzip
+import random
+import hashlib
+import time
+from stat import S_IFLNK, S_IFREG
+from struct import pack
+from collections import defaultdict, namedtuple
+from argparse import ArgumentParser
+
+from lib import *
+
+
+# A function in the object. calls are the names of the functions it calls,
+# which have to be in the same object. A local function is only in .symtab,
+# like a static function. hidden makes version a non-default version (foo@V
+# rather than foo@@V).
+Function = namedtuple("Function", ["name", "calls", "version", "hidden", "local"],
+                      defaults = ((), None, False, False))
+# A function imported from library, at version if one is given
+Import = namedtuple("Import", ["name", "library", "version"], defaults = (None,))
+
+# ELF constants
+ET_EXEC = 2
+ET_DYN = 3
+EM_386 = 3
+EM_X86_64 = 62
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_HASH = 5
+SHT_DYNAMIC = 6
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERNEED = 0x6ffffffe
+SHT_GNU_VERSYM = 0x6fffffff
+SHF_WRITE = 1
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_FUNC = 2
+SHN_UNDEF = 0
+DT_NULL = 0
+DT_NEEDED = 1
+DT_HASH = 4
+DT_STRTAB = 5
+DT_SYMTAB = 6
+DT_STRSZ = 10
+DT_SYMENT = 11
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+DT_VERSYM = 0x6ffffff0
+DT_VERDEF = 0x6ffffffc
+DT_VERDEFNUM = 0x6ffffffd
+DT_VERNEED = 0x6ffffffe
+DT_VERNEEDNUM = 0x6fffffff
+NT_GNU_BUILD_ID = 3
+VER_FLG_BASE = 1
+VERSYM_HIDDEN = 0x8000
+
+INTERPRETERS = {32: "/lib/ld-linux.so.2", 64: "/lib64/ld-linux-x86-64.so.2"}
+LIBRARY_DIRS = {32: "/usr/lib", 64: "/usr/lib64"}
+RPM_ARCHES = {32: "i686", 64: "x86_64"}
+GLIBC_VERSIONS = {32: "GLIBC_2.0", 64: "GLIBC_2.2.5"}
+
+# rpm header tags and types
+RPM_INT16 = 3
+RPM_INT32 = 4
+RPM_STRING = 6
+RPM_BIN = 7
+RPM_STRING_ARRAY = 8
+RPM_I18NSTRING = 9
+RPMTAG_HEADERSIGNATURES = 62
+RPMTAG_HEADERIMMUTABLE = 63
+RPMSIGTAG_SIZE = 1000
+RPMSIGTAG_MD5 = 1004
+RPMSIGTAG_PAYLOADSIZE = 1007
+RPMSIGTAG_SHA256 = 273
+
+# ISO 9660
+ISO_SECTOR = 2048
+ISO_FIRST_DESCRIPTOR = 16
+ISO_FLAG_DIRECTORY = 2
+
+def elf_hash(name):
+    h = 0
+    for c in name.encode():
+        h = ((h << 4) + c) & 0xffffffff
+        g = h & 0xf0000000
+        if g:
+            h ^= g >> 24
+        h &= ~g & 0xffffffff
+    return h
+
+
+def align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class StringTable:
+    def __init__(self):
+        self.data = bytearray(b"\0")
+        self.offsets = {"": 0}
+
+    def add(self, s):
+        if s not in self.offsets:
+            self.offsets[s] = len(self.data)
+            self.data += s.encode() + b"\0"
+        return self.offsets[s]
+
+
+class Section:
+    def __init__(self, name, sh_type, flags, data, link = None, info = 0, alignment = 1, entsize = 0):
+        '''
+        @param
+        data        the contents, or for sections filled in once the layout is known, their size
+        link        the name of the section this one links to
+        '''
+        self.name = name
+        self.sh_type = sh_type
+        self.flags = flags
+        self.data = data if not isinstance(data, int) else bytes(data)
+        self.link = link
+        self.info = info
+        self.alignment = alignment
+        self.entsize = entsize
+        self.offset = 0
+        self.addr = 0
+
+
+def build_elf(functions, bits = 64, executable = False, soname = None, needed = (), rpath = None,
+              runpath = None, imports = (), build_id = None, strip = False):
+    '''
+    Put together an ELF file for x86 (32-bit) or x86-64.
+
+    @param
+    functions   Functions making up .text. The global ones are exported as dynamic symbols.
+    executable  an executable (ET_EXEC, with an interpreter) rather than a shared object
+    needed      names for NEEDED entries. Libraries imports come from are added.
+    imports     Imports, undefined dynamic symbols
+    build_id    20 bytes for the GNU build-id note, made up from the contents if not given
+    strip       leave out .symtab, so local functions have no name
+
+    @return
+    the file's contents as bytes
+    '''
+    if bits not in (32, 64):
+        raise ValueError("bits has to be 32 or 64, not %s" % str(bits))
+    addr_fmt = "Q" if bits == 64 else "I"
+    word = bits // 8
+    base = (0x400000 if bits == 64 else 0x8048000) if executable else 0
+    sym_size = 24 if bits == 64 else 16
+    dyn_size = 16 if bits == 64 else 8
+
+    names = set(f.name for f in functions)
+    for f in functions:
+        for callee in f.calls:
+            if callee not in names:
+                raise ValueError("%s calls %s, which isn't one of the functions" % (f.name, callee))
+
+    needed = list(needed)
+    for imp in imports:
+        if imp.library not in needed:
+            needed.append(imp.library)
+
+    dynstr = StringTable()
+    for library in needed:
+        dynstr.add(library)
+    for s in (soname, rpath, runpath):
+        if s:
+            dynstr.add(s)
+
+    # version indexes 0 and 1 are local and global, the versions this file
+    # defines come next and the versions it needs from other files after them
+    defined_versions = []
+    for f in functions:
+        if f.version and not f.local and f.version not in defined_versions:
+            defined_versions.append(f.version)
+    version_index = dict((v, i + 2) for i, v in enumerate(defined_versions))
+    needed_versions = {}
+    for imp in imports:
+        if imp.version and imp.version not in needed_versions.setdefault(imp.library, []):
+            needed_versions[imp.library].append(imp.version)
+    needed_index = {}
+    for library in needed:
+        for v in needed_versions.get(library, []):
+            needed_index[(library, v)] = len(version_index) + len(needed_index) + 2
+
+    # .dynsym: the imports, then what's exported
+    exported = [f for f in functions if not f.local]
+    dynamic_symbols = [None] + list(imports) + exported
+    for s in dynamic_symbols[1:]:
+        dynstr.add(s.name)
+
+    versym = bytearray(pack("<H", 0))
+    for imp in imports:
+        versym += pack("<H", needed_index.get((imp.library, imp.version), 1))
+    for f in exported:
+        index = version_index.get(f.version, 1)
+        if f.version and f.hidden:
+            index |= VERSYM_HIDDEN
+        versym += pack("<H", index)
+
+    verdef = bytearray()
+    if defined_versions:
+        definitions = [(soname or "fixture", VER_FLG_BASE)] + [(v, 0) for v in defined_versions]
+        for n, (name, flags) in enumerate(definitions):
+            last = n == len(definitions) - 1
+            verdef += pack("<HHHHIII", 1, flags, n + 1, 1, elf_hash(name), 20, 0 if last else 28)
+            verdef += pack("<II", dynstr.add(name), 0)
+
+    verneed = bytearray()
+    libraries = [library for library in needed if library in needed_versions]
+    for n, library in enumerate(libraries):
+        versions = needed_versions[library]
+        last = n == len(libraries) - 1
+        verneed += pack("<HHIII", 1, len(versions), dynstr.add(library), 16, 0 if last else 16 + 16 * len(versions))
+        for m, v in enumerate(versions):
+            verneed += pack("<IHHII", elf_hash(v), 0, needed_index[(library, v)], dynstr.add(v),
+                            0 if m == len(versions) - 1 else 16)
+
+    nbucket = max(1, len(dynamic_symbols) // 2)
+    buckets = [0] * nbucket
+    chains = [0] * len(dynamic_symbols)
+    for i, s in enumerate(dynamic_symbols[1:], 1):
+        h = elf_hash(s.name) % nbucket
+        chains[i] = buckets[h]
+        buckets[h] = i
+    hash_data = pack("<%dI" % (2 + nbucket + len(chains)), nbucket, len(chains), *(buckets + chains))
+
+    dynamic = [(DT_NEEDED, dynstr.add(library)) for library in needed]
+    if soname:
+        dynamic.append((DT_SONAME, dynstr.add(soname)))
+    if rpath:
+        dynamic.append((DT_RPATH, dynstr.add(rpath)))
+    if runpath:
+        dynamic.append((DT_RUNPATH, dynstr.add(runpath)))
+    # the rest point at sections, their values are filled in below
+    dynamic += [(DT_HASH, ".hash"), (DT_STRTAB, ".dynstr"), (DT_SYMTAB, ".dynsym"),
+                (DT_STRSZ, len(dynstr.data)), (DT_SYMENT, sym_size), (DT_VERSYM, ".gnu.version")]
+    if verdef:
+        dynamic += [(DT_VERDEF, ".gnu.version_d"), (DT_VERDEFNUM, len(defined_versions) + 1)]
+    if verneed:
+        dynamic += [(DT_VERNEED, ".gnu.version_r"), (DT_VERNEEDNUM, len(libraries))]
+    dynamic.append((DT_NULL, 0))
+
+    # lay out .text
+    prologue = b"\x55\x48\x89\xe5" if bits == 64 else b"\x55\x89\xe5"
+    function_offsets = []
+    text_size = 0
+    for f in functions:
+        text_size = align(text_size, 16)
+        function_offsets.append(text_size)
+        text_size += len(prologue) + 5 * len(f.calls) + 2
+
+    symtab_functions = [f for f in functions if f.local] + [f for f in functions if not f.local]
+    strtab = StringTable()
+    for f in symtab_functions:
+        strtab.add(f.name)
+
+    sections = [Section("", 0, 0, b"")]
+    if executable:
+        sections.append(Section(".interp", SHT_PROGBITS, SHF_ALLOC, INTERPRETERS[bits].encode() + b"\0"))
+    sections.append(Section(".note.gnu.build-id", SHT_NOTE, SHF_ALLOC, 36, alignment = 4))
+    sections.append(Section(".hash", SHT_HASH, SHF_ALLOC, hash_data, ".dynsym", alignment = word, entsize = 4))
+    sections.append(Section(".dynsym", SHT_DYNSYM, SHF_ALLOC, sym_size * len(dynamic_symbols), ".dynstr", 1,
+                            alignment = word, entsize = sym_size))
+    sections.append(Section(".dynstr", SHT_STRTAB, SHF_ALLOC, bytes(dynstr.data)))
+    sections.append(Section(".gnu.version", SHT_GNU_VERSYM, SHF_ALLOC, bytes(versym), ".dynsym", alignment = 2,
+                            entsize = 2))
+    if verdef:
+        sections.append(Section(".gnu.version_d", SHT_GNU_VERDEF, SHF_ALLOC, bytes(verdef), ".dynstr",
+                                len(defined_versions) + 1, alignment = word))
+    if verneed:
+        sections.append(Section(".gnu.version_r", SHT_GNU_VERNEED, SHF_ALLOC, bytes(verneed), ".dynstr",
+                                len(libraries), alignment = word))
+    sections.append(Section(".text", SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, text_size, alignment = 16))
+    sections.append(Section(".dynamic", SHT_DYNAMIC, SHF_ALLOC | SHF_WRITE, dyn_size * len(dynamic), ".dynstr",
+                            alignment = word, entsize = dyn_size))
+    if not strip:
+        sections.append(Section(".symtab", SHT_SYMTAB, 0, sym_size * (1 + len(symtab_functions)), ".strtab",
+                                1 + len([f for f in functions if f.local]), alignment = word, entsize = sym_size))
+        sections.append(Section(".strtab", SHT_STRTAB, 0, bytes(strtab.data)))
+    shstrtab = StringTable()
+    for s in sections:
+        shstrtab.add(s.name)
+    shstrtab.add(".shstrtab")
+    sections.append(Section(".shstrtab", SHT_STRTAB, 0, bytes(shstrtab.data)))
+    by_name = dict((s.name, s) for s in sections)
+    section_index = dict((s.name, n) for n, s in enumerate(sections))
+
+    phdr_count = 3 + (1 if executable else 0)
+    ehdr_size = 64 if bits == 64 else 52
+    phdr_size = 56 if bits == 64 else 32
+    shdr_size = 64 if bits == 64 else 40
+    offset = ehdr_size + phdr_count * phdr_size
+    for s in sections[1:]:
+        offset = align(offset, s.alignment)
+        s.offset = offset
+        if s.flags & SHF_ALLOC:
+            s.addr = base + offset
+        offset += len(s.data)
+    load_end = max(s.offset + len(s.data) for s in sections if s.flags & SHF_ALLOC)
+    shoff = align(offset, word)
+
+    # now that addresses are known, fill in what depends on them
+    text = by_name[".text"]
+    addresses = {}
+    for f, function_offset in zip(functions, function_offsets):
+        addresses.setdefault(f.name, text.addr + function_offset)
+    code = bytearray()
+    for f, function_offset in zip(functions, function_offsets):
+        code += b"\x90" * (function_offset - len(code))
+        address = text.addr + function_offset
+        code += prologue
+        for callee in f.calls:
+            code += b"\xe8" + pack("<i", addresses[callee] - (address + len(code) - function_offset + 5))
+        code += b"\x5d\xc3"
+    text.data = bytes(code)
+
+    def symbol(name_offset, info, shndx, value, size):
+        if bits == 64:
+            return pack("<IBBHQQ", name_offset, info, 0, shndx, value, size)
+        return pack("<IIIBBH", name_offset, value, size, info, 0, shndx)
+
+    function_size = dict((f.name, len(prologue) + 5 * len(f.calls) + 2) for f in functions)
+    text_index = section_index[".text"]
+    dynsym = bytearray(symbol(0, 0, 0, 0, 0))
+    for imp in imports:
+        dynsym += symbol(dynstr.add(imp.name), (STB_GLOBAL << 4) | STT_FUNC, SHN_UNDEF, 0, 0)
+    for f in exported:
+        dynsym += symbol(dynstr.add(f.name), (STB_GLOBAL << 4) | STT_FUNC, text_index, addresses[f.name],
+                         function_size[f.name])
+    by_name[".dynsym"].data = bytes(dynsym)
+
+    if not strip:
+        symtab = bytearray(symbol(0, 0, 0, 0, 0))
+        for f in symtab_functions:
+            binding = STB_LOCAL if f.local else STB_GLOBAL
+            symtab += symbol(strtab.add(f.name), (binding << 4) | STT_FUNC, text_index, addresses[f.name],
+                             function_size[f.name])
+        by_name[".symtab"].data = bytes(symtab)
+
+    dynamic_data = bytearray()
+    for tag, value in dynamic:
+        if isinstance(value, str):
+            value = by_name[value].addr
+        dynamic_data += pack("<q" + addr_fmt if bits == 64 else "<i" + addr_fmt, tag, value)
+    by_name[".dynamic"].data = bytes(dynamic_data)
+
+    if build_id is None:
+        build_id = hashlib.sha1(b"".join(s.data for s in sections)).digest()
+    by_name[".note.gnu.build-id"].data = pack("<III", 4, len(build_id), NT_GNU_BUILD_ID) + b"GNU\0" + build_id
+
+    for s in sections[1:]:
+        if isinstance(s.data, bytearray):
+            s.data = bytes(s.data)
+
+    def program_header(p_type, flags, offset, addr, size, alignment):
+        if bits == 64:
+            return pack("<IIQQQQQQ", p_type, flags, offset, addr, addr, size, size, alignment)
+        return pack("<IIIIIIII", p_type, offset, addr, addr, size, size, flags, alignment)
+
+    phdrs = bytearray()
+    if executable:
+        interp = by_name[".interp"]
+        phdrs += program_header(PT_INTERP, 4, interp.offset, interp.addr, len(interp.data), 1)
+    phdrs += program_header(PT_LOAD, 7, 0, base, load_end, 0x1000)
+    dynamic_section = by_name[".dynamic"]
+    phdrs += program_header(PT_DYNAMIC, 6, dynamic_section.offset, dynamic_section.addr,
+                            len(dynamic_section.data), word)
+    note = by_name[".note.gnu.build-id"]
+    phdrs += program_header(PT_NOTE, 4, note.offset, note.addr, len(note.data), 4)
+
+    entry = 0
+    if executable and functions:
+        entry = addresses.get("main", addresses[functions[0].name])
+    ident = b"\x7fELF" + bytes([2 if bits == 64 else 1, 1, 1, 0]) + bytes(8)
+    machine = EM_X86_64 if bits == 64 else EM_386
+    ehdr = pack("<16sHHI" + addr_fmt * 3 + "IHHHHHH", ident, ET_EXEC if executable else ET_DYN, machine, 1,
+                entry, ehdr_size, shoff, 0, ehdr_size, phdr_size, phdr_count, shdr_size, len(sections),
+                section_index[".shstrtab"])
+
+    out = bytearray(ehdr + phdrs)
+    for s in sections[1:]:
+        out += bytes(s.offset - len(out))
+        out += s.data
+    out += bytes(shoff - len(out))
+    for s in sections:
+        link = section_index[s.link] if s.link else 0
+        out += pack("<II" + addr_fmt * 4 + "II" + addr_fmt * 2, shstrtab.add(s.name), s.sh_type, s.flags, s.addr,
+                    s.offset, len(s.data), link, s.info, s.alignment if s.name else 0, s.entsize)
+    return bytes(out)
+
+
+def library_functions(rng, prefix, count, versions, calls, static_fraction):
+    '''
+    Make up the functions of a library. They're spread over versions (the
+    first ones in the oldest), every 50th one also keeps a hidden older
+    version, and static_fraction of them are local.
+    '''
+    names = ["%s_fn%d" % (prefix, n) for n in range(count)]
+    functions = []
+    for n, name in enumerate(names):
+        callees = tuple(rng.choice(names) for _ in range(calls)) if count > 1 else ()
+        local = rng.random() < static_fraction
+        version = versions[n * len(versions) // count] if versions else None
+        functions.append(Function(name, callees, version, False, local))
+        if not local and version and version != versions[0] and n % 50 == 0:
+            functions.append(Function(name, (), versions[0], True))
+    return functions
+
+
+def generate_package(rng, name, bits = 64, libraries = 2, executables = 2, symbols = 1000, calls = 3,
+                     static_fraction = 0.1, strip = False):
+    '''
+    Make up the files of a package: libraries with a symlink for their
+    soname, each needing the one before it, and executables using them all.
+
+    @return
+    {install path: (contents as bytes, mode) for a file or link target string for a symlink}
+    '''
+    files = {}
+    lib_dir = LIBRARY_DIRS[bits]
+    libc = Import("malloc", "libc.so.6", GLIBC_VERSIONS[bits])
+    exported = []
+    for n in range(libraries):
+        prefix = "%s_%d" % (name.replace("-", "_"), n)
+        soname = "lib%s.so.1" % prefix
+        versions = ["%s_1.0" % prefix.upper(), "%s_1.1" % prefix.upper(), "%s_2.0" % prefix.upper()]
+        functions = library_functions(rng, prefix, symbols, versions, calls, static_fraction)
+        imports = [libc] + exported[-8:]
+        build_id = hashlib.sha1(("%s/%s" % (name, soname)).encode()).digest()
+        files[path.join(lib_dir, soname + ".0")] = (build_elf(functions, bits, soname = soname, imports = imports,
+                                                              build_id = build_id, strip = strip), 0o755)
+        files[path.join(lib_dir, soname)] = soname + ".0"
+        exported = [Import(f.name, soname, f.version) for f in functions if not f.local and not f.hidden]
+
+    for n in range(executables):
+        executable = "%s-%d" % (name, n)
+        helpers = ["helper_%d" % m for m in range(max(1, symbols // 20))]
+        functions = [Function("main", tuple(rng.choice(helpers) for _ in range(calls)))]
+        functions += [Function(h, tuple(rng.choice(helpers) for _ in range(calls)), local = True) for h in helpers]
+        imports = [libc] + rng.sample(exported, min(len(exported), 16))
+        build_id = hashlib.sha1(("%s/%s" % (name, executable)).encode()).digest()
+        files["/usr/bin/" + executable] = (build_elf(functions, bits, executable = True, imports = imports,
+                                                     runpath = "$ORIGIN/..%s" % lib_dir[len("/usr"):],
+                                                     build_id = build_id, strip = strip), 0o755)
+    return files
+
+
+def write_tree(root, files):
+    '''
+    Write the files of a package under root
+    '''
+    for install_path, contents in sorted(files.items()):
+        full_path = path.join(root, install_path.lstrip("/"))
+        if not path.isdir(path.dirname(full_path)):
+            os.makedirs(path.dirname(full_path))
+        if isinstance(contents, str):
+            os.symlink(contents, full_path)
+        else:
+            with open(full_path, "wb") as f:
+                f.write(contents[0])
+            os.chmod(full_path, contents[1])
+
+
+def cpio_archive(files, mtime = 0):
+    '''
+    @return
+    the files of a package as a cpio archive in the "newc" format, which is what rpms carry
+    '''
+    out = bytearray()
+
+    def member(name, mode, data, ino, nlink = 1):
+        name = name.encode() + b"\0"
+        fields = (ino, mode, 0, 0, nlink, mtime, len(data), 0, 0, 0, 0, len(name), 0)
+        out.extend(b"070701" + "".join("%08x" % field for field in fields).encode() + name)
+        out.extend(bytes(align(len(out), 4) - len(out)))
+        out.extend(data)
+        out.extend(bytes(align(len(out), 4) - len(out)))
+
+    for ino, (install_path, contents) in enumerate(sorted(files.items()), 1):
+        if isinstance(contents, str):
+            member("." + install_path, S_IFLNK | 0o777, contents.encode(), ino)
+        else:
+            member("." + install_path, S_IFREG | contents[1], contents[0], ino)
+    member("TRAILER!!!", 0, b"", 0)
+    return bytes(out)
+
+
+def rpm_header(entries, region_tag):
+    '''
+    @param
+    entries     (tag, type, value) tuples, value being a string, a list of strings or ints, or bytes
+    region_tag  the tag of the region the entries are in
+
+    @return
+    the header structure holding the entries
+    '''
+    index = []
+    store = bytearray()
+    for tag, tag_type, value in sorted(entries, key = lambda e: e[0]):
+        if tag_type in (RPM_STRING, RPM_I18NSTRING):
+            data, count = value.encode() + b"\0", 1
+        elif tag_type == RPM_STRING_ARRAY:
+            data, count = b"".join(v.encode() + b"\0" for v in value), len(value)
+        elif tag_type == RPM_INT32:
+            store.extend(bytes(align(len(store), 4) - len(store)))
+            data, count = pack(">%di" % len(value), *value), len(value)
+        elif tag_type == RPM_INT16:
+            store.extend(bytes(align(len(store), 2) - len(store)))
+            data, count = pack(">%dH" % len(value), *value), len(value)
+        else:
+            data, count = value, len(value)
+        index.append(pack(">iiii", tag, tag_type, len(store), count))
+        store.extend(data)
+
+    entry_count = len(index) + 1
+    region = pack(">iiii", region_tag, RPM_BIN, len(store), 16)
+    store.extend(pack(">iiii", region_tag, RPM_BIN, -16 * entry_count, 16))
+    return b"\x8e\xad\xe8\x01\0\0\0\0" + pack(">ii", entry_count, len(store)) + region + b"".join(index) + bytes(store)
+
+
+def rpm_package(name, version, release, arch, files, mtime = 0):
+    '''
+    @return
+    an rpm of the files
+    '''
+    payload = cpio_archive(files, mtime)
+    installed = sorted(files.items())
+    dirs = sorted(set(path.dirname(p) + "/" for p, _ in installed))
+    sizes = [0 if isinstance(c, str) else len(c[0]) for _, c in installed]
+    modes = [(S_IFLNK | 0o777) if isinstance(c, str) else (S_IFREG | c[1]) for _, c in installed]
+    digests = ["" if isinstance(c, str) else hashlib.sha256(c[0]).hexdigest() for _, c in installed]
+    count = len(installed)
+
+    header = rpm_header([(1000, RPM_STRING, name),
+                         (1001, RPM_STRING, version),
+                         (1002, RPM_STRING, release),
+                         (1004, RPM_I18NSTRING, "Generated fixture package"),
+                         (1005, RPM_I18NSTRING, "Made-up ELF files for exercising rpm_db_builder."),
+                         (1006, RPM_INT32, [mtime]),
+                         (1009, RPM_INT32, [sum(sizes)]),
+                         (1014, RPM_STRING, "MIT"),
+                         (1016, RPM_I18NSTRING, "Development/Tools"),
+                         (1021, RPM_STRING, "linux"),
+                         (1022, RPM_STRING, arch),
+                         (1028, RPM_INT32, sizes),
+                         (1030, RPM_INT16, modes),
+                         (1033, RPM_INT16, [0] * count),
+                         (1034, RPM_INT32, [mtime] * count),
+                         (1035, RPM_STRING_ARRAY, digests),
+                         (1036, RPM_STRING_ARRAY, [c if isinstance(c, str) else "" for _, c in installed]),
+                         (1037, RPM_INT32, [0] * count),
+                         (1039, RPM_STRING_ARRAY, ["root"] * count),
+                         (1040, RPM_STRING_ARRAY, ["root"] * count),
+                         (1044, RPM_STRING, "%s-%s-%s.src.rpm" % (name, version, release)),
+                         (1045, RPM_INT32, [-1] * count),
+                         (1095, RPM_INT32, [1] * count),
+                         (1096, RPM_INT32, list(range(1, count + 1))),
+                         (1097, RPM_STRING_ARRAY, [""] * count),
+                         (1116, RPM_INT32, [dirs.index(path.dirname(p) + "/") for p, _ in installed]),
+                         (1117, RPM_STRING_ARRAY, [path.basename(p) for p, _ in installed]),
+                         (1118, RPM_STRING_ARRAY, dirs),
+                         (1124, RPM_STRING, "cpio"),
+                         (1125, RPM_STRING, "gzip"),
+                         (1126, RPM_STRING, "9"),
+                         (5011, RPM_INT32, [8])],
+                        RPMTAG_HEADERIMMUTABLE)
+    compressed = gzip.compress(payload, mtime = mtime)
+
+    signature = rpm_header([(RPMSIGTAG_SHA256, RPM_STRING, hashlib.sha256(header).hexdigest()),
+                            (RPMSIGTAG_SIZE, RPM_INT32, [len(header) + len(compressed)]),
+                            (RPMSIGTAG_MD5, RPM_BIN, hashlib.md5(header + compressed).digest()),
+                            (RPMSIGTAG_PAYLOADSIZE, RPM_INT32, [len(payload)])],
+                           RPMTAG_HEADERSIGNATURES)
+    signature += bytes(align(len(signature), 8) - len(signature))
+
+    lead_name = ("%s-%s-%s" % (name, version, release)).encode()[:65]
+    lead = pack(">4sBBhh66shh16s", b"\xed\xab\xee\xdb", 3, 0, 0, 1, lead_name, 1, 5, bytes(16))
+    return lead + signature + header + compressed
+
+def both_endian(value, size = 4):
+    fmt = "I" if size == 4 else "H"
+    return pack("<" + fmt, value) + pack(">" + fmt, value)
+
+
+def iso_identifier(name, taken, directory):
+    '''
+    A level 1 ISO 9660 identifier (8.3 upper case d-characters) for name,
+    unique among the identifiers taken in its directory
+    '''
+    stem, ext = name, ""
+    if not directory and "." in name.strip("."):
+        stem, ext = name.rsplit(".", 1)
+    stem = re.sub("[^A-Z0-9_]", "_", stem.upper()) or "_"
+    ext = re.sub("[^A-Z0-9_]", "_", ext.upper())[:3]
+
+    n = 0
+    candidate = stem[:8]
+    while True:
+        identifier = candidate if directory else "%s.%s;1" % (candidate, ext)
+        if identifier not in taken:
+            taken.add(identifier)
+            return identifier.encode()
+        n += 1
+        candidate = stem[:8 - len(str(n))] + str(n)
+
+
+def iso_record(identifier, extent, size, directory, system_use = b"", mtime = 0):
+    '''
+    @return
+    a directory record. They are padded to an even length, and so that the system use area starts at an even offset.
+    '''
+    pad = b"" if len(identifier) % 2 else b"\0"
+    system_use += bytes(len(system_use) % 2)
+    t = time.gmtime(mtime)
+    date = pack("7B", t.tm_year - 1900, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, 0)
+    length = 33 + len(identifier) + len(pad) + len(system_use)
+    return pack("<BB", length, 0) + both_endian(extent) + both_endian(size) + date + \
+           pack("<BBB", ISO_FLAG_DIRECTORY if directory else 0, 0, 0) + both_endian(1, 2) + \
+           pack("<B", len(identifier)) + identifier + pad + system_use
+
+
+def rock_ridge_entries(name, mode, nlinks = 1):
+    '''
+    The Rock Ridge NM (the real name) and PX (mode) entries of a directory record
+    '''
+    entries = b"PX" + pack("<BB", 36, 1) + both_endian(mode) + both_endian(nlinks) + both_endian(0) + both_endian(0)
+    if name is not None:
+        name = name.encode()
+        entries += b"NM" + pack("<BBB", 5 + len(name), 1, 0) + name
+    return entries
+
+
+def iso_image(files, volume_id = "FIXTURES", mtime = 0):
+    '''
+    An ISO 9660 image of files, with Rock Ridge names so they keep the names
+    they have rather than 8.3 upper case ones
+
+    @param
+    files       dict of path in the image -> contents as bytes
+
+    @return
+    the image as bytes
+    '''
+    root = {}
+    for image_path, contents in files.items():
+        parts = image_path.strip("/").split("/")
+        directory = root
+        for part in parts[:-1]:
+            directory = directory.setdefault(part, {})
+        directory[parts[-1]] = contents
+
+    # Directories in path table order (breadth first) as (identifier, contents,
+    # number of the parent directory counting from 1), and the children of each
+    # as (identifier, name, contents, number of the directory if it is one)
+    directories = [(b"\0", root, 1)]
+    children = []
+    for i, (_, contents, _) in enumerate(directories):
+        taken = set()
+        entries = []
+        for identifier, name, c in sorted((iso_identifier(name, taken, isinstance(c, dict)), name, c)
+                                          for name, c in contents.items()):
+            if isinstance(c, dict):
+                directories.append((identifier, c, i + 1))
+                entries.append((identifier, name, c, len(directories) - 1))
+            else:
+                entries.append((identifier, name, c, None))
+        children.append(entries)
+
+    # The root's own record says SUSP, with Rock Ridge, is in use
+    root_system_use = b"SP" + pack("<BB", 7, 1) + b"\xbe\xef\0" + \
+                      b"ER" + pack("<BBBBBB", 18, 1, 10, 0, 0, 1) + b"RRIP_1991A"
+
+    def directory_extent(i, extents):
+        # a record can't cross into the next sector
+        out = bytearray()
+        own_use = (root_system_use if i == 0 else b"") + rock_ridge_entries(None, 0o40755, 2)
+        records = [iso_record(b"\0", *extents[i], True, own_use, mtime),
+                   iso_record(b"\1", *extents[directories[i][2] - 1], True, rock_ridge_entries(None, 0o40755, 2), mtime)]
+        for identifier, name, c, d in children[i]:
+            if d is not None:
+                records.append(iso_record(identifier, *extents[d], True, rock_ridge_entries(name, 0o40755, 2), mtime))
+            else:
+                records.append(iso_record(identifier, *extents[(i, identifier)], False, rock_ridge_entries(name, 0o100644), mtime))
+        for record in records:
+            if len(out) // ISO_SECTOR != (len(out) + len(record) - 1) // ISO_SECTOR:
+                out.extend(bytes(align(len(out), ISO_SECTOR) - len(out)))
+            out.extend(record)
+        out.extend(bytes(align(len(out), ISO_SECTOR) - len(out)))
+        return bytes(out)
+
+    def path_table(extents, byteorder):
+        out = bytearray()
+        for i, (identifier, _, parent) in enumerate(directories):
+            out.extend(pack(byteorder + "BBIH", len(identifier), 0, extents[i][0], parent) + identifier)
+            out.extend(bytes(len(identifier) % 2))
+        return bytes(out)
+
+    # Records are the same length wherever they point, so the sizes are
+    # worked out with every extent at 0 before the extents are placed
+    placeholder = defaultdict(lambda: (0, 0))
+    path_table_size = len(path_table(placeholder, "<"))
+    path_table_sectors = align(path_table_size, ISO_SECTOR) // ISO_SECTOR
+
+    extents = {}
+    sector = ISO_FIRST_DESCRIPTOR + 2 + 2 * path_table_sectors
+    for i in range(len(directories)):
+        size = len(directory_extent(i, placeholder))
+        extents[i] = (sector, size)
+        sector += size // ISO_SECTOR
+    for i in range(len(directories)):
+        for identifier, _, c, d in children[i]:
+            if d is None:
+                extents[(i, identifier)] = (sector, len(c))
+                sector += align(len(c), ISO_SECTOR) // ISO_SECTOR
+
+    pvd = pack("<B5sBB", 1, b"CD001", 1, 0) + b" " * 32 + volume_id.upper().encode()[:32].ljust(32) + bytes(8) + \
+          both_endian(sector) + bytes(32) + both_endian(1, 2) + both_endian(1, 2) + both_endian(ISO_SECTOR, 2) + \
+          both_endian(path_table_size) + pack("<II", ISO_FIRST_DESCRIPTOR + 2, 0) + \
+          pack(">II", ISO_FIRST_DESCRIPTOR + 2 + path_table_sectors, 0) + \
+          iso_record(b"\0", *extents[0], True, mtime = mtime) + b" " * (4 * 128 + 3 * 37) + \
+          (b"0" * 16 + b"\0") * 4 + pack("<B", 1)
+    terminator = pack("<B5sB", 255, b"CD001", 1)
+
+    image = bytearray(ISO_FIRST_DESCRIPTOR * ISO_SECTOR)
+    for block in [pvd, terminator, path_table(extents, "<"), path_table(extents, ">")] + \
+                 [directory_extent(i, extents) for i in range(len(directories))] + \
+                 [c for i in range(len(directories)) for _, _, c, d in children[i] if d is None]:
+        image.extend(block)
+        image.extend(bytes(align(len(image), ISO_SECTOR) - len(image)))
+    return bytes(image)
+
+
+def generate_corpus(output_directory, packages = 10, output_format = "rpm", seed = 0, bits = 64, iso_files = None,
+                    **package_args):
+    '''
+    Write packages made up by generate_package to output_directory
+
+    @param
+    output_format   rpm, cpio (one archive per package), tree (one directory per package) or
+                    iso (the rpms in Packages/ on fixtures.iso)
+    iso_files       with the iso format, more files to put on the image, as a dict of path -> bytes
+    package_args    passed on to generate_package
+
+    @return
+    the number of files written into the packages
+    '''
+    rng = random.Random(seed)
+    if not path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    file_count = 0
+    image_files = dict(iso_files or {})
+    for n in range(packages):
+        name = "fixture%d" % n
+        files = generate_package(rng, name, bits, **package_args)
+        file_count += len(files)
+        nvr = "%s-1.0-1.el7" % name
+        rpm_name = "%s.%s.rpm" % (nvr, RPM_ARCHES[bits])
+        if output_format == "tree":
+            write_tree(path.join(output_directory, nvr), files)
+        elif output_format == "cpio":
+            with open(path.join(output_directory, nvr + ".cpio"), "wb") as f:
+                f.write(cpio_archive(files))
+        elif output_format == "iso":
+            image_files["Packages/" + rpm_name] = rpm_package(name, "1.0", "1.el7", RPM_ARCHES[bits], files)
+        else:
+            with open(path.join(output_directory, rpm_name), "wb") as f:
+                f.write(rpm_package(name, "1.0", "1.el7", RPM_ARCHES[bits], files))
+
+    if output_format == "iso":
+        with open(path.join(output_directory, "fixtures.iso"), "wb") as f:
+            f.write(iso_image(image_files))
+    return file_count
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-o", "--output_directory", type=str, required=True,
+                   help="The directory the packages are written to.")
+    p.add_argument("-n", "--packages", type=int, default=10,
+                   help="The number of packages.")
+    p.add_argument("-l", "--libraries", type=int, default=2,
+                   help="The number of shared libraries in each package.")
+    p.add_argument("-e", "--executables", type=int, default=2,
+                   help="The number of executables in each package.")
+    p.add_argument("-s", "--symbols", type=int, default=1000,
+                   help="The number of functions in each library.")
+    p.add_argument("-c", "--calls", type=int, default=3,
+                   help="The number of calls each function makes.")
+    p.add_argument("-t", "--static-fraction", type=float, default=0.1,
+                   help="The fraction of library functions that are static (local).")
+    p.add_argument("-b", "--bits", type=int, choices=[32, 64], default=64,
+                   help="Write 32-bit (i686) or 64-bit (x86_64) ELF files.")
+    p.add_argument("-f", "--format", type=str, choices=["rpm", "cpio", "tree", "iso"], default="rpm",
+                   help="rpm: an rpm per package. cpio: a cpio archive per package. tree: a directory per package. iso: an ISO image (fixtures.iso) of the rpms.")
+    p.add_argument("-x", "--strip", action="store_true",
+                   help="Leave .symtab out of the ELF files.")
+    p.add_argument("-d", "--seed", type=int, default=0,
+                   help="Seed for making up the packages.")
+    args = p.parse_args()
+
+    file_count = generate_corpus(args.output_directory, args.packages, args.format, args.seed, args.bits,
+                                 libraries = args.libraries, executables = args.executables, symbols = args.symbols,
+                                 calls = args.calls, static_fraction = args.static_fraction, strip = args.strip)
+    terminal_msg(2, "Wrote %d packages with %d files to %s" % (args.packages, file_count, args.output_directory))
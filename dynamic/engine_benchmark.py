@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+engine_benchmark runs rpm_db_builder over the same directory of rpm files
+once per execution engine and reports the throughput of each, so the async
+engine can be compared against the multiprocessing one on the same corpus.
+"""
+import os
+import time
+from json import dumps
+from argparse import ArgumentParser
+
+import rpm_db_builder
+from lib import *
+
+
+def count_rpms(rpm_directory):
+    return sum(len([f for f in files if f.endswith("rpm")]) for _, _, files in os.walk(rpm_directory))
+
+
+def benchmark_engine(rpm_directory, work_directory, engine, processes, subprocesses, rpms_per_process):
+    '''
+    Build the JSON database for rpm_directory with the given engine.
+
+    @return
+    a dict of timings for the run
+    '''
+    worker_directory = os.path.join(work_directory, engine + "-worker")
+    output_directory = os.path.join(work_directory, engine + "-json")
+
+    wall_start = time.time()
+    cpu_start = os.times()
+    rpm_db_builder.run(rpm_directory, worker_directory, output_directory, "benchmark", engine, processes,
+                       engine, subprocesses, rpms_per_process)
+    cpu_end = os.times()
+    wall_time = time.time() - wall_start
+
+    # the workers are children of this process, so their cpu time shows up here once they've been joined
+    cpu_time = (cpu_end.children_user - cpu_start.children_user) + (cpu_end.children_system - cpu_start.children_system) + \
+               (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    output_bytes = sum(os.path.getsize(os.path.join(output_directory, f)) for f in os.listdir(output_directory))
+
+    return {"engine": engine,
+            "processes": processes,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "output_bytes": output_bytes}
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-r", "--rpm_directory", type=str, required=True,
+                   help="The root directory where RPM files will be found in subdirectories.")
+    p.add_argument("-w", "--work_directory", type=str, default="engine-benchmark",
+                   help="The directory where worker and output directories for each engine are created.")
+    p.add_argument("-p", "--processes", type=int, default=10,
+                   help="The number of worker processes for the process engine.")
+    p.add_argument("-a", "--async_processes", type=int, default=2,
+                   help="The number of event loop processes for the async engine.")
+    p.add_argument("-t", "--subprocesses", type=int, default=16,
+                   help="The number of tool subprocesses each async process keeps running.")
+    p.add_argument("-k", "--rpms-per-process", type=int, default=8,
+                   help="The number of rpms each async process examines at once.")
+    p.add_argument("-j", "--json", type=str,
+                   help="Also write the results to this file as JSON.")
+    args = p.parse_args()
+
+    if not os.path.exists(args.work_directory):
+        os.makedirs(args.work_directory)
+
+    rpm_count = count_rpms(args.rpm_directory)
+    results = [benchmark_engine(args.rpm_directory, args.work_directory, "process", args.processes, 0, 0),
+               benchmark_engine(args.rpm_directory, args.work_directory, "async", args.async_processes,
+                                args.subprocesses, args.rpms_per_process)]
+
+    for result in results:
+        result["rpms"] = rpm_count
+        result["rpms_per_second"] = rpm_count / result["wall_time"] if result["wall_time"] else 0
+        terminal_msg(2, "{engine}: {rpms} rpms in {wall_time:.1f}s wall, {cpu_time:.1f}s cpu, {rpms_per_second:.2f} rpms/s, {output_bytes} bytes of JSON".format(**result))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(dumps(results, sort_keys = True, indent = 4))
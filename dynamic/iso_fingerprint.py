@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+iso_fingerprint recognizes an iso that's been ingested before, whatever its
+file is called now, without reading all of it. The fingerprint is made of the
+iso's size, hashes of its primary volume descriptor and of metadata.xml, and a
+hash of blocks sampled evenly across the whole image. Ingested isos are kept
+in the iso_fingerprints table, with the version they were ingested as.
+"""
+import os
+import hashlib
+from json import dumps
+from argparse import ArgumentParser
+
+import iso_parser
+import rpm_store
+from lib import *
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+# ISO9660 starts its volume descriptors, the primary one first, at sector 16
+PVD_OFFSET = 16 * 2048
+PVD_SIZE = 2048
+
+# how many blocks of the image go into the sampled hash, and their size
+SAMPLES = 64
+SAMPLE_SIZE = 2 ** 16
+
+# SQL format strings
+ingested_sql = ("SELECT p.product, v.version FROM iso_fingerprints f "
+                "JOIN versions v ON f.vers_id = v.vers_id "
+                "JOIN products p ON v.prod_id = p.prod_id "
+                "WHERE f.fingerprint = %s AND v.ready;")
+
+vers_id_sql = ("SELECT v.vers_id FROM versions v "
+               "JOIN products p ON v.prod_id = p.prod_id "
+               "WHERE p.product = %s AND v.version = %s "
+               "ORDER BY v.vers_id DESC LIMIT 1;")
+
+register_sql = ("INSERT INTO iso_fingerprints "
+                "(fingerprint, vers_id, iso_name, iso_size, pvd_hash, metadata_hash, sample_hash) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (fingerprint) DO NOTHING;")
+
+
+def sampled_hash(fd, size, samples = SAMPLES, sample_size = SAMPLE_SIZE):
+    '''
+    @return
+    the sha256 hex digest of sample_size bytes at each of samples places spread
+    evenly over the file, its first and last blocks included. A small file is hashed whole.
+    '''
+    h = hashlib.sha256()
+    if size <= samples * sample_size:
+        h.update(os.pread(fd, size, 0))
+    else:
+        step = (size - sample_size) // (samples - 1)
+        for n in range(samples):
+            h.update(os.pread(fd, sample_size, n * step))
+    return h.hexdigest()
+
+
+def fingerprint(file):
+    '''
+    @param
+    file    the path to an iso
+
+    @return
+    dict of the registry columns: FINGERPRINT (which the others are combined into), ISO_SIZE,
+    PVD_HASH, METADATA_HASH (empty without a metadata.xml) and SAMPLE_HASH
+    '''
+    metadata = iso_parser.iso_extents(file, ["metadata.xml"])
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        pvd_hash = hashlib.sha256(os.pread(fd, PVD_SIZE, PVD_OFFSET)).hexdigest()
+        metadata_hash = ""
+        if metadata:
+            offset, length = metadata["metadata.xml"]
+            metadata_hash = rpm_store.extent_digest(fd, offset, length)
+        sample_hash = sampled_hash(fd, size)
+    finally:
+        os.close(fd)
+
+    combined = "%d:%s:%s:%s" % (size, pvd_hash, metadata_hash, sample_hash)
+    return {FINGERPRINT: hashlib.sha256(combined.encode("utf-8")).hexdigest(),
+            ISO_SIZE: size,
+            PVD_HASH: pvd_hash,
+            METADATA_HASH: metadata_hash,
+            SAMPLE_HASH: sample_hash}
+
+
+def connect():
+    if psycopg2 is None:
+        utility.terminal_msg(0, "Psycopg2 must be installed to use the iso fingerprint registry.")
+    return psycopg2.connect(utility.get_conn_str())
+
+
+def ingested_as(prints, conn = None):
+    '''
+    Look an iso's fingerprint up in the registry.
+
+    @param
+    prints  what fingerprint() returned for the iso
+    conn    the connection to the database, e.g. a sqlite_db stand-in. By default the database in the config.
+
+    @return
+    tuple (product, version) an identical iso was ingested as, or None
+    '''
+    close_conn = conn is None
+    if close_conn:
+        conn = connect()
+
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(ingested_sql, (prints[FINGERPRINT],))
+            row = cur.fetchone()
+
+    if close_conn:
+        conn.close()
+    return tuple(row) if row else None
+
+
+def register(prints, iso_name, product, version, conn = None):
+    '''
+    Record that the iso with these fingerprints was ingested as product and version.
+
+    @return
+    False if the version isn't in the database, so nothing could be recorded
+    '''
+    close_conn = conn is None
+    if close_conn:
+        conn = connect()
+
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(vers_id_sql, (product, version))
+            row = cur.fetchone()
+            if row:
+                cur.execute(register_sql, (prints[FINGERPRINT], row[0], iso_name, prints[ISO_SIZE],
+                                           prints[PVD_HASH], prints[METADATA_HASH], prints[SAMPLE_HASH]))
+
+    if close_conn:
+        conn.close()
+    if not row:
+        utility.terminal_msg(1, "%s %s isn't in the database, the fingerprint of %s wasn't recorded." % (product, version, iso_name))
+    return bool(row)
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-i", "--iso", metavar="<ISO file>", type=str, required=True,
+                   help= "The iso to fingerprint.")
+    p.add_argument("-c", "--check", action="store_true",
+                   help= "Also look the iso up in the registry of ingested isos.")
+
+    args = p.parse_args()
+
+    prints = fingerprint(args.iso)
+    print(dumps(prints, sort_keys = True, indent = 4))
+    if args.check:
+        ingested = ingested_as(prints)
+        if ingested:
+            utility.terminal_msg(2, "Ingested before as %s %s" % ingested)
+        else:
+            utility.terminal_msg(2, "Not ingested before")
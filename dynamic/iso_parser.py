@@ -2,51 +2,168 @@
 
 import os
 import sys
+import time
+import errno
+import fnmatch
 import isoparser
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 
+import rpm_store
 from lib import *
 
 
 __doc__ = "A tool to extract rpm files from a given iso."
 
-def rpm_extract(r, d):
-    '''
-    Iterate over the iso object, extract and write all files into the output directory.
+# the most copied in one call, so no call holds on to a thread (or, reading, memory) for long
+CHUNK_SIZE = 8 * (2 ** 20)
+
+# what the rest of the pipeline reads from an iso
+DEFAULT_PATTERNS = ["*.rpm", "metadata.xml"]
+
+# errors meaning the kernel or filesystem can't do this kind of copy, rather than that the copy failed
+UNSUPPORTED_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
 
+
+def file_filter(patterns):
+    '''
     @param
-    r       an entry in the file hierarchy (may be a file or a directory)
-    d       the path that will be used for storing extracted rpms 
+    patterns    shell patterns (*.rpm) matched against file names, or None for every file
+
+    @return
+    a function telling whether a file name is wanted
+    '''
+    if patterns is None:
+        return lambda name: True
+    return lambda name: any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def rpm_extract(r, d, wanted, block_size, found):
     '''
-    #debug
-    #print(r.name)
+    Iterate over the iso object, and list the wanted files found for extraction into the output directory.
+    Nothing is read from the files here, only the directory records.
 
+    @param
+    r           an entry in the file hierarchy (may be a file or a directory)
+    d           the path that will be used for storing extracted rpms
+    wanted      a function of the file name, telling whether to extract the file
+    block_size  the logical block size of the iso, which the locations of files are counted in
+    found       dict of output path -> (offset in the iso, length), that the wanted files are added to
+    '''
     # when encounter a directory
     if r.is_directory:
         # extract all files in subdirectory
         for x in r.children:
-            rpm_extract(x, d)
+            rpm_extract(x, d, wanted, block_size, found)
     # when encounter a file
     else:
         # UTF-8 decode for the new filename
-        with open(os.path.join(d, r.name.decode('utf-8')), 'wb') as rpm:
-            rpm.write(r.content)
+        name = r.name.decode('utf-8')
+        if wanted(name):
+            found[os.path.join(d, name)] = (r.location * block_size, r.length)
+
+
+def copy_file_range_chunk(iso_fd, out_fd, offset, count):
+    return os.copy_file_range(iso_fd, out_fd, count, offset)
+
+
+def sendfile_chunk(iso_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, iso_fd, offset, count)
+
+
+def pread_chunk(iso_fd, out_fd, offset, count):
+    data = memoryview(os.pread(iso_fd, count, offset))
+    written = 0
+    while written < len(data):
+        written += os.write(out_fd, data[written:])
+    return len(data)
+
 
+# tried in order until one works: copy_file_range and sendfile copy inside the kernel, pread is the fallback
+COPY_METHODS = [copy_file_range_chunk, sendfile_chunk, pread_chunk]
 
-def iso_process(file, output_dir):
+
+def copy_extent(iso_fd, offset, length, output_path):
     '''
-    Create and process an iso object on the top of the iso file given. create the output directory if not exist.
+    Copy length bytes at offset in the iso into a new file at output_path, a chunk at a time.
+    The iso's file position isn't used, so threads can share iso_fd.
+    '''
+    if os.path.lexists(output_path):
+        # left by an earlier extraction, and maybe a link into the store, which mustn't be written through
+        os.unlink(output_path)
+    out_fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        copied = 0
+        for copy in COPY_METHODS:
+            try:
+                while copied < length:
+                    n = copy(iso_fd, out_fd, offset + copied, min(CHUNK_SIZE, length - copied))
+                    if n == 0:
+                        raise IOError("The iso ends %d bytes into %s, which should be %d bytes long." % (copied, output_path, length))
+                    copied += n
+                break
+            except AttributeError:
+                # no os.copy_file_range before python 3.8
+                continue
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or copy is pread_chunk:
+                    raise
+                # carries on where the copy got to, the output's file position moved with it
+                continue
+    finally:
+        os.close(out_fd)
+
+
+def store_extent(store, iso_fd, offset, length, output_path):
+    '''
+    Like copy_extent, but the file only gets copied into store if it isn't there already,
+    and output_path is a link to the stored copy.
+
+    @return
+    tuple (the file's digest, whether it was in the store already)
+    '''
+    digest = rpm_store.extent_digest(iso_fd, offset, length)
+    stored = store.contains(digest)
+    if not stored:
+        store.add(digest, lambda tmp: copy_extent(iso_fd, offset, length, tmp))
+    store.link(digest, output_path)
+    return (digest, stored)
+
+
+def iso_extents(file, patterns = DEFAULT_PATTERNS):
+    '''
+    Find where the wanted files are in the iso, from its directory records alone.
 
     @param
     file            a string that represents path to a file
-    output_dir      the path that will be used for storing extracted rpms 
+    patterns        only files whose names match one of these shell patterns are listed; None lists everything
+
+    @return
+    dict of file name -> (offset in the iso, length)
     '''
-    # create iso object
     iso = isoparser.parse(file)
-    # get the root directory
-    root = iso.root
+    found = {}
+    rpm_extract(iso.root, "", file_filter(patterns), iso.volume_descriptors["primary"].logical_block_size, found)
+    iso.close()
+    return found
+
+
+def iso_process(file, output_dir, patterns = DEFAULT_PATTERNS, threads = 8, store = None):
+    '''
+    Create and process an iso object on the top of the iso file given. create the output directory if not exist.
 
-    # check if directory exists 
+    @param
+    file            a string that represents path to a file
+    output_dir      the path that will be used for storing extracted rpms
+    patterns        only files whose names match one of these shell patterns are extracted; None extracts everything
+    threads         the number of files copied at once
+    store           an rpm_store.RpmStore. rpms are kept there once, whichever isos they're on,
+                    and linked into output_dir.
+
+    @return
+    dict of output path -> digest, for the rpms put in the store
+    '''
+    # check if directory exists
     if not os.path.exists(output_dir):
         utility.terminal_msg(1, "Output directory not found. Attempt to create one...")
         try:
@@ -56,8 +173,36 @@ def iso_process(file, output_dir):
         except OSError as e:
             utility.terminal_msg(0, "Failed to create output directory from the given path.\n OS Error: {0}".format(e))
 
+    # find the files to extract
+    found = dict((os.path.join(output_dir, name), extent) for name, extent in iso_extents(file, patterns).items())
+
     # extract files
-    rpm_extract(root, output_dir)
+    start = time.time()
+    digests = {}
+    already_stored = 0
+    iso_fd = os.open(file, os.O_RDONLY)
+    try:
+        with ThreadPoolExecutor(max_workers = max(1, threads)) as pool:
+            copies = {}
+            for output_path, (offset, length) in sorted(found.items()):
+                if store and output_path.endswith(".rpm"):
+                    copies[output_path] = pool.submit(store_extent, store, iso_fd, offset, length, output_path)
+                else:
+                    copies[output_path] = pool.submit(copy_extent, iso_fd, offset, length, output_path)
+            for output_path, copy in copies.items():
+                stored = copy.result()
+                if stored:
+                    digests[output_path] = stored[0]
+                    already_stored += stored[1]
+    except OSError as e:
+        utility.terminal_msg(0, "Failed to extract files from {0}.\n OS Error: {1}".format(file, e))
+    finally:
+        os.close(iso_fd)
+
+    utility.terminal_msg(2, "Extracted %d files (%d bytes) in %.1f seconds" % (len(found), sum(l for _, l in found.values()), time.time() - start))
+    if store:
+        utility.terminal_msg(2, "%d of the %d rpms were in the rpm store %s already" % (already_stored, len(digests), store.directory))
+    return digests
 
 
 if __name__ == "__main__":
@@ -67,7 +212,14 @@ if __name__ == "__main__":
                    help= "The iso to be examined.")
     p.add_argument("-r", "--rpmdir", metavar="<output directory>", type=str, required=True,
                    help= "The directory where the extraced rpm files will be stored.")
+    p.add_argument("-a", "--all", action="store_true",
+                   help= "Extract every file, not only the rpms and metadata.xml.")
+    p.add_argument("-t", "--threads", type=int, default=8,
+                   help= "The number of files copied out of the iso at once.")
+    p.add_argument("-s", "--store", metavar="<store directory>", type=str,
+                   help= "Keep one copy of each rpm in this store, whichever isos it's on, and link the rpms in the output directory to it.")
 
     args = p.parse_args()
 
-    iso_process(args.iso, args.rpmdir)
+    iso_process(args.iso, args.rpmdir, None if args.all else DEFAULT_PATTERNS, args.threads,
+                rpm_store.RpmStore(args.store) if args.store else None)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+json_stream reads the JSON files rpm_db_builder writes,
+
+    { "<prod>:<vers>" :{ "<rpm>": {...}, "<rpm>": {...}, ... }}
+
+one rpm at a time, so only one rpm's data is in memory however big the file
+is. Each rpm's value is decoded with json's own raw_decode as soon as all of it
+has been read.
+"""
+from json import JSONDecoder, JSONDecodeError
+
+
+# read from the file at a time, at least. A value bigger than the buffer makes it grow.
+READ_SIZE = 2 ** 20
+
+WHITESPACE = " \t\n\r"
+
+
+class ContainerReader:
+    def __init__(self, f, read_size = READ_SIZE):
+        '''
+        Read up to the first rpm of the container.
+
+        @param
+        f           a JSON file opened for reading as text
+        read_size   characters read from f at a time, at least
+
+        name is the container's "<prod>:<vers>", or None if the file has no container
+        '''
+        self.f = f
+        self.read_size = read_size
+        self.decoder = JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.name = None
+
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        self.name = self.decode()
+        self.expect(":")
+        self.expect("{")
+
+    def read_more(self, at_least = 0):
+        '''
+        @return
+        False at the end of the file
+        '''
+        if self.eof:
+            return False
+        # drop what's been parsed already
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(self.read_size, at_least))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        '''
+        @return
+        the next character that isn't whitespace, without taking it. "" at the end of the file.
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.read_more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, character):
+        found = self.peek()
+        if found != character:
+            raise ValueError("Expected %r at character %d of the JSON, found %r" % (character, self.pos, found))
+        self.pos += 1
+
+    def decode(self):
+        '''
+        Decode the JSON value starting at the next character that isn't whitespace
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except JSONDecodeError:
+                # the value may only be cut short by the end of the buffer. Reading as much again as
+                # the buffer holds keeps the number of times it's decoded over again logarithmic.
+                if not self.read_more(len(self.buf) - self.pos):
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        '''
+        Yield tuple (rpm, rpm data) for each rpm in the container
+        '''
+        if self.name is None:
+            return
+        if self.peek() == "}":
+            return
+        while True:
+            rpm = self.decode()
+            self.expect(":")
+            yield (rpm, self.decode())
+            if self.peek() == "}":
+                return
+            self.expect(",")
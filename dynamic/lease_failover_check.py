@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+lease_failover_check runs several rpm_db_builder hosts against one lease store,
+as local processes with their own --host-id and worker directory, and kills
+one of them partway through: once its workers ran out of rpms to lease, while
+the rpms they examined are still with its writer rather than in a closed shard.
+The hosts left have to wait for its leases to run out and examine those rpms
+again, so that in the end every rpm is done and in a shard that holds it.
+
+The rpms are made by elf_fixture_generator from a seed, like
+pipeline_benchmark's.
+"""
+import os
+import time
+import json
+import shutil
+import signal
+import sqlite3
+from argparse import ArgumentParser, Namespace
+from multiprocessing import get_context
+
+import elf_fixture_generator
+import lease_store
+from lib import *
+
+
+PRODUCT = "FAILOVER"
+VERSION = "1.0.0"
+
+held_str = ("SELECT state, count(*) FROM leases "
+            "WHERE host = ? GROUP BY state;")
+
+leases_str = "SELECT rpm, state, shard FROM leases;"
+
+
+def run_host(settings, host):
+    '''
+    One host: rpm_db_builder with its own worker directory, in a session of its
+    own so the host and its workers can be killed together
+    '''
+    import rpm_db_builder
+
+    os.setsid()
+    worker_directory = os.path.join(settings.worker_directory, host)
+    os.makedirs(worker_directory)
+    rpm_db_builder.run(settings.rpm_directory, worker_directory, settings.json_directory,
+                       PRODUCT, VERSION, settings.processes,
+                       lease_filename = settings.lease_file, host_name = host,
+                       lease_duration = settings.lease_seconds)
+
+
+def held_by(settings, host):
+    '''
+    @return
+    dict of state -> the number of rpms host holds in that state
+    '''
+    try:
+        conn = sqlite3.connect(settings.lease_file, timeout = 60)
+        try:
+            return dict(conn.execute(held_str, (host,)).fetchall())
+        finally:
+            conn.close()
+    except sqlite3.OperationalError:
+        # the hosts haven't made the store yet
+        return {}
+
+
+def kill_when_idle(settings, process, host):
+    '''
+    Kill the host once it holds results that aren't in a closed shard, and its
+    workers examine nothing: the other hosts only know it holds them from the
+    results, not from leases on rpms being examined.
+
+    @return
+    whether it was killed, rather than finishing first
+    '''
+    while process.is_alive():
+        held = held_by(settings, host)
+        if held.get(lease_store.WRITTEN) and not held.get(lease_store.LEASED):
+            os.killpg(process.pid, signal.SIGKILL)
+            process.join()
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def check_shards(settings):
+    '''
+    @return
+    list of what's wrong with the lease store and the shards the hosts wrote
+    '''
+    conn = sqlite3.connect(settings.lease_file, timeout = 60)
+    rows = conn.execute(leases_str).fetchall()
+    conn.close()
+
+    problems = []
+    shards = {}
+    for rpm, state, shard in rows:
+        if state != lease_store.DONE:
+            problems.append("%s is %s" % (rpm, state))
+            continue
+        if shard not in shards:
+            try:
+                with open(shard, "r") as f:
+                    shards[shard] = set().union(*[x.keys() for x in json.load(f).values()])
+            except (OSError, ValueError) as e:
+                shards[shard] = set()
+                problems.append("%s can't be read: %s" % (shard, e))
+        if rpm not in shards[shard]:
+            problems.append("%s isn't in %s, its shard" % (rpm, shard))
+    if len(rows) != settings.packages:
+        problems.append("the lease store has %d rpms rather than %d" % (len(rows), settings.packages))
+    return problems
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-w", "--work_directory", type=str, default="lease-failover-check",
+                   help="The directory the rpms, the lease store, the worker directories and the JSON files go in.")
+    p.add_argument("-H", "--hosts", type=int, default=3,
+                   help="The number of hosts, one of which is killed.")
+    p.add_argument("-p", "--processes", type=int, default=1,
+                   help="The number of rpm_db_builder worker processes on each host.")
+    p.add_argument("-x", "--lease-seconds", type=int, default=60,
+                   help="How long a lease lasts, and so how long the hosts left wait for the killed host's rpms. " \
+                        "It has to be longer than they take to examine the rest, or they'd find them by chance.")
+    p.add_argument("-k", "--packages", type=int, default=12,
+                   help="The number of rpms.")
+    p.add_argument("-s", "--symbols", type=int, default=200,
+                   help="The number of functions in each library.")
+    p.add_argument("-d", "--seed", type=int, default=0,
+                   help="Seed for generating the rpms.")
+    p.add_argument("-n", "--noclean", action="store_true",
+                   help="Keep the rpms, lease store and JSON files.")
+    args = p.parse_args()
+
+    if args.hosts < 2:
+        terminal_msg(0, "There have to be at least two hosts, one to kill and one to finish its rpms.")
+
+    work_directory = os.path.abspath(args.work_directory)
+    if os.path.exists(work_directory):
+        shutil.rmtree(work_directory)
+    settings = Namespace(processes = args.processes,
+                         packages = args.packages,
+                         lease_seconds = args.lease_seconds,
+                         lease_file = os.path.join(work_directory, "leases.sqlite"),
+                         rpm_directory = os.path.join(work_directory, "rpms"),
+                         worker_directory = os.path.join(work_directory, "worker"),
+                         json_directory = os.path.join(work_directory, "json"))
+    elf_fixture_generator.generate_corpus(settings.rpm_directory, args.packages, "rpm", args.seed, symbols = args.symbols)
+    os.makedirs(settings.worker_directory)
+    os.makedirs(settings.json_directory)
+
+    start = time.perf_counter()
+    ctx = get_context("fork")
+    hosts = {}
+    for n in range(args.hosts):
+        host = "host%d" % n
+        hosts[host] = ctx.Process(target = run_host, args = (settings, host), name = host)
+        hosts[host].start()
+
+    victim = "host0"
+    if not kill_when_idle(settings, hosts[victim], victim):
+        terminal_msg(0, "%s finished before it could be killed, try more rpms (-k)." % victim)
+    terminal_msg(2, "Killed %s after %.1fs" % (victim, time.perf_counter() - start))
+
+    failed = []
+    for host, process in hosts.items():
+        if host != victim:
+            process.join()
+            if process.exitcode != 0:
+                failed.append("%s exited with %s" % (host, process.exitcode))
+    terminal_msg(2, "The other hosts finished after %.1fs" % (time.perf_counter() - start))
+
+    problems = failed + check_shards(settings)
+    if not args.noclean:
+        shutil.rmtree(work_directory)
+    if problems:
+        terminal_msg(0, "The hosts left didn't finish the killed host's rpms:\n\t" + "\n\t".join(problems))
+    terminal_msg(2, "Every rpm is in a shard that holds it.")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+lease_store lets several hosts build the JSON database of one ISO together.
+The rpm inventory is published to a sqlite file on a shared filesystem, and
+the worker processes on every host lease rpms out of it. sqlite's locking
+(advisory fcntl locks on the file) keeps the leasing atomic across hosts.
+
+Each rpm goes through the states
+    pending -> leased (a worker is examining it) -> written (the writer has it)
+            -> done (the shard holding it has been closed)
+A host renews the leases it holds (leased or written) while it's alive. When
+a host dies, its leases expire and the other hosts take those rpms back.
+
+Several local processes with their own --host-id and worker directory work
+just as well as several machines, which is handy for trying this out.
+"""
+import sqlite3
+import time
+from json import dumps, loads
+
+PENDING = "pending"
+LEASED = "leased"
+WRITTEN = "written"
+DONE = "done"
+
+create_str = ("CREATE TABLE IF NOT EXISTS leases ("
+              "    rpm     TEXT PRIMARY KEY,"
+              "    entry   TEXT,"
+              "    state   TEXT,"
+              "    host    TEXT,"
+              "    expires REAL,"
+              "    shard   TEXT"
+              ");")
+
+publish_str = ("INSERT OR IGNORE INTO leases (rpm, entry, state) "
+               "VALUES (?, ?, '%s');" % PENDING)
+
+available_str = ("SELECT rpm, entry FROM leases "
+                 "WHERE state = '%s' OR (state IN ('%s', '%s') AND expires < ?) "
+                 "LIMIT 1;" % (PENDING, LEASED, WRITTEN))
+
+lease_str = ("UPDATE leases SET state = '%s', host = ?, expires = ? "
+             "WHERE rpm = ?;" % LEASED)
+
+renew_str = ("UPDATE leases SET expires = ? "
+             "WHERE host = ? AND state IN ('%s', '%s');" % (LEASED, WRITTEN))
+
+written_str = ("UPDATE leases SET state = '%s', host = ? "
+               "WHERE rpm = ? AND state != '%s';" % (WRITTEN, DONE))
+
+complete_str = ("UPDATE leases SET state = '%s', host = ?, shard = ? "
+                "WHERE rpm = ? AND state != '%s';" % (DONE, DONE))
+
+# rpms still waiting for a worker, or held by another host, which may die before their shard is closed
+outstanding_str = ("SELECT count(*) FROM leases "
+                   "WHERE state = '%s' OR (state IN ('%s', '%s') AND host != ?);" % (PENDING, LEASED, WRITTEN))
+
+examining_str = ("SELECT count(*) FROM leases "
+                 "WHERE host = ? AND state = '%s';" % LEASED)
+
+unfinished_str = ("SELECT count(*) FROM leases "
+                  "WHERE state != '%s';" % DONE)
+
+
+class LeaseStore:
+    def __init__(self, filename, host, lease_seconds = 300):
+        '''
+        @param
+        filename        the sqlite file shared by all hosts
+        host            a name for this host, unique among the hosts sharing the file
+        lease_seconds   how long a lease lasts without being renewed
+        '''
+        self.filename = filename
+        self.host = host
+        self.lease_seconds = lease_seconds
+        # autocommit mode, transactions are started explicitly below
+        self.conn = sqlite3.connect(filename, timeout = 600, isolation_level = None)
+        # WAL needs shared memory, which doesn't work across hosts
+        self.conn.execute("PRAGMA journal_mode=DELETE;")
+        self.conn.execute(create_str)
+
+    def _transaction(self, statements):
+        '''
+        Run (sql, params) statements under the write lock of the file.
+        '''
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            for sql, params in statements:
+                self.conn.execute(sql, params)
+            self.conn.execute("COMMIT;")
+        except:
+            self.conn.execute("ROLLBACK;")
+            raise
+
+    def publish(self, items):
+        '''
+        Add (key, entry) pairs to the inventory. Keys already there, whether
+        published by another host or left by an earlier run, are kept as they are.
+        '''
+        self._transaction([(publish_str, (key, dumps(entry))) for key, entry in items])
+
+    def lease(self):
+        '''
+        Lease one pending rpm, or one whose lease has expired.
+
+        @return
+        the entry published for the rpm, or None if nothing is available right now
+        '''
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            now = time.time()
+            row = self.conn.execute(available_str, (now,)).fetchone()
+            if row:
+                self.conn.execute(lease_str, (self.host, now + self.lease_seconds, row[0]))
+            self.conn.execute("COMMIT;")
+        except:
+            self.conn.execute("ROLLBACK;")
+            raise
+
+        if row:
+            return loads(row[1])
+        return None
+
+    def renew(self):
+        '''
+        Extend every lease this host holds.
+        '''
+        self._transaction([(renew_str, (time.time() + self.lease_seconds, self.host))])
+
+    def written(self, keys):
+        '''
+        Mark rpms as handed to this host's writer. They stay leased to this
+        host until their shard is closed.
+        '''
+        self._transaction([(written_str, (self.host, key)) for key in keys])
+
+    def complete(self, keys, shard):
+        '''
+        Mark rpms as written to the given shard. If a lease expired and another
+        host finished the rpm first, the rpm ends up in both shards.
+        '''
+        self._transaction([(complete_str, (self.host, shard, key)) for key in keys])
+
+    def outstanding(self):
+        '''
+        @return
+        the number of rpms that are pending, or leased or written by other hosts
+        '''
+        return self.conn.execute(outstanding_str, (self.host,)).fetchone()[0]
+
+    def examining(self):
+        '''
+        @return
+        the number of rpms this host's workers have leased, and not handed to its writer yet
+        '''
+        return self.conn.execute(examining_str, (self.host,)).fetchone()[0]
+
+    def unfinished(self):
+        '''
+        @return
+        the number of rpms not in a closed shard yet, on any host
+        '''
+        return self.conn.execute(unfinished_str).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
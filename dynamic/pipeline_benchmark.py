@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+pipeline_benchmark runs the stages dynamic_parser runs on a product ISO -
+iso_parser, rpm_db_builder, rpm_uploader and dependency_resolver - on an ISO
+of generated rpms, and measures the wall time, cpu time, peak RSS and bytes
+written of each. The ISO is made by elf_fixture_generator from a seed, so the
+same parameters give the same corpus, and what ends up in the database can be
+checked as well as how long it took.
+
+The database is a sqlite file standing in for postgres, unless --postgres is
+given. A run can be saved as a baseline, and later runs compared with it:
+a stage that got slower or bigger by more than the tolerance, or a database
+that doesn't hold the same number of rows, fails the run.
+"""
+import os
+import time
+import shutil
+import resource
+from json import dumps, loads
+from argparse import ArgumentParser, Namespace
+from multiprocessing import get_context
+
+import elf_fixture_generator
+from lib import *
+from library import sqlite_db
+
+
+STAGES = ["iso", "build", "upload", "resolve"]
+
+PRODUCT = "BENCHMARK"
+METADATA = ("<productName>{product}</productName>\n"
+            "<imageType>release</imageType>\n"
+            "<version>{version}</version>\n"
+            "<buildNumber>{build}</buildNumber>\n")
+
+# how much worse than the baseline a measurement may get, on top of the
+# tolerance, before it counts; small stages vary more than their size suggests
+SLACK = {"wall_time": 0.5,
+         "cpu_time": 0.5,
+         "peak_rss": 16 * (2 ** 20),
+         "bytes_written": 2 ** 20}
+
+version_joins = ("JOIN rpms r ON e.rpm_id = r.rpm_id JOIN versions v ON r.vers_id = v.vers_id "
+                 "JOIN products p ON v.prod_id = p.prod_id WHERE p.product = %s AND v.version = %s;")
+
+# the rows the pipeline leaves in the database for the benchmark version
+count_sql = [("rpms", "SELECT count(*) FROM rpms r JOIN versions v ON r.vers_id = v.vers_id "
+                      "JOIN products p ON v.prod_id = p.prod_id WHERE p.product = %s AND v.version = %s;"),
+             ("execs", "SELECT count(*) FROM execs e " + version_joins),
+             ("aliases", "SELECT count(*) FROM aliases a JOIN execs e ON a.exec_id = e.exec_id " + version_joins),
+             ("deps", "SELECT count(*) FROM deps d JOIN execs e ON d.exec_id = e.exec_id " + version_joins),
+             ("decl_funcs", "SELECT count(*) FROM decl_funcs f JOIN execs e ON f.content_id = e.content_id " + version_joins),
+             ("callee_funcs", "SELECT count(*) FROM callee_funcs c JOIN decl_funcs f ON c.func_id = f.func_id "
+                              "JOIN execs e ON f.content_id = e.content_id " + version_joins),
+             ("resolved_deps", "SELECT count(*) FROM resolved_deps_execs x JOIN deps d ON x.dep_id = d.dep_id "
+                               "JOIN execs e ON d.exec_id = e.exec_id " + version_joins)]
+
+# for postgres, where an earlier run left the benchmark version behind
+delete_resolved_sql = ("DELETE FROM resolved_deps_execs WHERE dep_id IN "
+                       "(SELECT d.dep_id FROM deps d JOIN execs e ON d.exec_id = e.exec_id " + version_joins[:-1] + ");")
+delete_version_sql = ("DELETE FROM versions WHERE version = %s AND prod_id IN "
+                      "(SELECT prod_id FROM products WHERE product = %s);")
+
+
+def open_database(settings):
+    '''
+    @return
+    a new connection to the benchmark database: the sqlite file, or the database in the config with --postgres
+    '''
+    if settings.postgres:
+        try:
+            import psycopg2
+        except ImportError:
+            terminal_msg(0, "Psycopg2 must be installed to benchmark against postgres.")
+        return psycopg2.connect(utility.get_conn_str())
+    return sqlite_db.connect(settings.database)
+
+
+def prepare_database(settings):
+    '''
+    Start from an empty database: a new sqlite file with the tables of
+    create_tables.py, or postgres without an earlier run's version.
+    '''
+    import create_tables
+
+    if not settings.postgres:
+        if os.path.exists(settings.database):
+            os.unlink(settings.database)
+        conn = open_database(settings)
+        create_tables.main(conn = conn)
+        conn.close()
+        return
+
+    conn = open_database(settings)
+    with conn:
+        with conn.cursor() as curs:
+            curs.execute(delete_resolved_sql, (PRODUCT, settings.version))
+            curs.execute(delete_version_sql, (settings.version, PRODUCT))
+    conn.close()
+
+
+def stage_iso(settings):
+    import iso_parser
+    import dynamic_parser
+
+    iso_parser.iso_process(settings.iso, settings.rpm_directory,
+                           ["metadata.xml"] if settings.zero_extract else iso_parser.DEFAULT_PATTERNS)
+
+    # as dynamic_parser.wrapper() does, and it has to agree with what the ISO was made with
+    args = dynamic_parser.validate_args_with_metadata(Namespace(product_name = PRODUCT, version_number = settings.version),
+                                                      settings.rpm_directory)
+    if args.version_number != settings.version:
+        terminal_msg(0, "metadata.xml on the ISO gives version %s rather than %s" % (args.version_number, settings.version))
+
+
+def stage_build(settings):
+    import rpm_db_builder
+
+    if settings.db_sink:
+        import rpm_uploader
+        rpm_uploader.connect = lambda: open_database(settings)
+
+    rpm_db_builder.run(settings.rpm_directory, settings.worker_directory, settings.json_directory,
+                       PRODUCT, settings.version, settings.processes,
+                       source_iso = settings.iso if settings.zero_extract else None,
+                       database_sink = settings.db_sink, write_json = not settings.db_sink)
+
+
+def stage_upload(settings):
+    import rpm_uploader
+
+    if settings.db_sink:
+        # the build stage did it
+        return
+
+    conn = open_database(settings)
+    rpm_uploader.upload(settings.json_directory, conn)
+    conn.close()
+
+
+def stage_resolve(settings):
+    import dependency_resolver
+
+    dependency_resolver.connect = lambda: open_database(settings)
+    dependency_resolver.resolve_deps_exact(PRODUCT, settings.version)
+
+
+STAGE_FUNCTIONS = {"iso": stage_iso,
+                   "build": stage_build,
+                   "upload": stage_upload,
+                   "resolve": stage_resolve}
+
+
+def io_counters():
+    '''
+    @return
+    dict of the counters in /proc/self/io, which take in the subprocesses that have been waited for.
+    Empty where there is no such file.
+    '''
+    try:
+        with open("/proc/self/io") as f:
+            return dict((name, int(value)) for name, value in (line.split(":") for line in f))
+    except (IOError, ValueError):
+        return {}
+
+
+def directory_size(top):
+    if os.path.isfile(top):
+        return os.path.getsize(top)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(top) for f in files
+               if not os.path.islink(os.path.join(d, f)))
+
+
+def measured_stage(stage, settings, pipe):
+    '''
+    Run one stage and send its measurements down pipe. Every stage runs in a
+    process of its own, so the peak RSS is that of the stage alone.
+    '''
+    io_start = io_counters()
+    cpu_start = os.times()
+    wall_start = time.perf_counter()
+
+    STAGE_FUNCTIONS[stage](settings)
+
+    wall_time = time.perf_counter() - wall_start
+    cpu_end = os.times()
+    io_end = io_counters()
+
+    # ru_maxrss is in kilobytes; for the children it's the largest of them, not their total
+    own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    pipe.send({"wall_time": wall_time,
+               "cpu_time": (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system) +
+                           (cpu_end.children_user - cpu_start.children_user) +
+                           (cpu_end.children_system - cpu_start.children_system),
+               "peak_rss": max(own_rss, child_rss),
+               "bytes_written": io_end.get("wchar", 0) - io_start.get("wchar", 0),
+               "disk_bytes_written": io_end.get("write_bytes", 0) - io_start.get("write_bytes", 0)})
+    pipe.close()
+
+
+def run_stage(stage, settings):
+    '''
+    @return
+    the measurements of stage
+    '''
+    ctx = get_context("fork")
+    receiver, sender = ctx.Pipe(duplex = False)
+    process = ctx.Process(target = measured_stage, args = (stage, settings, sender), name = "benchmark-" + stage)
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None or process.exitcode != 0:
+        terminal_msg(0, "The %s stage failed (exit code %s)." % (stage, process.exitcode))
+    return result
+
+
+def count_rows(settings):
+    conn = open_database(settings)
+    counts = {}
+    with conn:
+        with conn.cursor() as curs:
+            for table, sql in count_sql:
+                curs.execute(sql, (PRODUCT, settings.version))
+                counts[table] = curs.fetchone()[0]
+    conn.close()
+    return counts
+
+
+def make_iso(fixture_directory, version, build, seed, packages, **package_args):
+    '''
+    Generate the benchmark ISO, with a metadata.xml like a product ISO has
+
+    @return
+    the path of the ISO
+    '''
+    metadata = METADATA.format(product = PRODUCT, version = version, build = build)
+    elf_fixture_generator.generate_corpus(fixture_directory, packages, "iso", seed,
+                                          iso_files = {"metadata.xml": metadata.encode()}, **package_args)
+    return os.path.join(fixture_directory, "fixtures.iso")
+
+
+def run_pipeline(settings):
+    '''
+    Run every stage once, in a fresh run directory and database
+
+    @return
+    dict of stage -> measurements, and the row counts it left in the database
+    '''
+    if os.path.exists(settings.run_directory):
+        shutil.rmtree(settings.run_directory)
+    os.makedirs(settings.run_directory)
+    prepare_database(settings)
+
+    outputs = {"iso": settings.rpm_directory,
+               "build": settings.json_directory}
+
+    stages = {}
+    for stage in STAGES:
+        database_size = 0 if settings.postgres else directory_size(settings.database)
+        stages[stage] = run_stage(stage, settings)
+        if stage in outputs:
+            stages[stage]["output_bytes"] = directory_size(outputs[stage])
+        elif not settings.postgres:
+            stages[stage]["output_bytes"] = directory_size(settings.database) - database_size
+        terminal_msg(2, "{}: {wall_time:.2f}s wall, {cpu_time:.2f}s cpu, peak RSS {peak_rss} bytes, "
+                        "{bytes_written} bytes written".format(stage, **stages[stage]))
+
+    return stages, count_rows(settings)
+
+
+def best_of(runs):
+    '''
+    The smallest of each measurement over several runs of the stages
+    '''
+    return dict((stage, dict((key, min(run[stage][key] for run in runs)) for key in runs[0][stage]))
+                for stage in runs[0])
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    '''
+    @return
+    a list of the ways results are worse than baseline; empty if they're not
+    '''
+    if results["parameters"] != baseline["parameters"]:
+        return ["the baseline was made with other parameters: %s" % dumps(baseline["parameters"], sort_keys = True)]
+
+    problems = []
+    for table, count in sorted(baseline["rows"].items()):
+        if results["rows"].get(table) != count:
+            problems.append("%s has %s rows, the baseline has %d" % (table, results["rows"].get(table), count))
+
+    for stage in STAGES:
+        for key, slack in sorted(SLACK.items()):
+            value = results["stages"][stage][key]
+            base = baseline["stages"][stage][key]
+            if value > base * (1 + tolerance) and value - base > slack:
+                problems.append("%s %s went from %s to %s" % (stage, key, base, value))
+    return problems
+
+
+if __name__ == "__main__":
+    p = ArgumentParser(description=__doc__)
+
+    p.add_argument("-w", "--work_directory", type=str, default="pipeline-benchmark",
+                   help="The directory the ISO, the extracted rpms, the JSON files and the sqlite database go in.")
+    p.add_argument("-b", "--baseline", type=str,
+                   help="A JSON file with the results of an earlier run to compare with.")
+    p.add_argument("-u", "--update-baseline", action="store_true",
+                   help="Save the results of this run as the baseline instead of comparing with it.")
+    p.add_argument("-t", "--tolerance", type=float, default=0.25,
+                   help="How much larger than the baseline (0.25 is 25%%) a stage's time, RSS or bytes written may be.")
+    p.add_argument("-r", "--repeat", type=int, default=1,
+                   help="Run the pipeline this many times and keep the best of each measurement.")
+    p.add_argument("-p", "--processes", type=int, default=4,
+                   help="The number of rpm_db_builder worker processes.")
+    p.add_argument("-g", "--postgres", action="store_true",
+                   help="Upload to the database in the config, whose tables must already exist, rather than a sqlite file.")
+    p.add_argument("-k", "--packages", type=int, default=20,
+                   help="The number of rpms on the ISO.")
+    p.add_argument("-l", "--libraries", type=int, default=2,
+                   help="The number of shared libraries in each rpm.")
+    p.add_argument("-e", "--executables", type=int, default=2,
+                   help="The number of executables in each rpm.")
+    p.add_argument("-s", "--symbols", type=int, default=1000,
+                   help="The number of functions in each library.")
+    p.add_argument("-c", "--calls", type=int, default=3,
+                   help="The number of calls each function makes.")
+    p.add_argument("-d", "--seed", type=int, default=0,
+                   help="Seed for generating the rpms.")
+    p.add_argument("-j", "--json", type=str,
+                   help="Also write the results to this file.")
+    p.add_argument("-z", "--zero-extract", action="store_true",
+                   help="Examine the rpms where they are in the ISO, as dynamic_parser --zero-extract does. " \
+                        "The results can be compared with a baseline made either way.")
+    p.add_argument("-D", "--db-sink", action="store_true",
+                   help="Add the rows in the build stage, as rpm_db_builder --db-sink --no-json does, leaving nothing to upload. " \
+                        "Compare the build and upload stages together with a baseline made without it.")
+    p.add_argument("-n", "--noclean", action="store_true",
+                   help="Keep the extracted rpms, JSON files and database of the last run.")
+    args = p.parse_args()
+
+    if args.update_baseline and not args.baseline:
+        terminal_msg(0, "--update-baseline needs a baseline file (-b).")
+
+    parameters = {"packages": args.packages,
+                  "libraries": args.libraries,
+                  "executables": args.executables,
+                  "symbols": args.symbols,
+                  "calls": args.calls,
+                  "seed": args.seed,
+                  "processes": args.processes,
+                  "postgres": args.postgres}
+
+    work_directory = os.path.abspath(args.work_directory)
+    run_directory = os.path.join(work_directory, "run")
+    settings = Namespace(version = "1.0.0-0.0.%d" % args.seed,
+                         processes = args.processes,
+                         zero_extract = args.zero_extract,
+                         db_sink = args.db_sink,
+                         postgres = args.postgres,
+                         database = os.path.join(work_directory, "benchmark.sqlite"),
+                         run_directory = run_directory,
+                         rpm_directory = os.path.join(run_directory, "rpms"),
+                         worker_directory = os.path.join(run_directory, "worker"),
+                         json_directory = os.path.join(run_directory, "json"))
+
+    generate_start = time.perf_counter()
+    fixture_directory = os.path.join(work_directory, "fixtures")
+    if os.path.exists(fixture_directory):
+        shutil.rmtree(fixture_directory)
+    settings.iso = make_iso(fixture_directory, "1.0.0", "0.0.%d" % args.seed, args.seed, args.packages,
+                            libraries = args.libraries, executables = args.executables,
+                            symbols = args.symbols, calls = args.calls)
+    terminal_msg(2, "Generated %s (%d bytes) in %.1fs" % (settings.iso, os.path.getsize(settings.iso),
+                                                          time.perf_counter() - generate_start))
+
+    runs = []
+    rows = None
+    for n in range(args.repeat):
+        stages, run_rows = run_pipeline(settings)
+        if rows is not None and run_rows != rows:
+            terminal_msg(0, "Run %d left different rows in the database than the first: %s" % (n + 1, dumps(run_rows)))
+        rows = run_rows
+        runs.append(stages)
+
+    if not args.noclean:
+        shutil.rmtree(run_directory)
+        if not args.postgres:
+            os.unlink(settings.database)
+
+    results = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "parameters": parameters,
+               "zero_extract": args.zero_extract,
+               "db_sink": args.db_sink,
+               "iso_bytes": os.path.getsize(settings.iso),
+               "stages": best_of(runs),
+               "rows": rows}
+    terminal_msg(2, "Rows in the database: %s" % ", ".join("%s %d" % (t, rows[t]) for t, _ in count_sql))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(dumps(results, sort_keys = True, indent = 4))
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(dumps(results, sort_keys = True, indent = 4))
+        terminal_msg(2, "Saved the results as the baseline in %s" % args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = loads(f.read())
+        problems = compare_with_baseline(results, baseline, args.tolerance)
+        if problems:
+            terminal_msg(0, "Worse than the baseline:\n\t" + "\n\t".join(problems))
+        terminal_msg(2, "No worse than the baseline in %s" % args.baseline)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+rpm_bulk_loader adds the rows rpm_uploader walks out of the JSON files with
+COPY instead of one INSERT ... RETURNING round trip per row. Ids are reserved
+from each table's sequence a block at a time and handed out in Python, every
+table's rows are spooled to a file as COPY text, and the files are streamed to
+the database in foreign key order, inside the upload's transaction.
+"""
+from tempfile import SpooledTemporaryFile
+
+from lib import *
+
+
+# every table rpm_uploader adds rows to: (table, id column, the other columns), parents before children
+COPY_TABLES = [(RPMS, RPM_ID, (VERS_ID, RPM, RELEASE, RPM_V, X86_64, I686, PPC, NOARCH, OTHERARCH)),
+               (EXECS, EXEC_ID, (RPM_ID, EXEC, BUILD_ID, EXEC_PATH, SONAME, ELF_CLASS, CONTENT_ID)),
+               (ALIASES, ALIAS_ID, (EXEC_ID, ALIAS, ALIAS_PATH)),
+               (DEPENDENCIES, DEP_ID, (EXEC_ID, DEP, STATIC)),
+               (RPATHS, RPATH_ID, (EXEC_ID, RPATH, RUNPATH)),
+               (DECL_FUNCS, DECL_ID, (CONTENT_ID, SYMBOL_ID)),
+               (AT_VERSIONS, AT_ID, (DECL_ID, AT)),
+               (DEF_FUNCS, DEF_ID, (DECL_ID, BIND)),
+               (CALLEE_FUNCS, CALLEE_ID, (DECL_ID, C_SYMBOL_ID))]
+
+# ids reserved at once, doubling each time a table runs out, up to the most
+FIRST_BLOCK = 1024
+MAX_BLOCK = 2 ** 18
+
+# rows spooled in memory before going to a temporary file, per table
+SPOOL_SIZE = 4 * (2 ** 20)
+
+# SQL format strings
+reserve_sql = ("SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+               "FROM generate_series(1, %s);")
+
+copy_sql = "COPY public.{} ({}) FROM STDIN;"
+
+# backslash first, so the escapes added for the others aren't escaped again
+COPY_ESCAPES = [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]
+
+
+def copy_field(value):
+    '''
+    @return
+    value in COPY's text format
+    '''
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    value = str(value)
+    for character, escape in COPY_ESCAPES:
+        value = value.replace(character, escape)
+    return value
+
+
+def copy_line(values):
+    return "\t".join(copy_field(v) for v in values) + "\n"
+
+
+class CopyWriter:
+    def __init__(self, curs):
+        '''
+        @param
+        curs    a psycopg2 cursor, in the transaction the rows are added in
+        '''
+        self.curs = curs
+        self.ids = dict((table, []) for table, _, _ in COPY_TABLES)
+        self.block_size = dict((table, FIRST_BLOCK) for table, _, _ in COPY_TABLES)
+        self.files = dict((table, SpooledTemporaryFile(max_size = SPOOL_SIZE, mode = "w+")) for table, _, _ in COPY_TABLES)
+        self.rows = dict((table, 0) for table, _, _ in COPY_TABLES)
+
+    def reserve(self, table):
+        '''
+        Take the next block of ids for table from its sequence. Ids reserved and not used are
+        skipped, as ids of rolled back inserts are.
+        '''
+        id_column = [i for t, i, _ in COPY_TABLES if t == table][0]
+        self.curs.execute(reserve_sql, ("public." + table, id_column, self.block_size[table]))
+        # handed out from the end of the list, so reversed to hand them out in order
+        self.ids[table] = [row[0] for row in reversed(self.curs.fetchall())]
+        self.block_size[table] = min(self.block_size[table] * 2, MAX_BLOCK)
+
+    def add(self, table, values):
+        '''
+        Add a row with the next id of table.
+
+        @param
+        values  the values of the columns of table listed in COPY_TABLES, without the id
+
+        @return
+        the id of the new row
+        '''
+        if not self.ids[table]:
+            self.reserve(table)
+        row_id = self.ids[table].pop()
+        self.files[table].write(copy_line((row_id,) + tuple(values)))
+        self.rows[table] += 1
+        return row_id
+
+    def flush(self):
+        '''
+        COPY the rows added so far to the database, parents first
+        '''
+        for table, id_column, columns in COPY_TABLES:
+            f = self.files[table]
+            if self.rows[table]:
+                f.seek(0)
+                self.curs.copy_expert(copy_sql.format(table, ", ".join((id_column,) + columns)), f)
+            f.seek(0)
+            f.truncate()
+            self.rows[table] = 0
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
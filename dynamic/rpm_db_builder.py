@@ -8,21 +8,38 @@ ELF files, symbols present in the symbol table of said ELF file, how they're
 defined or not defined, and information about the architecture that the RPM
 is compiled for.
 """
-from multiprocessing import Process, Queue, active_children, cpu_count
+from multiprocessing import active_children, cpu_count, get_context
 from queue import Empty
-from os import mkdir, walk, chdir, path, rmdir, remove, X_OK, access, listdir, getcwd, devnull, write, symlink, unlink, O_RDONLY, O_NONBLOCK, fdopen
+from queue import Queue as ThreadQueue
+from threading import Thread
+from os import mkdir, walk, chdir, path, rmdir, X_OK, access, getcwd, devnull, write, symlink, unlink, O_RDONLY, O_NONBLOCK, fdopen, getpid
 from os import open as osopen
 from sys import argv, exit
 from json import dumps
 from subprocess import check_call, Popen, PIPE
 from tempfile import TemporaryFile
-from time import sleep
+from time import sleep, monotonic
 from shutil import rmtree
+from socket import gethostname
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from bisect import bisect_left
+from functools import lru_cache
+from glob import escape
+from shlex import quote
 from argparse import ArgumentParser
 from errno import ENOENT, EACCES
+from mmap import mmap, ACCESS_READ
+import asyncio
+import hashlib
 import re
 
 import assemblyparser
+import async_runner
+import byte_queue
+import iso_parser
+import lease_store
+import rpm_db_sink
+import scratch_cleaner
 from rpm_db_print import DBPrinter
 from lib import *
 
@@ -36,12 +53,67 @@ global noclean
 global current_directory
 global debug_process
 global mark_worker_dir_for_removal
+global engine
+global async_subprocesses
+global async_rpms
+global lease_file
+global host_id
+global lease_seconds
+global queue_budget
+global pair_debuginfo
+global start_method
+global split_threshold
+global split_ranges
+global iso_file
+global iso_extents
+global db_sink
+global json_output
 
 
 err_file = None
+engine = "process"
+async_subprocesses = 8
+async_rpms = 4
+lease_file = None
+host_id = "%s-%d" % (gethostname(), getpid())
+lease_seconds = 300
+queue_budget = 256 * (2 ** 20)
+pair_debuginfo = False
+start_method = "fork"
+split_threshold = 64 * (2 ** 20)
+split_ranges = 4
+iso_file = None
+iso_extents = None
+iso_map = None
+db_sink = False
+json_output = True
+
+# the regular expressions used to parse readelf output, compiled once
+needed_match = re.compile(r"^.*NEEDED.*\[(?P<needed_so>.*)\].*")
+rpath_match = re.compile(r"^.*\(RPATH\).*\[(?P<rpath_so>.*)\].*")
+runpath_match = re.compile(r"^.*\(RUNPATH\).*\[(?P<runpath_so>.*)\].*")
+soname_match = re.compile(r"^.*\(SONAME\).*\[(?P<soname>.*)\].*")
+symbol_num_match = re.compile("[0-9]:$")
+versym_match = re.compile(r"(?P<index>[0-9a-f]+)(?P<hidden>[h ])\((?P<version>[^)]*)\)")
+section_header_match = re.compile(r"\]\s+(?P<name>\S+)\s+\S+\s+(?P<address>[0-9a-f]+)\s+[0-9a-f]+\s+(?P<size>[0-9a-f]+)\s")
+
+# the module globals workers need, handed to them explicitly for start methods
+# (forkserver) that don't give them a copy of this process's memory
+WORKER_GLOBALS = ("worker_dir", "current_directory", "debug_process", "engine", "async_subprocesses", "async_rpms",
+                  "lease_file", "host_id", "lease_seconds", "pair_debuginfo", "split_threshold", "split_ranges",
+                  "iso_file", "iso_extents")
+
+# sent to the serializer in place of a result, to close the shard it's printing (see writer_process)
+CLOSE_SHARD = "close shard"
+# where debuginfo rpms install .debug files, and the build-id symlinks to them
+DEBUG_ROOT = "/usr/lib/debug"
+# the subdirectory of an rpm's scratch directory the needed .debug files are unpacked into
+DEBUGINFO_SCRATCH = ".debuginfo-members"
 
 try:
     import cxxfilt
+    # the same library functions get demangled over and over, in every executable calling them
+    @lru_cache(maxsize = 2 ** 16)
     def cppdemangle(s):
         if not s.startswith("_Z"):
             return s
@@ -52,6 +124,7 @@ try:
             except:
                 return s
 except:
+    @lru_cache(maxsize = 2 ** 16)
     def cppdemangle(s):
         #print("running cppdemangle")
         if not s.startswith("_Z"):
@@ -175,6 +248,29 @@ def is_elf_file(f):
     return False
 
 
+def elf_class(f):
+    '''
+    Read the class of an ELF file out of its header, which ld.so goes by to pick
+    the lib64 or lib directories.
+
+    @param
+    f               a string that represents path to an ELF file
+
+    @return
+    64 or 32, or None if the header can't be read
+    '''
+    try:
+        with open(f, "rb") as test:
+            ident = test.read(5)
+    except IOError as error:
+        log_err("Unable to read the ELF header of %s: %s" % (f, str(error)))
+        return None
+    if len(ident) == 5 and ident[:4] == b'\x7fELF':
+        # EI_CLASS: ELFCLASS32 is 1, ELFCLASS64 is 2
+        return {1: 32, 2: 64}.get(ident[4])
+    return None
+
+
 def log_err(s):
     '''
     Logging mechanism for errors raised.
@@ -212,9 +308,13 @@ def writer_process(cores, container_name, output_file, output_size):
 
     return 0 on success, non-zero on error
     """
-    terminal_msg(2, "Examining files under %s directory" % rpm_dir)
-    #chdir(rpm_dir)
     file_list = []
+    debuginfo_list = []
+
+    if not (json_output or db_sink):
+        terminal_msg(0, "The results have to be written to JSON files, the database, or both.")
+    if lease_file and (db_sink or not json_output):
+        terminal_msg(0, "Hosts sharing a lease store write JSON files, they can't add their results to the database themselves.")
 
     global rpm_repository_path
     rpm_repository_path = path.join(worker_dir, "rpm-repository")
@@ -225,22 +325,34 @@ def writer_process(cores, container_name, output_file, output_size):
         #Already there, no worries
         pass
 
-    for dirpath, dirs, files_in_dir in walk(rpm_dir):
-        #root_dir = path.join(rpm_dir, root)
-        #print(root_dir)
-        for f in files_in_dir:
-            if f.endswith("rpm"):
-                #print ("examining file " +  f)
+    if iso_file:
+        # Nothing is extracted, workers read the rpms out of the iso where they are
+        global iso_extents
+        terminal_msg(2, "Examining rpms in %s" % iso_file)
+        iso_extents = iso_parser.iso_extents(iso_file, ["*.rpm"])
+        found_files = [(f, f) for f in iso_extents]
+        # mapped before the workers are forked, so they share the mapping
+        map_iso()
+    else:
+        terminal_msg(2, "Examining files under %s directory" % rpm_dir)
+        found_files = [(f, path.abspath(path.join(dirpath, f))) for dirpath, dirs, files_in_dir in walk(rpm_dir) for f in files_in_dir]
+
+    for f, full_path in found_files:
+        if f.endswith("rpm"):
+            #print ("examining file " +  f)
 
-                block_list = ("debug", "devel")
-                if debug_process == False and any(s in f for s in block_list):
-                        continue
-                elif debug_process == True and not any(s in f for s in block_list):
+            if pair_debuginfo and "-debuginfo-" in f:
+                # examined along with the binary rpms they go with
+                debuginfo_list.append(full_path)
+                continue
+
+            block_list = ("debug", "devel")
+            if debug_process == False and any(s in f for s in block_list):
                     continue
-                #full_path = path.join(root_dir, f)
-                full_path = path.join(dirpath, f)
-                file_list.append(path.abspath(full_path))
-                #print(full_path)
+            elif debug_process == True and not any(s in f for s in block_list):
+                continue
+            file_list.append(full_path)
+            #print(full_path)
     """
     We'll trim the number of files that we're examining here.
     Each rpm may have an x86_64 or i686 (or other) version.
@@ -255,6 +367,8 @@ def writer_process(cores, container_name, output_file, output_size):
     # Desired result {filename:<f>, x86_64:"Y", i686:{N}, ...}
     file_list_union = set(x86_64_rpms) | set(i686_rpms) | set(noarch_rpms) | set(ppc_rpms) | set(other_rpms)
     file_list_input = []
+    debuginfo_rpms = debuginfo_index(debuginfo_list)
+    debuginfo_linked = set()
 
     if restart:
         restart_set = set()
@@ -287,8 +401,9 @@ def writer_process(cores, container_name, output_file, output_size):
         elif has_otherarch:
             symlink_src = f
 
+        # Reading from an iso, the links only keep track of what's left to examine for a restart
         if not restart:
-            symlink(symlink_src, path.join(rpm_repository_path, grab_path_leaf(symlink_src)))
+            symlink(iso_file or symlink_src, path.join(rpm_repository_path, grab_path_leaf(symlink_src)))
 
         entry = {FPATH :grab_path_leaf(f),
                  X86_64: has_x86_64,
@@ -296,33 +411,80 @@ def writer_process(cores, container_name, output_file, output_size):
                  NOARCH: has_noarch,
                  PPC: has_ppc,
                  OTHERARCH : has_otherarch}
+
+        if pair_debuginfo:
+            debuginfo_src = find_debuginfo(grab_path_leaf(symlink_src), debuginfo_rpms)
+            if debuginfo_src:
+                entry[DEBUGINFO] = grab_path_leaf(debuginfo_src)
+                # subpackages share the debuginfo rpm of their source package, so it stays in the repository
+                if not restart and debuginfo_src not in debuginfo_linked:
+                    symlink(iso_file or debuginfo_src, path.join(rpm_repository_path, entry[DEBUGINFO]))
+                    debuginfo_linked.add(debuginfo_src)
         file_list_input.append(entry)
 
-    q_output = Queue()
-    q_files = Queue()
+    ctx = worker_context()
+    # Workers block once this many bytes of results are waiting on the writer
+    q_output = byte_queue.ByteBudgetQueue(queue_budget, ctx)
+    q_files = ctx.Queue()
     terminal_msg(2, "Processed %d unique rpms" % len(file_list))
     terminal_msg(2, "Entered %d de-duplicated rpms in the queue" % len(file_list_input))
+    if pair_debuginfo:
+        terminal_msg(2, "Paired %d rpms with one of %d debuginfo rpms" % (len([x for x in file_list_input if DEBUGINFO in x]), len(debuginfo_list)))
     total_rpm_count = len(file_list_input)
 
-    for x in file_list_input:
-        q_files.put(x)
+    store = None
+    if lease_file:
+        # Workers on every host lease their rpms from the shared store instead of q_files
+        store = lease_store.LeaseStore(lease_file, host_id, lease_seconds)
+        store.publish((rpm_package_name(x), x) for x in file_list_input)
+        output_file = output_file + "-" + host_id
+    else:
+        for x in file_list_input:
+            q_files.put(x)
+        # one for each worker, so they stop as soon as the rpms run out and the writer doesn't wait on them
+        for x in range(cores):
+            q_files.put(None)
+
+    if engine == "async":
+        # A few event loop processes keep many tool subprocesses busy
+        target = async_worker_process
+    else:
+        target = worker_process
 
+    state = worker_state()
+    workers = []
     for x in range(cores):
-        p = Process(target = worker_process, args = (q_output, q_files, "Process-%s" % x, worker_dir))
+        name = "Process-%s" % x
+        p = ctx.Process(target = start_worker, args = (target, state, q_output, q_files, name, worker_dir), name = name)
         p.start()
-
-    printer = DBPrinter(output_file, output_dir, output_size, container_name)
+        workers.append(p)
+
+    printer = None
+    if json_output:
+        # a host restarted with the same --host-id mustn't overwrite its shards, their rpms are done
+        printer = DBPrinter(output_file, output_dir, output_size, container_name, keep_existing = store is not None)
+    # JSON encoding, file I/O and adding rows to the database happen on their own thread,
+    # so receiving results overlaps with writing them
+    results = ThreadQueue()
+    serializer_errors = []
+    serializer = Thread(target = serialize_output, args = (printer, container_name if db_sink else None, results, q_output, serializer_errors), daemon = True)
+    serializer.start()
     timeout = 3
     rpm_len = len(file_list)
     rpms_processed = 0
     last_count = 0
+    last_renewal = monotonic()
 
     while rpms_processed < rpm_len:
+        if store and monotonic() - last_renewal > lease_seconds / 3:
+            store.renew()
+            last_renewal = monotonic()
         try:
-            printer.print_out(q_output.get(block=True, timeout=timeout))
+            results.put(q_output.get(block=True, timeout=timeout))
             rpms_processed += 1
             timeout = 3
-            write(0, b".")
+            # progress goes to stdout; stdin is read-only when the writer runs as a child process or under "< /dev/null"
+            write(1, b".")
         except Empty:
             num_active_children = len(active_children())
             if num_active_children == 0:
@@ -332,18 +494,42 @@ def writer_process(cores, container_name, output_file, output_size):
             else:
                 #Something's probably just taking a while to process
                 #print("Queue empty, but has %d children: continuing" % num_active_children)
-                write(0, b".")
+                write(1, b".")
                 remaining_rpms = (total_rpm_count - rpms_processed)
                 if last_count != remaining_rpms:
-                    write(0, b"\n")
+                    write(1, b"\n")
                     print("Remaining rpm files: %d"  % remaining_rpms)
                     last_count = remaining_rpms
                 #print("Current timeout: %d seconds" % timeout)
                 sleep(timeout)
                 #Exponentially back off on checking while the queue is empty
                 timeout *= 2
-
-    printer.close_out()
+                if store:
+                    # but not past the point where our leases would run out
+                    timeout = min(timeout, lease_seconds / 3)
+                    if store.examining() == 0:
+                        # The workers are waiting for rpms other hosts hold. Those hosts wait for ours
+                        # in turn until they're done, so the shard with them is closed now.
+                        results.put(CLOSE_SHARD)
+
+    for p in workers:
+        p.join()
+    failed_workers = [p.name for p in workers if p.exitcode != 0]
+    if failed_workers:
+        # seen by the serializer once it gets None, so it doesn't publish a version missing their rpms
+        serializer_errors.append(Exception("%s errored out, the rpms they didn't finish are missing from the results" % ", ".join(failed_workers)))
+    results.put(None)
+    serializer.join()
+    if store:
+        unfinished = store.unfinished()
+        if unfinished:
+            terminal_msg(1, "%d rpms are still being examined by other hosts, or were left behind by hosts that stopped. " \
+                            "Run another host against %s to pick up any whose leases run out." % (unfinished, lease_file))
+        store.close()
+    if serializer_errors:
+        for e in serializer_errors[1:]:
+            terminal_msg(1, "Also failed: {}: {}".format(type(e).__name__, e))
+        raise serializer_errors[0]
 
     if mark_worker_dir_for_removal and (noclean == False):
         try:
@@ -352,34 +538,141 @@ def writer_process(cores, container_name, output_file, output_size):
             terminal_msg(1, "Unable to remove worker directory. \n\t Error message: {} {}".format(e.args, e))
 
 
-def cleanup_process_dir():
-    #Cleanup the current directory where we're working
+def map_iso():
+    """
+    Map the iso the rpms are read from, once per process. Workers forked from
+    the writer after it mapped the iso share its mapping.
+    """
+    global iso_map
+    if iso_map is None:
+        with open(iso_file, "rb") as f:
+            iso_map = mmap(f.fileno(), 0, access = ACCESS_READ)
+    return iso_map
+
+def rpm2cpio_source(filename):
+    """
+    Where rpm2cpio reads an rpm in the repository from.
+
+    Returns tuple (the file argument for rpm2cpio, the bytes to write to its stdin).
+    The bytes are None unless the rpms are read out of an iso, when they're a
+    view of the rpm in the mapped iso and the argument is "-" for stdin.
+    """
+    if iso_file:
+        offset, length = iso_extents[filename]
+        return ("-", memoryview(map_iso())[offset:offset + length])
+    return (path.join(rpm_repository_path, filename), None)
+
+def worker_context():
+    """
+    The multiprocessing context workers are started with. A fork server
+    imports the builder and its parsers once, and every worker is forked from
+    it ready to go, rather than from the writer with its threads and queues.
+    """
+    ctx = get_context(start_method)
+    if start_method == "forkserver":
+        preload = ["__main__", "assemblyparser", "async_runner", "byte_queue", "lease_store", "scratch_cleaner"]
+        if __name__ != "__main__":
+            # run() was called by another script
+            preload.append(__name__)
+        ctx.set_forkserver_preload(preload)
+    return ctx
+
+def worker_state():
+    """
+    Snapshot the module globals workers need, see WORKER_GLOBALS
+    """
+    return dict((name, globals()[name]) for name in WORKER_GLOBALS if name in globals())
+
+def start_worker(target, state, *args):
+    """
+    The entry point of worker processes. Puts the writer's globals back in
+    place, since a worker started by a fork server only has what was imported.
+    """
+    globals().update(state)
+    target(*args)
+
+def serialize_output(printer, sink_name, results, q_output, errors):
+    """
+    The writer's serializer thread. Prints the (output dict, size) pairs the
+    writer receives until it gets None, and/or adds them to the database as
+    version sink_name ("<prod>:<vers>"), then hands their bytes back to the
+    q_output budget. Either printer or sink_name may be None. The version is
+    rolled back instead of published if errors has any by then, e.g. from the
+    writer when a worker errored out.
+    """
+    store = None
+    sink = None
+    # rpms this host printed, but whose shard hasn't been closed yet
+    leased_rpms = []
+    item = False
+
     try:
-        entries = listdir(getcwd())
-        for en in entries:
-            if path.isdir(en):
-                retcode, _, _ = run_shell_cmd(["chmod -R a+wx", en])
-                if retcode != 0:
-                    log_err("Unable to change permissions on %s" % en)
-                retcode, _, _ = run_shell_cmd(["rm -rf", en])
-                if retcode != 0:
-                    log_err("Unable to remove %s" % en)
-                #rmtree(en)
-            else:
-                remove(en)
+        if lease_file:
+            store = lease_store.LeaseStore(lease_file, host_id, lease_seconds)
+        if sink_name:
+            # made on this thread, after the workers are forked, so it's the only one with its connection
+            sink = rpm_db_sink.DBSink(sink_name)
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            if item == CLOSE_SHARD:
+                if leased_rpms:
+                    shard_count = printer.filecount
+                    printer.end_file()
+                    store.complete(leased_rpms, "%s-%d.json" % (printer.base_filename, shard_count))
+                    leased_rpms = []
+                continue
+            output_dict, size = item
+            if printer:
+                shard_count = printer.filecount
+                printer.print_out(output_dict)
+            if sink:
+                sink.add(output_dict, size)
+            q_output.release(size)
+
+            if store:
+                store.written(output_dict.keys())
+                leased_rpms.extend(output_dict.keys())
+                if printer.filecount != shard_count:
+                    store.complete(leased_rpms, "%s-%d.json" % (printer.base_filename, shard_count))
+                    leased_rpms = []
+
+        if printer:
+            printer.close_out()
+        if sink and not errors:
+            sink.close()
+        if store:
+            store.complete(leased_rpms, "%s-%d.json" % (printer.base_filename, printer.filecount))
     except Exception as e:
-        log_err("Unable to cleanup directory")
-        log_err(getcwd())
-        log_err(str(e.args))
-        log_err(e.strerror) #issues: no strerror member?
-        log_err("---")
-        raise e
+        errors.append(e)
+        # Keep the budget moving so the writer and workers don't wait on us forever
+        while item is not None:
+            item = results.get()
+            if item not in (None, CLOSE_SHARD):
+                q_output.release(item[1])
+    finally:
+        if store:
+            store.close()
+
+    if sink and errors:
+        # what went wrong stays first in errors, a failed rollback is reported after it
+        try:
+            sink.abort()
+        except Exception as e:
+            errors.append(e)
+
+def rpm_package_name(rpm_dict):
+    """
+    The package name an rpm dict's output ends up keyed by
+    """
+    return grab_path_leaf(rpm_dict[FPATH].split(D_SEPARATOR)[0])
 
 def rpm_name_process(rpm_dict):
     """
     expecting a dict like this: {filepath: "/path/to/<rpm>.SEPARATOR.rpm", X86_64:True...}
     """
-    rpm_leafname = grab_path_leaf(rpm_dict[FPATH].split(D_SEPARATOR)[0])
+    rpm_leafname = rpm_package_name(rpm_dict)
     log_err("rpm_leafname is %s" % rpm_leafname)
     rpm_parts = rpm_leafname.split('-')
     #print(rpm_leafname)
@@ -415,12 +708,56 @@ def rpm_name_process(rpm_dict):
     return out
 
 
-def walk_for_execs():
+def debuginfo_index(debuginfo_list):
+    """
+    Index debuginfo rpms like /path/to/zlib-debuginfo-1.2.7-17.el7.x86_64.rpm
+    by version and release.arch, for find_debuginfo.
+    returns {(version, release.arch.rpm): [(source package name, path)]}
+    """
+    index = {}
+    for debuginfo_path in debuginfo_list:
+        try:
+            name, version, release = grab_path_leaf(debuginfo_path).rsplit("-", 2)
+        except ValueError:
+            continue
+        base = name[:-len("-debuginfo")] if name.endswith("-debuginfo") else name
+        index.setdefault((version, release), []).append((base, debuginfo_path))
+    return index
+
+def find_debuginfo(rpm_leaf, index):
+    """
+    Find the debuginfo rpm for a binary rpm. It has the same version, release
+    and architecture, and is named after the source package, which the binary
+    rpm's name starts with (zlib-devel goes with zlib-debuginfo).
+    returns the path of the debuginfo rpm or None
+    """
+    try:
+        name, version, release = rpm_leaf.rsplit("-", 2)
+    except ValueError:
+        return None
+    candidates = [(base, debuginfo_path) for base, debuginfo_path in index.get((version, release), [])
+                  if name == base or name.startswith(base + "-")]
+    if not candidates:
+        return None
+    # the most specific source package name wins
+    return max(candidates, key = lambda c: len(c[0]))[1]
+
+def package_path(x, top = "."):
+    """
+    The path a file unpacked under top is installed at by its rpm
+    """
+    return path.normpath("/" + path.relpath(x, top))
+
+def walk_for_execs(top = "."):
+    """
+    Find the ELF files unpacked under top, and the symlinks to them.
+    returns tuple ([executable], [(symlink name, target name, symlink install path)])
+    """
     execs_out = []
     orphan_leaves = []
     unwanted_file_types = (".js", ".gz", ".lua", ".conf", ".jar", ".tgz", ".tcl")
 
-    for root, dirs, files_in_dir in walk("."):
+    for root, dirs, files_in_dir in walk(top):
         for f in files_in_dir:
             full_path = path.join(root, f)
             if path.islink(full_path):
@@ -430,11 +767,11 @@ def walk_for_execs():
                 
                 if orphan_file.endswith(unwanted_file_types) or target.endswith(unwanted_file_types):
                     continue
-                orphan_leaves.append((orphan_file, target))
+                orphan_leaves.append((orphan_file, target, package_path(full_path, top)))
             else:
                 if is_elf_file(full_path):
                     execs_out.append(full_path)
-    orphan_leaves = [(orphan, target) for (orphan, target) in orphan_leaves for exec_out in execs_out if target in path.basename(exec_out)]
+    orphan_leaves = [(orphan, target, orphan_path) for (orphan, target, orphan_path) in orphan_leaves for exec_out in execs_out if target in path.basename(exec_out)]
     return execs_out, orphan_leaves
 
 
@@ -442,106 +779,264 @@ def grab_path_leaf(x):
     path_list = x.split("/")
     return path_list[-1]
 
+def parse_dynamic_lines(readelf_lines):
+    """
+    Pick the dependencies, rpaths and soname out of "readelf -d" lines like
+     0x0000000000000001 (NEEDED)             Shared library: [libc.so.6]
+     0x000000000000000f (RPATH)              Library rpath: [/usr/lib/foo]
+     0x000000000000001d (RUNPATH)            Library runpath: [$ORIGIN/../lib]
+     0x000000000000000e (SONAME)             Library soname: [libfoo.so.1]
+    returns tuple ([needed], [rpath], [runpath], soname or "")
+    """
+    sonames = [soname_match.match(x).group("soname") for x in readelf_lines if soname_match.match(x)]
+
+    return ([needed_match.match(x).group("needed_so") for x in readelf_lines if needed_match.match(x)],
+            [rpath_match.match(x).group("rpath_so") for x in readelf_lines if rpath_match.match(x)],
+            [runpath_match.match(x).group("runpath_so") for x in readelf_lines if runpath_match.match(x)],
+            sonames[0] if sonames else "")
+
 def readelf_grab(x):
     #issues: document output format
-    retcode, readelf_output, readelf_err = run_shell_cmd(["readelf -d", x, " | grep 'NEEDED\|RPATH\|RUNPATH'"])
+    retcode, readelf_output, readelf_err = run_shell_cmd(["readelf -d", x, " | grep 'NEEDED\|RPATH\|RUNPATH\|SONAME'"])
     #print(readelf_output)
     #print(readelf_err)
     if retcode in (0, 1):
         log_err(readelf_output)
-        readelf_lines = readelf_output.splitlines()
-
-        needed_match_str = "^.*NEEDED.*\[(?P<needed_so>.*)\].*"
-        needed_match = re.compile(needed_match_str)
-        rpath_match_str = "^.*PATH.*\[(?P<rpath_so>.*)\].*"
-        rpath_match = re.compile(rpath_match_str)
-
-        return ([needed_match.match(x).group("needed_so") for x in readelf_lines if needed_match.match(x)],
-                [rpath_match.match(x).group("rpath_so") for x in readelf_lines if rpath_match.match(x)])
+        return parse_dynamic_lines(readelf_output.splitlines())
     else:
         log_err(readelf_err)
         raise Exception("readelf unexpectedly terminated by signal %d " % -retcode)
 
-def symbol_grab(x):
+def parse_build_id_lines(notes_lines):
     """
-    Grab and process the symbols. The expected output from the shell cmd will be
-    TYPE:BINDING:SYMBOL
-    So, FUNC:GLOBAL:tmconf_mcpmsg_set_metadata
-    would be processed into
-    {symbol: tmconf_mcpmsg_set_metadat, typ: FUNC, binding: GLOBAL, at: ""}
-    Some (GLIBC functions in particular) may look something like this
-    FUNC:WEAK:symbol@GLIBC_2.2.5
-    the last part goes into the "at" entry
-    {symbol: symbol, typ: TYPE, binding: WEAK, at: "GLIBC_2.2.5"}
+    Pick the GNU build-id out of "readelf -n" lines like
+        Build ID: 8c4e05cd0e8e6ad4f3d2b6ea5e4b6e1a0f5e7c42
+    returns the hex string, or None if the executable has no build-id note
     """
-    cmd_str = "readelf -s --wide %s | awk \' $1 ~ /[0-9]\:$/ {print $4\":\"$5\":\"$7\":\"$8}\'" % x
-    retcode, symbols, symbol_err = run_shell_cmd(cmd_str)
-    output = {}
+    for line in notes_lines:
+        fields = line.split("Build ID:")
+        if len(fields) == 2 and fields[1].strip():
+            return fields[1].strip()
+    return None
+
+def content_hash(x):
+    """
+    The stand-in identity for executables linked without a build-id note,
+    a sha256 of the file read in chunks so big executables aren't loaded whole.
+    returns "sha256:<hex>"
+    """
+    digest = hashlib.sha256()
+    with open(x, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+    return "sha256:" + digest.hexdigest()
+
+def buildid_grab(x):
+    """
+    Grab the GNU build-id of an executable, which identifies the same binary
+    across rpms and versions without comparing contents. Falls back to a
+    content hash when there's no build-id note.
+    """
+    retcode, notes, notes_err = run_shell_cmd(["readelf -n --wide", x])
+    build_id = None
     if retcode == 0:
-        symbol_list = symbols.split('\n')
+        build_id = parse_build_id_lines(notes.splitlines())
+    else:
+        log_err(notes_err)
 
-        for s in symbol_list:
-            s_info = s.split(":")
+    if build_id:
+        return build_id
+    return content_hash(x)
 
-            if (len(s_info) != 4):
-                if s_info:
-                    log_err("symbols split into " + ":".join(s_info))
-                    log_err("***")
-                continue
+def symbol_grab(x, include_local = False):
+    """
+    Grab and process the symbols of an executable from "readelf -s", and their
+    versions from "readelf -V". See symbols_from_readelf for the output.
+    LOCAL symbols are skipped unless include_local is set.
+    """
+    retcode, symbols, symbol_err = run_shell_cmd(["readelf -s --wide", x])
+    if retcode != 0:
+        log_err(symbol_err)
+        return {}
 
-            typ = s_info[0]
-            bind = s_info[1]
-            if bind == "LOCAL":
-                continue
-            #print(s_info[2])
-            if s_info[2] == "UND":
-                defed = "NO"
-            else:
-                defed = "YES"
-            sym_list = s_info[3].split("@")
-            symbol = s_info[3]
+    retcode, versions, version_err = run_shell_cmd(["readelf -V --wide", x])
+    if retcode != 0:
+        log_err(version_err)
+        versions = ""
+
+    return symbols_from_readelf(symbols.splitlines(), versions.splitlines(), include_local)
 
-            if (typ not in ("FUNC", "IFUNC")):
-                log_err("Skipping adding %s, type %s, bind %s, defined? %s" % (symbol, typ, bind, defed))
+def readelf_symbol_fields(line):
+    """
+    Split a "readelf -s --wide" line like
+         2: 0000000000000000     0 FUNC    GLOBAL DEFAULT  UND puts@GLIBC_2.2.5 (2)
+    returns [TYPE, BINDING, NDX, SYMBOL] or None for lines that aren't symbols
+    """
+    fields = line.split()
+    if not fields or not symbol_num_match.search(fields[0]):
+        return None
+    fields.extend([""] * (8 - len(fields)))
+    return [fields[3], fields[4], fields[6], fields[7]]
+
+def parse_version_lines(version_lines):
+    """
+    Read the symbol versions out of "readelf -V --wide" lines. The
+    .gnu.version section gives the version of each .dynsym entry, like
+      000:   0 (*local*)       2h(GLIBC_2.2.5)   3 (ZLIB_1.2.0)
+    where h marks a hidden (non-default) version. .gnu.version_r gives the
+    file each needed version comes from
+      000000: Version: 1  File: libc.so.6  Cnt: 1
+      0x0010:   Name: GLIBC_2.2.5  Flags: none  Version: 2
+    returns {.dynsym index: (version, hidden, file)}
+    """
+    versym = {}
+    needed_from = {}
+    section = None
+    needed_file = ""
+
+    for line in version_lines:
+        if line.startswith("Version symbols section"):
+            section = "versym"
+            continue
+        elif line.startswith("Version needs section"):
+            section = "verneed"
+            continue
+        elif line.startswith("Version definition section"):
+            section = "verdef"
+            continue
+
+        if section == "versym":
+            start, _, entries = line.partition(":")
+            try:
+                num = int(start, 16)
+            except ValueError:
                 continue
-            long_name = cppdemangle(sym_list[0])
-            at = ""
+            for offset, entry in enumerate(versym_match.finditer(entries)):
+                version_index = int(entry.group("index"), 16)
+                version = entry.group("version")
+                if version_index < 2:
+                    # *local* and *global*, unversioned
+                    version = ""
+                versym[num + offset] = (version_index, version, entry.group("hidden") == "h")
+        elif section == "verneed":
+            if "File:" in line:
+                needed_file = line.split("File:")[1].split()[0]
+            elif "Name:" in line and "Version:" in line:
+                needed_from[int(line.split("Version:")[1].split()[0])] = needed_file
+
+    return dict((num, (version, hidden, needed_from.get(version_index, "")))
+                for num, (version_index, version, hidden) in versym.items())
+
+def symbols_from_readelf(symbol_lines, version_lines = (), include_local = False):
+    """
+    Build the symbol dict of an executable from "readelf -s --wide" and
+    "readelf -V --wide" lines. .dynsym entries are matched up with their
+    versions by symbol number. Entries of other symbol tables (.symtab) don't
+    replace a .dynsym entry spelled the same way.
+    returns {SYMBOL: symbol info}, see add_symbol
+    """
+    versions = parse_version_lines(version_lines)
+    output = {}
+    table = None
 
-            if (len(sym_list) >= 2):
-                at = sym_list[-1]
+    for line in symbol_lines:
+        if line.startswith("Symbol table"):
+            table = line.split("'")[1]
+            continue
+        s_info = readelf_symbol_fields(line)
+        if not s_info:
+            continue
+        if table == ".dynsym":
+            add_symbol(output, s_info, include_local, versions.get(int(line.split()[0][:-1])))
+        elif s_info[3] not in output:
+            add_symbol(output, s_info, include_local)
 
-            symbol_info = {"type": typ, "binding": bind, "defined": defed, "long_name": long_name.strip(), "at": at}
+    return output
 
-            output[symbol] = symbol_info
+def add_symbol(output, s_info, include_local = False, version_info = None):
+    """
+    Add a symbol split into [TYPE, BINDING, NDX, SYMBOL] to the output dict.
+    FUNC, GLOBAL, UND, puts@GLIBC_2.2.5 is added as
+    {"puts@GLIBC_2.2.5": {type: FUNC, binding: GLOBAL, defined: NO, long_name: puts, at: GLIBC_2.2.5,
+                          name: puts, version: GLIBC_2.2.5, hidden: False, default: False, file: libc.so.6}}
+    version_info is (version, hidden, file) from the versioning sections. Without
+    it the version comes from the spelling of the symbol and file is unknown.
+    default marks the definitions an unversioned reference binds to.
+    """
+    if (len(s_info) != 4):
+        if s_info:
+            log_err("symbols split into " + ":".join(s_info))
+            log_err("***")
+        return
+
+    typ = s_info[0]
+    bind = s_info[1]
+    if bind == "LOCAL" and not include_local:
+        return
+    #print(s_info[2])
+    if s_info[2] == "UND":
+        defed = "NO"
     else:
-        log_err(symbol_err)
+        defed = "YES"
+    sym_list = s_info[3].split("@")
+    symbol = s_info[3]
 
-    return output
+    if (typ not in ("FUNC", "IFUNC")):
+        log_err("Skipping adding %s, type %s, bind %s, defined? %s" % (symbol, typ, bind, defed))
+        return
+    long_name = cppdemangle(sym_list[0])
+    at = ""
+
+    if (len(sym_list) >= 2):
+        at = sym_list[-1]
+
+    if version_info:
+        version, hidden, needed_file = version_info
+    else:
+        version = at
+        hidden = defed == "YES" and at != "" and "@@" not in symbol
+        needed_file = ""
+
+    symbol_info = {"type": typ, "binding": bind, "defined": defed, "long_name": long_name.strip(), "at": at,
+                   "name": sym_list[0], "version": version, "hidden": hidden,
+                   "default": defed == "YES" and not hidden, "file": needed_file}
+
+    output[symbol] = symbol_info
 
 
 def readelf_list_process(executables):
     """
     Run readelf to get the executable dependencies and rpaths for the executable files
     """
+    return collect_readelf_data((x, readelf_grab(x), symbol_grab(x), buildid_grab(x)) for x in executables)
+
+def collect_readelf_data(readelf_data, top = "."):
+    """
+    Organize the readelf results into the per rpm output.
+    readelf_data is an iterable of (executable, (dependencies, rpaths, runpaths, soname), symbols, build-id)
+    for executables unpacked under top
+    """
     so_dict = {}
     full_exec_set = set()
     full_depend_set = set()
-    for x in executables:
+    for x, (dep_list, rpath_list, runpath_list, soname), symbol_dict, build_id in readelf_data:
         exec_name = grab_path_leaf(x)
 
         full_exec_set.add(exec_name)
 
-        so_dict.setdefault(exec_name, {"dependencies":[], "symbols" : {}, "rpath" : []})
-
-        dep_list, rpath_list = readelf_grab(x)
+        so_dict.setdefault(exec_name, {"dependencies":[], "symbols" : {}, "rpath" : [], "runpath" : []})
 
         so_dict[exec_name]["dependencies"].extend(dep_list)
         so_dict[exec_name]["rpath"].extend(rpath_list)
+        so_dict[exec_name]["runpath"].extend(runpath_list)
+        so_dict[exec_name]["soname"] = soname
+        so_dict[exec_name]["path"] = package_path(x, top)
         full_depend_set |= set(dep_list)
         so_dict[exec_name]["dependencies"] = list(set(so_dict[exec_name]["dependencies"]))
 
-        symbol_dict = symbol_grab(x)
         so_dict[exec_name]["symbols"].update(symbol_dict)
+        so_dict[exec_name]["build_id"] = build_id
+        so_dict[exec_name]["elf_class"] = elf_class(x)
 
         log_err("%s has %d dependencies and  %d symbols" % (exec_name, len(dep_list), len(symbol_dict)))
 
@@ -551,23 +1046,136 @@ def readelf_list_process(executables):
     output["executables"] = so_dict
     return output
 
+def parse_text_section(section_lines):
+    """
+    Find .text in "readelf -S --wide" lines like
+      [16] .text             PROGBITS        0000000000004b20 004b20 012a52 00  AX  0   0 16
+    returns tuple (address, size), or None if there is no .text
+    """
+    for line in section_lines:
+        match = section_header_match.search(line)
+        if match and match.group("name") == ".text":
+            return int(match.group("address"), 16), int(match.group("size"), 16)
+    return None
+
+def parse_function_addresses(symbol_lines):
+    """
+    The addresses functions start at, from "readelf -s --wide" lines
+    returns a sorted list of addresses
+    """
+    addresses = set()
+    for line in symbol_lines:
+        fields = line.split()
+        if len(fields) < 8 or not symbol_num_match.search(fields[0]):
+            continue
+        if fields[3] == "FUNC" and fields[6] != "UND":
+            addresses.add(int(fields[1], 16))
+    return sorted(addresses)
+
+def split_text(text_section, function_addresses, ranges):
+    """
+    Cut .text into about equal address ranges, at the start of a function so
+    no function is cut in two. The first range is open at the start and the
+    last at the end, which keeps .init, .plt, .fini and the like in them.
+    returns a list of (start, stop) tuples, None standing for an open end
+    """
+    start, size = text_section
+    cuts = []
+    for i in range(1, ranges):
+        n = bisect_left(function_addresses, start + size * i // ranges)
+        if n < len(function_addresses) and function_addresses[n] < start + size:
+            if not cuts or function_addresses[n] > cuts[-1]:
+                cuts.append(function_addresses[n])
+
+    bounds = [None] + cuts + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def may_split(x):
+    """
+    Whether x could have enough .text to be disassembled in ranges, going by
+    its size alone (.text is never bigger than the file)
+    """
+    return split_threshold > 0 and split_ranges > 1 and path.getsize(x) > split_threshold
+
+def text_ranges(x, section_lines, symbol_lines):
+    """
+    The address ranges to disassemble x in, given its "readelf -S" and
+    "readelf -s" output. That's one range covering everything unless its
+    .text is bigger than split_threshold.
+    """
+    text_section = parse_text_section(section_lines)
+    if not text_section or text_section[1] <= split_threshold:
+        return [(None, None)]
+    ranges = split_text(text_section, parse_function_addresses(symbol_lines), split_ranges)
+    log_err("%s: disassembling %d bytes of .text in %d ranges" % (x, text_section[1], len(ranges)))
+    return ranges
+
+def objdump_cmd(x, start = None, stop = None):
+    cmd = ["objdump", "-d"]
+    if start is not None:
+        cmd.append("--start-address=0x%x" % start)
+    if stop is not None:
+        cmd.append("--stop-address=0x%x" % stop)
+    cmd.append(x)
+    return cmd
+
+def merge_defined_functions(defined_function_maps):
+    """
+    Merge the defined functions found in separately disassembled address
+    ranges of an executable. objdump labels the instructions a range starts
+    with after the function they're in (<foo+0x40>), so a function can show
+    up in two ranges; it calls whatever it calls in either of them.
+    """
+    merged = {}
+    for defined_functions in defined_function_maps:
+        for name, function_data in defined_functions.items():
+            if name not in merged:
+                merged[name] = function_data
+                continue
+            called = merged[name]["called_functions"]
+            known = set(c["function"] for c in called)
+            called.extend(c for c in function_data["called_functions"] if c["function"] not in known)
+    return {"defined_functions": merged}
+
+def disassemble_range(x, start, stop):
+    """
+    objdump and parse one address range of x
+    returns the defined functions found in it
+    """
+    _, assembly_code, _ = run_shell_cmd(objdump_cmd(x, start, stop))
+    return assemblyparser.AssemblyRaw(text = assembly_code).create_json_data()["defined_functions"]
+
 def objdump_process(executables):
     """
     Objdump the executables into a file <executable>-dump
     """
     assembly_objs = {}
     for x in executables:
-        _, assembly_code, _ = run_shell_cmd("objdump -d " + x)
-        assembly_code = assembly_code
-        assembly_obj = assemblyparser.AssemblyRaw(text = assembly_code)
-        assembly_objs[path.basename(x)] = assembly_obj.create_json_data()
+        ranges = [(None, None)]
+        if may_split(x):
+            _, section_out, _ = run_shell_cmd(["readelf -S --wide", x])
+            _, symbol_out, _ = run_shell_cmd(["readelf -s --wide", x])
+            ranges = text_ranges(x, section_out.splitlines(), symbol_out.splitlines())
+
+        if len(ranges) == 1:
+            _, assembly_code, _ = run_shell_cmd("objdump -d " + x)
+            assembly_obj = assemblyparser.AssemblyRaw(text = assembly_code)
+            assembly_objs[path.basename(x)] = assembly_obj.create_json_data()
+        else:
+            # parsing is what takes the time, so every range gets a process of
+            # its own. All they run is disassemble_range, so forking them is fine.
+            with ProcessPoolExecutor(max_workers = len(ranges), mp_context = get_context("fork")) as pool:
+                defined_function_maps = pool.map(disassemble_range, [x] * len(ranges),
+                                                 [r[0] for r in ranges], [r[1] for r in ranges])
+                assembly_objs[path.basename(x)] = merge_defined_functions(defined_function_maps)
 
     return assembly_objs
 
-def run_shell_cmd(x):
+def run_shell_cmd(x, input_data = None):
     """
     Runs a shell cmd, returns tuple (retcode, stdout, stderr).
-    Obviously runs as a full shell cmd, so avoid using untrusted input
+    Obviously runs as a full shell cmd, so avoid using untrusted input.
+    input_data, if given, is written to the cmd's stdin.
     """
     stdout_tmp = TemporaryFile()
     stderr_tmp = TemporaryFile()
@@ -578,8 +1186,8 @@ def run_shell_cmd(x):
     if (isinstance(x, list)):
         cmd_str = " ".join(x)
 
-    p = Popen(cmd_str, stdout = stdout_tmp, stderr = stderr_tmp, shell=True)
-    p.wait()
+    p = Popen(cmd_str, stdin = None if input_data is None else PIPE, stdout = stdout_tmp, stderr = stderr_tmp, shell=True)
+    p.communicate(input_data)
 
     stdout_tmp.seek(0)
     stderr_tmp.seek(0)
@@ -618,21 +1226,131 @@ def merge_data(readelf_list, objdump_list):
 
 def rehome_orphans(output, orphans):
     executables = output["executables"]
-    for symlink, target in orphans:
+    for symlink, target, symlink_path in orphans:
         try:
-            symlink_data = executables[target]
+            # the symlink shares everything but its own name and path with the target
+            symlink_data = dict(executables[target])
         except KeyError:
             #print("Unable to rehome " + symlink + " targeted to " + target)
             continue
         output["All executables"].append(symlink)
         symlink_data["Symlink Target"] = target
+        symlink_data["path"] = symlink_path
         new_symlink_dict = {symlink: symlink_data}
         output["executables"].update(new_symlink_dict)
 
     return output
 
-def process_executables(executables):
+def debuginfo_member(build_id):
+    """
+    The build-id symlink a debuginfo rpm carries for the .debug file of an executable
+    """
+    return path.join(DEBUG_ROOT, ".build-id", build_id[:2], build_id[2:] + ".debug")
+
+def parse_cpio_listing(listing_lines):
+    """
+    Pick the members and symlinks out of "cpio -itv" lines like
+    lrwxrwxrwx   1 root     root   55 Jun 10  2014 ./usr/lib/debug/.build-id/8c/4e05cd0e8e.debug -> ../../usr/lib64/libz.so.1.2.7.debug
+    returns tuple ({/member/path: name in the archive}, {/symlink/path: /target/path})
+    """
+    members = {}
+    links = {}
+    for line in listing_lines:
+        fields = line.split(None, 8)
+        if len(fields) != 9:
+            continue
+        name, _, target = fields[8].partition(" -> ")
+        member = path.normpath("/" + name)
+        members[member] = name
+        if fields[0].startswith("l") and target:
+            links[member] = path.normpath(path.join(path.dirname(member), target))
+    return members, links
+
+def debuginfo_wanted(executables, members, links):
+    """
+    Find the .debug files of an rpm's executables in the listing of its
+    debuginfo rpm, by build-id. Executables with only a content hash can't be paired.
+    returns {name of the .debug file in the archive: [executables]}
+    """
+    wanted = {}
+    for exec_name, exec_data in executables.items():
+        build_id = exec_data.get("build_id") or ""
+        if not build_id or build_id.startswith("sha256:"):
+            continue
+        member = debuginfo_member(build_id)
+        hops = 0
+        while member in links and hops < 8:
+            member = links[member]
+            hops += 1
+        if member in members and member not in links:
+            wanted.setdefault(members[member], []).append(exec_name)
+    return wanted
+
+def write_members_file(debug_dir, wanted):
+    """
+    Write the cpio patterns (see cpio -E) matching exactly the wanted .debug files.
+    returns the name of the file
+    """
+    members_file = path.join(debug_dir, "members")
+    with open(members_file, "w") as f:
+        for member in wanted:
+            f.write(escape(member) + "\n")
+    return members_file
+
+def debuginfo_path(debug_dir, member):
+    return path.join(debug_dir, path.normpath("/" + member).lstrip("/"))
+
+def add_debuginfo_symbols(executables, exec_names, debug_symbols):
+    """
+    Add the static functions from a .debug file to the symbol tables of its
+    executables. Symbols the executable already has are kept as they are.
+    returns the number of symbols added
+    """
+    added = 0
+    for exec_name in exec_names:
+        symbols = executables[exec_name]["symbols"]
+        for symbol, symbol_info in debug_symbols.items():
+            if symbol_info["binding"] == "LOCAL" and symbol not in symbols:
+                symbols[symbol] = dict(symbol_info)
+                added += 1
+    return added
+
+def pair_debuginfo_rpm(output, debuginfo_rpm):
+    """
+    Add the static functions of the executables in output from their .debug
+    files in debuginfo_rpm, the name of a debuginfo rpm in the repository.
+    The debuginfo rpm is read twice, once to list it and once to unpack only
+    the .debug files that are needed.
+    """
+    executables = output["executables"]
+    rpm_arg, rpm_data = rpm2cpio_source(debuginfo_rpm)
+    retcode, listing, listing_err = run_shell_cmd(["rpm2cpio", rpm_arg, "| cpio -itv"], rpm_data)
+    if retcode != 0:
+        log_err(listing_err)
+
+    wanted = debuginfo_wanted(executables, *parse_cpio_listing(listing.splitlines()))
+    if not wanted:
+        log_err("No .debug files in %s for %s" % (debuginfo_rpm, ", ".join(executables)))
+        return output
+
+    debug_dir = path.abspath(DEBUGINFO_SCRATCH)
+    mkdir(debug_dir)
+    members_file = write_members_file(debug_dir, wanted)
+    retcode, _, unpack_err = run_shell_cmd(["cd", debug_dir, "&& rpm2cpio", rpm_arg,
+                                            "| cpio -idm --no-preserve-owner -E", members_file], rpm_data)
+    if retcode != 0:
+        log_err(unpack_err)
+
+    for member, exec_names in wanted.items():
+        added = add_debuginfo_symbols(executables, exec_names, symbol_grab(debuginfo_path(debug_dir, member), include_local = True))
+        log_err("%s: added %d static functions from %s" % (", ".join(exec_names), added, member))
+    return output
+
+def process_executables(executables, debuginfo_rpm = None):
     readelf_list = readelf_list_process(executables)
+    if debuginfo_rpm:
+        # before merge_data, so the functions objdump finds get their real binding
+        readelf_list = pair_debuginfo_rpm(readelf_list, debuginfo_rpm)
     objdump_list = objdump_process(executables)
     #output.update(readelf_list)
     #output.update(objdump_list)
@@ -645,11 +1363,237 @@ def process_rpm(rpm_dict):
 
     executables, orphans = walk_for_execs()
 
-    executable_information = process_executables(executables)
+    executable_information = process_executables(executables, rpm_dict.get(DEBUGINFO))
     output.update(executable_information)
     output = rehome_orphans(output, orphans)
     return output
 
+async def examine_executable_async(runner, x):
+    """
+    Run readelf and objdump on an executable at the same time, parsing their
+    output as it streams in.
+    returns tuple (executable, (dependencies, rpaths, runpaths, soname), symbols, build-id, assembly json data)
+    """
+    dynamic_lines = []
+    notes_lines = []
+    symbol_lines = []
+    version_lines = []
+
+    ranges = [(None, None)]
+    if may_split(x):
+        section_lines = []
+        await asyncio.gather(runner.stream(["readelf", "-S", "--wide", x], section_lines.append),
+                             runner.stream(["readelf", "-s", "--wide", x], symbol_lines.append))
+        ranges = text_ranges(x, section_lines, symbol_lines)
+        symbol_lines = []
+    # the objdumps of the ranges run at the same time, each feeding a parser of its own
+    assembly_objs = [assemblyparser.AssemblyRaw(incremental = True) for _ in ranges]
+
+    def dynamic_line(line):
+        if "NEEDED" in line or "PATH" in line or "SONAME" in line:
+            dynamic_lines.append(line)
+
+    retcodes = await asyncio.gather(runner.stream(["readelf", "-d", x], dynamic_line),
+                                    runner.stream(["readelf", "-s", "--wide", x], symbol_lines.append),
+                                    runner.stream(["readelf", "-V", "--wide", x], version_lines.append),
+                                    runner.stream(["readelf", "-n", "--wide", x], notes_lines.append),
+                                    *[runner.stream(objdump_cmd(x, start, stop), assembly_obj.feed)
+                                      for (start, stop), assembly_obj in zip(ranges, assembly_objs)])
+    if any(r not in (0, 1) for r in retcodes):
+        log_err("readelf/objdump returned %s for %s" % (str(retcodes), x))
+
+    build_id = parse_build_id_lines(notes_lines)
+    if not build_id:
+        build_id = await asyncio.get_event_loop().run_in_executor(None, content_hash, x)
+
+    for assembly_obj in assembly_objs:
+        assembly_obj.finish()
+    if len(assembly_objs) == 1:
+        assembly_data = assembly_objs[0].create_json_data()
+    else:
+        assembly_data = merge_defined_functions([a.create_json_data()["defined_functions"] for a in assembly_objs])
+    return (x, parse_dynamic_lines(dynamic_lines), symbols_from_readelf(symbol_lines, version_lines), build_id,
+            assembly_data)
+
+async def process_rpm_async(runner, rpm_dict, filename, scratch):
+    """
+    The async engine's version of process_rpm, working in its own scratch
+    directory instead of the current one.
+    """
+    rpm_arg, rpm_data = rpm2cpio_source(filename)
+    retcodes = await runner.extract_rpm(rpm_arg, scratch, rpm_data = rpm_data)
+    if retcodes != (0, 0):
+        log_err("%s errored out unpacking %s: %s" % (process_name, filename, str(retcodes)))
+
+    output = rpm_name_process(rpm_dict)
+    executables, orphans = walk_for_execs(scratch)
+
+    examined = await asyncio.gather(*[examine_executable_async(runner, x) for x in executables])
+    readelf_list = collect_readelf_data(((x, dynamic, symbols, build_id) for x, dynamic, symbols, build_id, _ in examined), scratch)
+    if DEBUGINFO in rpm_dict:
+        await pair_debuginfo_rpm_async(runner, readelf_list, rpm_dict[DEBUGINFO], scratch)
+    objdump_list = dict((path.basename(x), assembly) for x, _, _, _, assembly in examined)
+
+    output.update(merge_data(readelf_list, objdump_list))
+    output = rehome_orphans(output, orphans)
+    return output
+
+async def pair_debuginfo_rpm_async(runner, output, debuginfo_rpm, scratch):
+    """
+    The async engine's version of pair_debuginfo_rpm
+    """
+    executables = output["executables"]
+    rpm_arg, rpm_data = rpm2cpio_source(debuginfo_rpm)
+    listing = []
+    retcodes = await runner.list_rpm(rpm_arg, listing.append, rpm_data = rpm_data)
+    if retcodes != (0, 0):
+        log_err("%s errored out listing %s: %s" % (process_name, debuginfo_rpm, str(retcodes)))
+
+    wanted = debuginfo_wanted(executables, *parse_cpio_listing(listing))
+    if not wanted:
+        log_err("No .debug files in %s for %s" % (debuginfo_rpm, ", ".join(executables)))
+        return
+
+    debug_dir = path.join(scratch, DEBUGINFO_SCRATCH)
+    mkdir(debug_dir)
+    retcodes = await runner.extract_rpm(rpm_arg, debug_dir, write_members_file(debug_dir, wanted), rpm_data = rpm_data)
+    if retcodes != (0, 0):
+        log_err("%s errored out unpacking %s: %s" % (process_name, debuginfo_rpm, str(retcodes)))
+
+    async def debug_symbols(member):
+        symbol_lines = []
+        await runner.stream(["readelf", "-s", "--wide", debuginfo_path(debug_dir, member)], symbol_lines.append)
+        return symbols_from_readelf(symbol_lines, include_local = True)
+
+    members = list(wanted)
+    for member, symbols in zip(members, await asyncio.gather(*[debug_symbols(m) for m in members])):
+        added = add_debuginfo_symbols(executables, wanted[member], symbols)
+        log_err("%s: added %d static functions from %s" % (", ".join(wanted[member]), added, member))
+
+def queued_rpms(q_files):
+    """
+    Yield the rpm dicts a worker should examine, taken from q_files or, when
+    several hosts share the work, leased from the lease store.
+    """
+    if lease_file:
+        store = lease_store.LeaseStore(lease_file, host_id, lease_seconds)
+        while True:
+            x = store.lease()
+            if x:
+                yield x
+            elif store.outstanding() == 0:
+                break
+            else:
+                # Other hosts hold the rest, wait around in case one of them dies
+                sleep(min(30, lease_seconds / 3))
+        store.close()
+    else:
+        # q_files.empty() can't be trusted right after the writer filled the
+        # queue (its feeder thread may not have flushed yet), so rely on the None
+        # the writer puts at the end for each worker, or the timeout
+        while True:
+            try:
+                x = q_files.get(block = True, timeout = 2)
+            except Empty:
+                return
+            if x is None:
+                return
+            yield x
+
+async def async_worker_loop(q_output, q_files, full_worker_dir, cleaner):
+    runner = async_runner.AsyncCommandRunner(async_subprocesses)
+    loop = asyncio.get_running_loop()
+    # one thread hands out rpms to all the slots, so the generator is never entered twice
+    rpm_source = queued_rpms(q_files)
+    rpm_source_thread = ThreadPoolExecutor(max_workers = 1)
+    # rpms that errored out, the other slots carry on without them
+    failed = []
+
+    async def rpm_slot(slot):
+        scratch = path.join(full_worker_dir, "rpm-%d" % slot)
+        if path.exists(scratch):
+            # Left behind by an earlier run
+            cleaner.discard(scratch)
+        while True:
+            x = await loop.run_in_executor(rpm_source_thread, next, rpm_source, None)
+            if x is None:
+                return
+
+            log_err("PROCESSING: %s" % str(x))
+            filename = rpm_filename(x)
+            mkdir(scratch)
+            try:
+                processed_data = await process_rpm_async(runner, x, filename, scratch)
+                # put() blocks while the writer is behind, so keep it off the event loop
+                await loop.run_in_executor(None, q_output.put, {processed_data["package"] : processed_data})
+            except Exception as e:
+                log_err("%s errored out on %s" % (process_name, filename))
+                log_err(e)
+                terminal_msg(1, "%s errored out on %s" % (process_name, filename))
+                failed.append(filename)
+                # left in the repository, for a restart to pick up
+                continue
+            finally:
+                cleaner.discard(scratch, filename)
+            unlink(path.join(rpm_repository_path, filename))
+
+    await asyncio.gather(*[rpm_slot(slot) for slot in range(async_rpms)])
+    rpm_source_thread.shutdown()
+    log_err("%s ran %d commands" % (process_name, runner.commands_run))
+    return failed
+
+def async_worker_process(q_output, q_files, name, worker_dir):
+    """
+    Like worker_process, but works on async_rpms rpms at a time, with up to
+    async_subprocesses readelf/objdump/rpm2cpio processes running for them.
+    An rpm that errors out doesn't stop the others, the process exits non-zero
+    once they're done instead.
+    """
+    chdir(current_directory)
+
+    global rpm_repository_path
+    rpm_repository_path = path.abspath(path.join(worker_dir, "rpm-repository"))
+    full_worker_dir = path.abspath(path.join(worker_dir, name))
+    global process_name
+    process_name = name
+
+    try:
+        mkdir(full_worker_dir)
+    except OSError:
+        #already there, no worries
+        pass
+
+    chdir(full_worker_dir)
+    cleaner = scratch_cleaner.ScratchCleaner(path.join(full_worker_dir, "trash"), log_err)
+    failed = asyncio.run(async_worker_loop(q_output, q_files, full_worker_dir, cleaner))
+    cleaner.close()
+
+    if failed:
+        log_err("%s errored out on %d rpms: %s" % (name, len(failed), ", ".join(failed)))
+        err_file.close()
+        # how the writer finds out
+        exit(1)
+    log_err(name + " has completed!")
+    err_file.close()
+
+def rpm_filename(x):
+    """
+    Turn a queued rpm dict back into the name of the rpm file we'll examine
+    """
+    filename = x[FPATH] #contains SEPARATOR
+    if x[X86_64]:
+        filename = filename.replace(SEPARATOR, X86_64)
+    elif x[I686]:
+        filename = filename.replace(SEPARATOR, I686)
+    elif x[NOARCH]:
+        filename = filename.replace(SEPARATOR, NOARCH)
+    elif x[PPC]:
+        filename = filename.replace(SEPARATOR, PPC)
+    else:
+        #do nothing since we didn't change rpm name
+        pass
+    return filename
+
 def worker_process(q_output, q_files, name, worker_dir):
     """
     Ensure name is unique.
@@ -667,7 +1611,9 @@ def worker_process(q_output, q_files, name, worker_dir):
     global current_directory
     chdir(current_directory)
 
-    full_worker_dir = path.join(worker_dir, name)
+    global rpm_repository_path
+    rpm_repository_path = path.abspath(path.join(worker_dir, "rpm-repository"))
+    full_worker_dir = path.abspath(path.join(worker_dir, name))
     global process_name
     process_name = name
 
@@ -687,32 +1633,26 @@ def worker_process(q_output, q_files, name, worker_dir):
     #print(full_worker_dir)
     devnull_f = open(devnull, "w") #To not redirect stdout/stderr
 
-    while (q_files.empty() == False):
-        try:
-            x = q_files.get(block = True, timeout = 2)
-        except Empty:
-            return
+    # Each rpm is unpacked into scratch, which is handed to the cleaner
+    # afterwards instead of being removed before the next rpm can start
+    scratch = path.join(full_worker_dir, "scratch")
+    tmpfile = path.join(full_worker_dir, "tmpfile")
+    cleaner = scratch_cleaner.ScratchCleaner(path.join(full_worker_dir, "trash"), log_err)
+    if path.exists(scratch):
+        # Left behind by an earlier run
+        cleaner.discard(scratch)
 
+    for x in queued_rpms(q_files):
         #Received a dict here
-        filename = x[FPATH] #contains SEPARATOR
-        if x[X86_64]:
-            filename = filename.replace(SEPARATOR, X86_64)
-        elif x[I686]:
-            filename = filename.replace(SEPARATOR, I686)
-        elif x[NOARCH]:
-            filename = filename.replace(SEPARATOR, NOARCH)
-        elif x[PPC]:
-            filename = filename.replace(SEPARATOR, PPC)
-        else:
-            #do nothing since we didn't change rpm name
-            pass
+        filename = rpm_filename(x)
         #print(filepath)
-        with open ("tmpfile", 'w') as tmp:
+        with open (tmpfile, 'w') as tmp:
             log_err("PROCESSING: %s" % str(x))
             try:
                 #check_call(["cp", x, "."])
-                p = Popen(["rpm2cpio", path.join("../rpm-repository", filename)], stdout=tmp)
-                p.wait()
+                rpm_arg, rpm_data = rpm2cpio_source(filename)
+                p = Popen(["rpm2cpio", rpm_arg], stdin = None if rpm_data is None else PIPE, stdout=tmp)
+                p.communicate(rpm_data)
             except Exception as e:
                 log_err("tmpfilecreate exception")
                 log_err(x)
@@ -721,8 +1661,10 @@ def worker_process(q_output, q_files, name, worker_dir):
                 terminal_msg(0, "%s errored out on rpm2cpio" % process_name)
                 
 
+        mkdir(scratch)
+        chdir(scratch)
         try:
-            check_call(["cpio -idm --no-preserve-owner < tmpfile"], shell=True,
+            check_call(["cpio -idm --no-preserve-owner < %s" % quote(tmpfile)], shell=True,
                        stdout=devnull_f, stderr=devnull_f)
         except Exception as e:
             log_err("unpacking error")
@@ -734,14 +1676,22 @@ def worker_process(q_output, q_files, name, worker_dir):
 
         processed_data = process_rpm(x)
         q_output.put({processed_data["package"] : processed_data})
-        cleanup_process_dir()
-        unlink(path.join("../rpm-repository", filename))
+        chdir(full_worker_dir)
+        cleaner.discard(scratch, filename)
+        unlink(path.join(rpm_repository_path, filename))
 
+    cleaner.close()
+    if path.exists(tmpfile):
+        unlink(tmpfile)
     log_err(name + " has completed!")
     err_file.close()
     devnull_f.close()
 
-def run(rpm_directory, worker_directory, output_directory, product, software_version, process_count):
+def run(rpm_directory, worker_directory, output_directory, product, software_version, process_count,
+        execution_engine = "process", subprocess_count = 8, rpms_per_process = 4,
+        lease_filename = None, host_name = None, lease_duration = 300, output_queue_budget = 256 * (2 ** 20),
+        debuginfo_pairing = False, worker_start_method = "fork", text_split_threshold = 64 * (2 ** 20),
+        text_split_ranges = 4, source_iso = None, database_sink = False, write_json = True):
     global worker_dir
     global restart
     global rpm_dir
@@ -750,6 +1700,20 @@ def run(rpm_directory, worker_directory, output_directory, product, software_ver
     global current_directory
     global debug_process
     global mark_worker_dir_for_removal
+    global engine
+    global async_subprocesses
+    global async_rpms
+    global lease_file
+    global host_id
+    global lease_seconds
+    global queue_budget
+    global pair_debuginfo
+    global start_method
+    global split_threshold
+    global split_ranges
+    global iso_file
+    global db_sink
+    global json_output
 
     worker_dir = worker_directory
     restart = False
@@ -761,6 +1725,21 @@ def run(rpm_directory, worker_directory, output_directory, product, software_ver
     current_directory = getcwd()
     debug_process = False
     mark_worker_dir_for_removal = True
+    engine = execution_engine
+    async_subprocesses = subprocess_count
+    async_rpms = rpms_per_process
+    lease_file = path.abspath(lease_filename) if lease_filename else None
+    if host_name:
+        host_id = host_name
+    lease_seconds = lease_duration
+    queue_budget = output_queue_budget
+    pair_debuginfo = debuginfo_pairing
+    start_method = worker_start_method
+    split_threshold = text_split_threshold
+    split_ranges = text_split_ranges
+    iso_file = path.abspath(source_iso) if source_iso else None
+    db_sink = database_sink
+    json_output = write_json
 
     cores = process_count
     container_name = "%s:%s" % (product, software_version)
@@ -784,8 +1763,10 @@ def run(rpm_directory, worker_directory, output_directory, product, software_ver
 if __name__ == "__main__":
     p = ArgumentParser(description=__doc__)
 
-    p.add_argument("-r", "--rpm_directory", type=str, required=True,
+    p.add_argument("-r", "--rpm_directory", type=str,
                    help="The root directory where RPM files will be found in subdirectories.")
+    p.add_argument("-I", "--iso", type=str,
+                   help="Examine the rpms in this iso where they are, without extracting them. Replaces -r.")
     p.add_argument("-p", "--processes", type=int, default=10,
                    help="The number of processes that can be utilized to examine rpm files.")
     p.add_argument("-w", "--worker_directory", type=str,
@@ -797,17 +1778,46 @@ if __name__ == "__main__":
     p.add_argument("-n", "--noclean", action="store_true",
                    help="Don't delete the directories where worker processes were unpacking rpm files or the directory created if one isn't given")
     p.add_argument("-v", "--debug-process", action="store_true",
-                   help="Unpack and process only debuginfo rpms for processing. Warning: takes a while longer....")
+                   help="Unpack and process only debuginfo rpms for processing, in a run of its own. Warning: takes a while longer.... --pair-debuginfo adds their symbols to the binary rpms in the same run instead.")
     p.add_argument("-b", "--product", type=str, default="BIG-IP",
                    help="The product being examined.")
     p.add_argument("-o", "--software_version", type=str, default="test",
                    help="The software version of the product.")
     p.add_argument("-e", "--restart", action="store_true",
                    help="If restarting after error, gather rpm files to process from this directory. -o, -w and -d need to be specified as well.")
+    p.add_argument("-g", "--engine", type=str, choices=["process", "async"], default="process",
+                   help="process: each worker process runs its tools one at a time. async: each worker process drives many tools at once from an event loop.")
+    p.add_argument("-t", "--subprocesses", type=int, default=8,
+                   help="With the async engine, the number of readelf/objdump/rpm2cpio subprocesses each worker process keeps running.")
+    p.add_argument("-k", "--rpms-per-process", type=int, default=4,
+                   help="With the async engine, the number of rpms each worker process examines at once.")
+    p.add_argument("-l", "--lease-store", type=str,
+                   help="A sqlite file on a shared filesystem. Every host pointed at the same file (and rpm directory) leases rpms from it, so several hosts build one database together.")
+    p.add_argument("-i", "--host-id", type=str,
+                   help="A name for this host that's unique among the hosts sharing the lease store. Defaults to <hostname>-<pid>.")
+    p.add_argument("-x", "--lease-seconds", type=int, default=300,
+                   help="How long a lease on an rpm lasts before other hosts may take it back.")
+    p.add_argument("-q", "--queue-budget", type=int, default=256,
+                   help="Megabytes of finished rpm data allowed to wait on the writer before workers block.")
+    p.add_argument("-y", "--pair-debuginfo", action="store_true",
+                   help="Examine each rpm together with its debuginfo rpm, adding the static functions from its .debug files (matched by build-id) to the symbol tables.")
+    p.add_argument("-m", "--start-method", type=str, choices=["fork", "forkserver"], default="fork",
+                   help="fork: workers are forked from the writer. forkserver: workers are forked from a server process that has already imported the parsers.")
+    p.add_argument("-T", "--split-threshold", type=int, default=64,
+                   help="Executables with more than this many megabytes of .text are disassembled in address ranges, in parallel. 0 never splits them.")
+    p.add_argument("-R", "--split-ranges", type=int, default=4,
+                   help="The number of address ranges a large executable is disassembled in.")
+    p.add_argument("-D", "--db-sink", action="store_true",
+                   help="Add the results to the database (see rpm_db_sink) as they come in, instead of leaving that to rpm_uploader.")
+    p.add_argument("-N", "--no-json", action="store_true",
+                   help="With --db-sink, don't write the JSON files as well.")
     args = p.parse_args()
 
     current_directory = getcwd()
+    if bool(args.rpm_directory) == bool(args.iso):
+        terminal_msg(0, "Either an rpm directory (-r) or an iso (-I) must be given, not both.")
     rpm_dir = args.rpm_directory
+    iso_file = path.abspath(args.iso) if args.iso else None
     cores = args.processes
     output_file = args.software_version
     mark_worker_dir_for_removal = args.noclean
@@ -844,8 +1854,24 @@ if __name__ == "__main__":
 
     output_size = args.size * (2**20)
     debug_process = args.debug_process
+    pair_debuginfo = args.pair_debuginfo
+    if debug_process and pair_debuginfo:
+        terminal_msg(0, "--debug-process and --pair-debuginfo can't be used together.")
 
     noclean = args.noclean
+    engine = args.engine
+    async_subprocesses = args.subprocesses
+    async_rpms = args.rpms_per_process
+    lease_file = path.abspath(args.lease_store) if args.lease_store else None
+    if args.host_id:
+        host_id = args.host_id
+    lease_seconds = args.lease_seconds
+    queue_budget = args.queue_budget * (2 ** 20)
+    start_method = args.start_method
+    split_threshold = args.split_threshold * (2 ** 20)
+    split_ranges = args.split_ranges
+    db_sink = args.db_sink
+    json_output = not args.no_json
 
     writer_process (cores, container_name, output_file, output_size)
 
@@ -34,6 +34,21 @@ class FunctionFinder:
         self.memo = Memo()
         self.full_db = full_db
         self.organized_db = organized_db
+        self.version_index = {}
+
+    def exact_symbols(self, rpm_option, dep):
+        """
+        The definitions in an executable keyed by (name, version), so a
+        versioned reference is found with a single probe. Built the first time
+        the executable is asked for.
+        """
+        key = (rpm_option, dep)
+        if key not in self.version_index:
+            symbols = self.full_db[rpm_option]["executables"][dep]["symbols"]
+            # databases built before symbol versions were recorded have no "name"
+            self.version_index[key] = dict(((s["name"], s["version"]), s) for s in symbols.values()
+                                           if "name" in s and s["defined"] == "YES")
+        return self.version_index[key]
 
     def FF_generator(self):
         for rpm_key in self.full_db:
@@ -95,6 +110,22 @@ class FunctionFinder:
                     yield {undef_func: symbol_data}
                     continue
 
+                # A versioned reference names the file it's needed from, so the
+                # definition can be looked up directly
+                needed_file = symbol_data.get("file")
+                if needed_file and symbol_data.get("version"):
+                    exact_key = (symbol_data["name"], symbol_data["version"])
+                    for rpm_option in self.container.organized_db[self.arch].get(needed_file, []):
+                        if exact_key in self.container.exact_symbols(rpm_option, needed_file):
+                            symbol_data.update({rpm_option: needed_file})
+                            found = True
+                            self.container.memo.add_memo(self.arch, needed_file, undef_func, rpm_option)
+                            break
+
+                if (found == True):
+                    yield {undef_func: symbol_data}
+                    continue
+
                 for dep in self.dependencies:
                     try:
                         rpm_options = self.container.organized_db[self.arch][dep]
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
+from glob import glob, escape as glob_escape
 from json import dumps
 from os import path
 
 class DBPrinter:
-    def __init__(self, base_filename, base_dir = "", output_filesize = 10, container_name = "BIG-IP", container = True):
+    def __init__(self, base_filename, base_dir = "", output_filesize = 10, container_name = "BIG-IP", container = True, keep_existing = False):
+        '''
+        @param
+        keep_existing   number the files after the ones an earlier run left, instead of overwriting them
+        '''
         self.fp = None
         self.filecount = 0
         self.base_filename = base_filename
         if base_dir:
             self.base_filename = path.join(base_dir, base_filename)
+        if keep_existing:
+            self.filecount = self.next_filecount()
         self.filesize = output_filesize
         self.charcount = 0
         self.container_start = "{ \"" + container_name + "\" :{"
@@ -17,6 +24,15 @@ class DBPrinter:
         self.last_dump = None
         self.container = container
 
+    def next_filecount(self):
+        '''
+        @return
+        the number after the highest numbered file there already is
+        '''
+        prefix = self.base_filename + "-"
+        numbers = [x[len(prefix):-len(".json")] for x in glob(glob_escape(prefix) + "*.json")]
+        return max([int(x) + 1 for x in numbers if x.isdigit()], default = 0)
+
     def initialize_file(self):
         if not self.fp:
             filename = self.base_filename + "-" + str(self.filecount) + ".json"
@@ -78,6 +94,17 @@ class DBPrinter:
         self.close_out()
 
 
+    def end_file(self):
+        '''
+        Close the current file, so what's printed next starts the one after it
+        '''
+        if self.fp:
+            self.close_out()
+            self.fp = None
+            self.charcount = 0
+            self.filecount += 1
+            self.last_dump = None
+
     def close_out(self):
         if self.fp:
             if self.last_dump:
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+rpm_db_sink adds the rpms rpm_db_builder finishes straight to the database,
+instead of printing them to JSON files for rpm_uploader to read back. The rpms
+are gathered into batches of a few megabytes, and each batch is uploaded the
+way rpm_uploader uploads a JSON file: its symbol names and executable contents
+first, then its rows with COPY in a transaction of their own. The version is
+hidden from readers until every batch is in.
+"""
+import time
+
+import rpm_uploader
+import symbol_cache
+from lib import *
+
+
+# bytes of rpm data (as the workers sent it) gathered before a batch is uploaded
+BATCH_SIZE = 32 * (2 ** 20)
+# how often the hold on the version is renewed
+RENEW_SECONDS = rpm_uploader.HOLD_SECONDS / 4
+
+
+class DBSink:
+    def __init__(self, container_name, conn = None, batch_size = BATCH_SIZE, bulk = True):
+        '''
+        @param
+        container_name  "<prod>:<vers>", as the JSON files have it
+        conn            the connection to add the rows through, e.g. a sqlite_db stand-in.
+                        By default the database in the config.
+        bulk            add the rows with COPY where the connection can
+        '''
+        self.close_conn = conn is None
+        if conn is None:
+            conn = rpm_uploader.connect()
+        self.conn = conn
+        self.batch_size = batch_size
+        self.bulk = bulk and rpm_uploader.can_copy(conn)
+        self.symbols = symbol_cache.SymbolCache()
+
+        split = container_name.split(":")
+        self.version = split[1]
+        # a version that's already there is refused, it's never added to
+        self.vers_id, _ = rpm_uploader.hold_version(conn, split[0], split[1])
+        self.renew_at = time.time() + RENEW_SECONDS
+
+        self.batch = {}
+        self.charcount = 0
+        self.batchcount = 0
+
+    def add(self, output_dict, size):
+        '''
+        @param
+        output_dict     {rpm: rpm data}, as a worker sent it
+        size            the bytes it took in the output queue
+        '''
+        self.batch.update(output_dict)
+        self.charcount += size
+        if self.charcount > self.batch_size:
+            self.flush()
+        if time.time() > self.renew_at:
+            # a build can take longer than the hold on the version, see rpm_uploader.hold_version()
+            rpm_uploader.renew_hold(self.conn, [self.vers_id])
+            self.renew_at = time.time() + RENEW_SECONDS
+
+    def flush(self):
+        if not self.batch:
+            return
+        contents = rpm_uploader.prepare_rpms(self.conn, self.batch.values(), self.symbols)
+        rpm_uploader.upload_rpms(self.conn, self.batch.items(), self.vers_id, self.symbols, contents, self.bulk)
+        self.batch = {}
+        self.charcount = 0
+        self.batchcount += 1
+
+    def close(self):
+        '''
+        Upload the last batch and let readers see the version
+        '''
+        self.flush()
+        rpm_uploader.publish(self.conn, [self.vers_id])
+        terminal_msg(2, "Added the rpms of version %s to the database in %d batches" % (self.version, self.batchcount))
+        if self.close_conn:
+            self.conn.close()
+
+    def abort(self):
+        '''
+        Delete what's been added of the version, after the build failed. Raises what the
+        rollback raised, for the caller to report along with why the build failed.
+        '''
+        terminal_msg(1, "Rolling back all changes with version %s" % self.version)
+        try:
+            rpm_uploader.roll_back_version(self.conn, self.vers_id)
+        finally:
+            if self.close_conn:
+                self.conn.close()
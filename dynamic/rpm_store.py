@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+rpm_store keeps a single copy of every rpm taken out of any iso, named by the
+sha256 of its contents. The rpm directory of each iso is made of links into
+the store, so the many rpms hotfix and build isos have in common take up disk
+space once. Whether the store has an rpm already is also a cheap way for later
+stages to tell that exactly this package has been seen before.
+"""
+import os
+import errno
+import fcntl
+import shutil
+import hashlib
+import tempfile
+
+
+# from linux/fs.h, _IOW(0x94, 9, int): share the blocks of another file instead of copying them (btrfs, xfs)
+FICLONE = 0x40049409
+
+# read at a time while hashing
+READ_SIZE = 2 ** 20
+
+# a hardlink can't be made here, though a reflink or a copy might
+LINK_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def extent_digest(fd, offset, length):
+    '''
+    @return
+    the sha256 hex digest of the length bytes at offset in the open file fd
+    '''
+    h = hashlib.sha256()
+    done = 0
+    while done < length:
+        data = os.pread(fd, min(READ_SIZE, length - done), offset + done)
+        if not data:
+            raise IOError("The file ends %d bytes into the %d bytes being hashed." % (done, length))
+        h.update(data)
+        done += len(data)
+    return h.hexdigest()
+
+
+def file_digest(filename):
+    '''
+    @return
+    the sha256 hex digest of a whole file, the key it has in an RpmStore
+    '''
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        return extent_digest(fd, 0, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+
+def reflink(src, dst):
+    '''
+    Make dst a copy of src sharing its blocks, on filesystems that can
+    '''
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_or_copy(src, dst):
+    '''
+    Put src at dst as a hardlink, or where that can't be done (e.g. the two
+    are on different filesystems) as a reflink, or as a copy.
+
+    @return
+    "link", "reflink" or "copy"
+    '''
+    if os.path.lexists(dst):
+        # left by an earlier extraction
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError as e:
+        if e.errno not in LINK_ERRNOS:
+            raise
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except OSError:
+        # copyfile overwrites whatever the failed reflink left behind
+        pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+class RpmStore:
+    def __init__(self, directory):
+        '''
+        @param
+        directory   where the rpms are kept, created if it doesn't exist. Hardlinks
+                    need it on the same filesystem as the rpm directories.
+        '''
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + ".rpm")
+
+    def contains(self, digest):
+        '''
+        Whether the rpm with this digest has been stored before, from this iso or any other
+        '''
+        return os.path.exists(self.path(digest))
+
+    def add(self, digest, fill):
+        '''
+        Store a new rpm.
+
+        @param
+        digest      the rpm's sha256 hex digest
+        fill        a callable writing the rpm to the file name it's given
+
+        @return
+        the path of the rpm in the store
+        '''
+        target = self.path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        fd, tmp = tempfile.mkstemp(suffix = ".part", dir = os.path.dirname(target))
+        os.close(fd)
+        try:
+            fill(tmp)
+            # every link to it is the stored copy, so nobody gets to change it
+            os.chmod(tmp, 0o444)
+            # if the same rpm was stored meanwhile (from another thread or iso), the copies are identical
+            os.rename(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return target
+
+    def link(self, digest, output_path):
+        '''
+        Put the stored rpm at output_path, see link_or_copy
+
+        @return
+        "link", "reflink" or "copy"
+        '''
+        return link_or_copy(self.path(digest), output_path)
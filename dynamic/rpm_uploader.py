@@ -5,18 +5,26 @@ This script will upload JSON files created by rpm_db_builder into the database
 created with create_tables.py. This should only need to be run once, then the
 data will be available in the database for future queries.
 """
-import sys
 import time
-from json import load
+import hashlib
+from json import dumps
 from os import listdir, path
+from multiprocessing import Pool
 from argparse import ArgumentParser
 
+import json_stream
+import rpm_bulk_loader
+import symbol_cache
 from lib import *
 
 try:
     import psycopg2
 except ImportError:
-    utility.terminal_msg(0, "Psycopg2 must be installed to use this script.")
+    psycopg2 = None
+
+# how long a version that isn't ready stays held without the upload renewing it. It's renewed
+# after every JSON file or batch of rpms, so it only has to outlast the longest of those.
+HOLD_SECONDS = 2 * 60 * 60
 
 """
 The format of the json database looks roughly like the following.
@@ -35,6 +43,11 @@ The format of the json database looks roughly like the following.
             "executables": {
                 "libattr.so.1": {
                     "Symlink Target": "libattr.so.1.1.0",
+                    "build_id": "3a1b4c0d9e6f8a2b5c7d0e1f2a3b4c5d6e7f8091",
+                    "path": "/lib/libattr.so.1",
+                    "soname": "libattr.so.1",
+                    "rpath": [],
+                    "runpath": [],
                     "dependencies": [
                         "libc.so.6"
                     ],
@@ -42,8 +55,13 @@ The format of the json database looks roughly like the following.
                         "__cxa_finalize@GLIBC_2.1.3": {
                             "at": "GLIBC_2.1.3",
                             "binding": "WEAK",
+                            "default": false,
                             "defined": "NO",
-                            "type": "FUNC"
+                            "file": "libc.so.6",
+                            "hidden": false,
+                            "name": "__cxa_finalize",
+                            "type": "FUNC",
+                            "version": "GLIBC_2.1.3"
                         },
                         "__errno_location@GLIBC_2.0": {
                             "at": "GLIBC_2.0",
@@ -70,23 +88,35 @@ prod_str = ("INSERT INTO products (product) "
             "VALUES (%s) "
             "RETURNING prod_id;")
 
-vers_str = ("INSERT INTO versions (prod_id, version) "
-            "VALUES (%s, %s) "
+# hidden from readers until publish()
+vers_str = ("INSERT INTO versions (prod_id, version, ready, held_until) "
+            "VALUES (%s, %s, FALSE, %s) "
             "RETURNING vers_id;")
 
+vers_select_str = ("SELECT vers_id, ready FROM versions "
+                   "WHERE prod_id = %s AND version = %s;")
+
+# only one run gets to take over a version whose hold ran out
+take_over_str = ("UPDATE versions SET held_until = %s "
+                 "WHERE vers_id = %s AND NOT ready AND (held_until IS NULL OR held_until < %s) "
+                 "RETURNING vers_id;")
+
+renew_str = ("UPDATE versions SET held_until = %s "
+             "WHERE vers_id = %s AND NOT ready;")
+
 rpm_sql_str = ("INSERT INTO rpms "
                "(vers_id, rpm, release, rpm_version, x86_64, i686, ppc, noarch, other_arch) "
                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
                "RETURNING rpm_id;")
 
 exec_sql_str = ("INSERT INTO execs "
-                "(rpm_id, exec) "
-                "VALUES (%s, %s) "
+                "(rpm_id, exec, build_id, path, soname, elf_class, content_id) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s) "
                 "RETURNING exec_id;")
 
 alias_sql_str = ("INSERT INTO aliases "
-                 "(exec_id, alias) "
-                "VALUES (%s, %s) "
+                 "(exec_id, alias, path) "
+                "VALUES (%s, %s, %s) "
                 "RETURNING alias_id;")
 
 dep_sql_str = ("INSERT INTO deps "
@@ -95,12 +125,12 @@ dep_sql_str = ("INSERT INTO deps "
                "RETURNING dep_id;")
 
 rpath_sql_str = ("INSERT INTO rpaths "
-               "(exec_id, rpath) "
-               "VALUES (%s, %s) "
+               "(exec_id, rpath, runpath) "
+               "VALUES (%s, %s, %s) "
                "RETURNING rpath_id;")
 
 decl_str = ("INSERT INTO decl_funcs "
-            "(exec_id, func) "
+            "(content_id, symbol_id) "
             "VALUES (%s, %s) "
             "RETURNING func_id;")
 
@@ -115,12 +145,51 @@ def_str = ("INSERT INTO def_funcs "
            "RETURNING def_func_id;")
 
 callee_str = ("INSERT INTO callee_funcs "
-              "(func_id, callee_func) "
+              "(func_id, callee_symbol_id) "
               "VALUES (%s, %s) "
               "RETURNING callee_func_id;")
 
+insert_sql = {RPMS: rpm_sql_str,
+              EXECS: exec_sql_str,
+              ALIASES: alias_sql_str,
+              DEPENDENCIES: dep_sql_str,
+              RPATHS: rpath_sql_str,
+              DECL_FUNCS: decl_str,
+              AT_VERSIONS: at_version_str,
+              DEF_FUNCS: def_str,
+              CALLEE_FUNCS: callee_str}
+
+# for a batch of content keys
+content_select_str = ("SELECT content_id, content_key, complete FROM exec_contents "
+                      "WHERE content_key IN ({});")
+
+# an upload running at the same time may add the same contents. They're complete once their symbols are in.
+content_str = ("INSERT INTO exec_contents (content_key, complete) "
+               "VALUES {} "
+               "ON CONFLICT (content_key) DO NOTHING "
+               "RETURNING content_id, content_key;")
+
+# the row stays locked until the transaction ends, so another upload claiming the same content waits
+# to find it complete, or claims it itself if this one is rolled back
+claim_content_str = ("UPDATE exec_contents SET complete = TRUE "
+                     "WHERE content_id = %s AND NOT complete "
+                     "RETURNING content_id;")
+
+# for a batch of content ids: the ones no executable refers to any more, along with their symbols
+drop_contents_str = ("DELETE FROM exec_contents "
+                     "WHERE content_id IN ({}) "
+                     "AND NOT EXISTS (SELECT 1 FROM execs e WHERE e.content_id = exec_contents.content_id);")
+
+version_contents_str = ("SELECT DISTINCT e.content_id FROM execs e "
+                        "JOIN rpms r ON e.rpm_id = r.rpm_id "
+                        "JOIN versions v ON r.vers_id = v.vers_id "
+                        "WHERE v.vers_id = %s AND e.content_id IS NOT NULL;")
+
+ready_str = ("UPDATE versions SET ready = %s "
+             "WHERE vers_id = %s;")
+
 rollback_str = ("DELETE FROM versions "
-                "WHERE versions.version = %s;")
+                "WHERE versions.vers_id = %s;")
 
 def existing_index(curs, table, _id, key, value):
     query_str = "SELECT %s from %s " % (_id, table)
@@ -143,165 +212,518 @@ def insert_row(curs, sql_str, value_tuple):
     return output
 
 
-def upload(filedir):
-    conn = psycopg2.connect(utility.get_conn_str())
+def content_key(exe_data):
+    '''
+    @return
+    what identifies an executable's content: its build id, or without one a hash of its symbols
+    '''
+    if exe_data.get("build_id"):
+        return "build-id:" + exe_data["build_id"]
+    return "sha256:" + hashlib.sha256(dumps(exe_data["symbols"], sort_keys = True).encode("utf-8")).hexdigest()
+
+def symlink_target(exe, exe_data):
+    '''
+    @return
+    the executable exe is a symlink to, or None if it's an executable of its own
+    '''
+    if "Symlink Target" in exe_data and exe_data["Symlink Target"] != "" and exe_data["Symlink Target"] != exe:
+        return exe_data["Symlink Target"]
+    return None
+
+def rpm_content_keys(rpm_data):
+    '''
+    @return
+    set of the content keys of the executables (not the symlinks) of an rpm in a JSON file
+    '''
+    return set(content_key(d) for exe, d in rpm_data["executables"].items() if symlink_target(exe, d) is None)
+
+def resolve_contents(conn, keys):
+    '''
+    Find or add the exec_contents rows for keys, in a transaction of their own, like
+    symbol_cache.SymbolCache.intern does with symbol names. Uploads running at the same time
+    only wait for each other for as long as this takes, not for their whole upload.
+    The contents are added incomplete, claim_contents() decides who adds their symbols.
+
+    @return
+    dict key -> list [content_id, whether the content was incomplete, so its symbols may still have to be added]
+    '''
+    # in the same order everywhere, so two uploads adding the same contents can't deadlock
+    keys = sorted(keys)
+    contents = {}
+
+    def select(batch):
+        curs.execute(content_select_str.format(", ".join(["%s"] * len(batch))), batch)
+        contents.update((key, [content_id, not complete]) for content_id, key, complete in curs.fetchall())
+
+    with conn:
+        with conn.cursor() as curs:
+            for i in range(0, len(keys), symbol_cache.BATCH):
+                select(keys[i:i + symbol_cache.BATCH])
+            missing = [x for x in keys if x not in contents]
+            for i in range(0, len(missing), symbol_cache.BATCH):
+                batch = missing[i:i + symbol_cache.BATCH]
+                curs.execute(content_str.format(", ".join(["(%s, FALSE)"] * len(batch))), batch)
+                contents.update((key, [content_id, True]) for content_id, key in curs.fetchall())
+            # added by an upload running at the same time, which has committed them by now
+            missing = [x for x in missing if x not in contents]
+            for i in range(0, len(missing), symbol_cache.BATCH):
+                select(missing[i:i + symbol_cache.BATCH])
+    return contents
+
+def prepare_rpms(conn, rpm_datas, symbols):
+    '''
+    Intern the symbol names and resolve the contents of the executables of rpms about to be
+    uploaded, each in a short transaction of its own.
+
+    @param
+    rpm_datas   an iterable of what the JSON files have for each rpm
+
+    @return
+    what resolve_contents() returns, for upload_rpms()
+    '''
+    names = set()
+    keys = set()
+    for rpm_data in rpm_datas:
+        names.update(symbol_cache.rpm_symbol_names(rpm_data))
+        keys.update(rpm_content_keys(rpm_data))
+    symbols.intern(conn, names)
+    return resolve_contents(conn, keys)
+
+def claim_contents(curs, contents):
+    '''
+    In the transaction of an upload, claim the incomplete contents it's about to refer to, and
+    keep the flag of those it has to add the symbols of. The others were completed meanwhile by
+    the upload that claimed them, which this one waited on. No upload can commit executables
+    whose content is incomplete, so readers never see one without its symbols.
+
+    @param
+    contents    what prepare_rpms() returned, updated in place
+    '''
+    # in the same order everywhere, so two uploads claiming the same contents can't deadlock
+    for content in sorted((x for x in contents.values() if x[1]), key = lambda x: x[0]):
+        curs.execute(claim_content_str, (content[0],))
+        content[1] = curs.fetchone() is not None
+
+def drop_contents(conn, content_ids):
+    '''
+    Delete the contents among content_ids that no executable refers to any more, and their symbol rows.
+    An upload that resolved one of them and hasn't added its executables yet fails, and is rolled back.
+    '''
+    content_ids = sorted(content_ids)
+    with conn:
+        with conn.cursor() as curs:
+            for i in range(0, len(content_ids), symbol_cache.BATCH):
+                batch = content_ids[i:i + symbol_cache.BATCH]
+                curs.execute(drop_contents_str.format(", ".join(["%s"] * len(batch))), batch)
+
+class InsertWriter:
+    '''
+    Adds each row with an INSERT ... RETURNING of its own, see rpm_bulk_loader.CopyWriter for the other way
+    '''
+    def __init__(self, curs):
+        self.curs = curs
+
+    def add(self, table, values):
+        return insert_row(self.curs, insert_sql[table], values)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def add_rpm_rows(writer, vers_id, rpm, rpm_data, symbols, contents):
+    '''
+    Add the rows for one rpm of a JSON file: the rpm, its executables and everything about them.
+
+    @param
+    writer      InsertWriter or rpm_bulk_loader.CopyWriter. writer.add(table, values) returns the id of the new row.
+                writer.curs is the cursor of the upload's transaction.
+    rpm         the file name of the rpm
+    rpm_data    what the JSON file has for the rpm
+    symbols     a symbol_cache.SymbolCache with the ids of all the rpm's symbol names
+    contents    what prepare_rpms() returned for the rpm, after claim_contents(). The symbols of a
+                content are added for the first executable with it, if this upload claimed the content.
+    '''
+    package = rpm_data["package"]
+    release = rpm_data["release"]
+    version = rpm_data["version"]
+    x86_64 = rpm_data["x86_64"]
+    i686 = rpm_data["i686"]
+    ppc = rpm_data["ppc"]
+    noarch = rpm_data["noarch"]
+    otherarch = rpm_data["other_arch"]
+    #print("inserting rpm")
+    rpm_id = writer.add(RPMS, (vers_id, rpm, release, version, x86_64, i686, ppc, noarch, otherarch))
+
+    execs = rpm_data["executables"]
+
+    alias_table = [] # aliases [{target_exec:blah, exec_:blah}...]
+    exist_dict = {} # [{<exec_name>: exec_id}]
+
+    for exe in execs:
+        #print("inserting exec")
+        target_exec = symlink_target(exe, execs[exe])
+        if target_exec is not None:
+            # Make alias table pairing the executable
+            # and the executable it symlinks to.
+            alias_table.append({"target_exec": target_exec, "exec": exe, "path": execs[exe].get("path")})
+            continue
+
+        # JSON files built by older versions of rpm_db_builder don't have all of these
+        build_id = execs[exe].get("build_id")
+        exec_path = execs[exe].get("path")
+        soname = execs[exe].get("soname")
+        elf_class = execs[exe].get("elf_class")
+        content = contents[content_key(execs[exe])]
+        content_id = content[0]
+        exec_id = writer.add(EXECS, (rpm_id, exe, build_id, exec_path, soname, elf_class, content_id))
+
+        exist_dict[exe] = exec_id; #Add real exec to existing_dict
+
+        dep_list = execs[exe]["dependencies"]
+        for dep in dep_list:
+            #print ("inserting dep")
+            writer.add(DEPENDENCIES, (exec_id, dep, False))
+        #print("deps inserted")
+        rpath_list = execs[exe]["rpath"]
+        for rpath in rpath_list:
+            #print ("inserting rpath")
+            if rpath:
+                writer.add(RPATHS, (exec_id, rpath, False))
+        for runpath in execs[exe].get("runpath", []):
+            if runpath:
+                writer.add(RPATHS, (exec_id, runpath, True))
+        #print ("rpaths inserted")
+        if not content[1]:
+            # the same executable was uploaded before, or earlier in this upload: its symbols are stored with its content
+            continue
+        content[1] = False
+        symbol_list = execs[exe]["symbols"]
+
+        for symbol in symbol_list:
+            symbol_data = symbol_list[symbol]
+            #print ("inserting symbol")
+            sym_id = writer.add(DECL_FUNCS, (content_id, symbols[symbol]))
+            try:
+                #print ("inserting at")
+                # "version" comes from the versioning sections, older files only have "at"
+                at = symbol_data.get("version", symbol_data["at"])
+                if at:
+                    writer.add(AT_VERSIONS, (sym_id, at))
+            except:
+                pass
+
+            binding = symbol_data["binding"]
+            defined = symbol_data["defined"]
+            #print ("inserting definition")
+
+            if defined == "YES":
+                writer.add(DEF_FUNCS, (sym_id, binding))
+
+            try:
+                called_funcs = symbol_data["called_functions"]
+                for x in called_funcs:
+                    callee = x["function"]
+                    if callee == symbol:
+                        #Don't record self-references
+                        continue
+                    writer.add(CALLEE_FUNCS, (sym_id, symbols.get(callee)))
+            except:
+                pass
+
+    alias_passes = 0
+    while alias_table and alias_passes <= len(alias_table):
+        alias_candidate = alias_table.pop()
+        try:
+            alias_exec_id = exist_dict[alias_candidate["target_exec"]]
+            writer.add(ALIASES, (alias_exec_id, alias_candidate["exec"], alias_candidate["path"]))
+            exist_dict[alias_candidate["exec"]] = alias_exec_id
+            #Reset the number of times we've looked through alias_table
+            #Why? We might have added the right exec into the table
+            alias_passes = 0
+        except KeyError:
+            alias_passes += 1
+            alias_table.insert(0, alias_candidate)
+            #Try again, we're working with a chain of aliases it seems
+            #print("passed through loop")
+
+
+def connect():
+    if psycopg2 is None:
+        utility.terminal_msg(0, "Psycopg2 must be installed to use this script.")
+    return psycopg2.connect(utility.get_conn_str())
+
+def version_of(filename):
+    '''
+    @return
+    tuple (product, version) from the <prod>:<vers> entry of a JSON file, or None if it has none
+    '''
+    with open(filename, "r") as f:
+        name = json_stream.ContainerReader(f).name
+    if name is None:
+        return None
+    # Expecting a version string like <prod>:<vers>
+    split = name.split(":")
+    return (split[0], split[1])
+
+def hold_version(conn, product, version, add_to_existing = False):
+    '''
+    Find or add the product row, and add the version row out of readers' sight until
+    publish() puts it in. A version that's already there is left as it is, unless it
+    isn't ready and its hold ran out: the run uploading it was stopped, so what it left
+    is rolled back and the version added again.
+
+    The hold lasts HOLD_SECONDS, the upload renews it with renew_hold() as it goes.
+
+    @param
+    add_to_existing     add the rows to the version if it's already there, instead of raising an Exception
+
+    @return
+    tuple (vers_id, whether this call added the version, so it's the one to publish or roll it back)
+    '''
+    with conn:
+        with conn.cursor() as curs:
+            prod_id = existing_index(curs, "products", "prod_id", "product", product)
+            if prod_id == False:
+                prod_id = insert_row(curs, prod_str, (product,))
+
+            curs.execute(vers_select_str, (prod_id, version))
+            row = curs.fetchone()
+            if row is None:
+                return (insert_row(curs, vers_str, (prod_id, version, time.time() + HOLD_SECONDS)), True)
+
+    vers_id, ready = row
+    if add_to_existing:
+        return (vers_id, False)
+    if ready:
+        raise Exception("{} {} is already in the database.".format(product, version))
+
+    now = time.time()
+    with conn:
+        with conn.cursor() as curs:
+            curs.execute(take_over_str, (now + HOLD_SECONDS, vers_id, now))
+            taken = curs.fetchone() is not None
+    if not taken:
+        raise Exception("{} {} is being uploaded by another run.".format(product, version))
+    terminal_msg(1, "{} {} was left behind by a run that was stopped, rolling it back.".format(product, version))
+    roll_back_version(conn, vers_id)
+    return hold_version(conn, product, version)
+
+def renew_hold(conn, vers_ids):
+    '''
+    Hold the versions for another HOLD_SECONDS, see hold_version()
+    '''
+    with conn:
+        with conn.cursor() as curs:
+            for vers_id in vers_ids:
+                curs.execute(renew_str, (time.time() + HOLD_SECONDS, vers_id))
+
+def publish(conn, vers_ids):
+    '''
+    Let readers see the versions, all of them at once, once every shard of them is in
+    '''
+    with conn:
+        with conn.cursor() as curs:
+            for vers_id in vers_ids:
+                curs.execute(ready_str, (True, vers_id))
+
+def can_copy(conn):
+    '''
+    Whether rows can be added through conn with rpm_bulk_loader's COPY, which needs postgres
+    '''
+    with conn.cursor() as curs:
+        if not hasattr(curs, "copy_expert"):
+            terminal_msg(1, "The database connection can't COPY, the rows are inserted one at a time.")
+            return False
+    return True
+
+def upload_rpms(conn, rpms, vers_id, symbols, contents, bulk = False):
+    '''
+    Add rpms under vers_id, in a transaction of their own. An exception rolls back these rows only.
+    The contents this upload claimed go back to incomplete then, for the next upload with them to fill in.
+
+    @param
+    rpms        an iterable of tuple (rpm, rpm data), as the JSON files have them
+    symbols     the symbol_cache.SymbolCache of the database conn is to
+    contents    what prepare_rpms() returned for rpms, with symbols
+    bulk        add the rows with COPY, see can_copy()
+    '''
+    with conn:
+        with conn.cursor() as curs:
+            claim_contents(curs, contents)
+            writer = InsertWriter(curs)
+            if bulk:
+                writer = rpm_bulk_loader.CopyWriter(curs)
+            try:
+                for rpm, rpm_data in rpms:
+                    try:
+                        add_rpm_rows(writer, vers_id, rpm, rpm_data, symbols, contents)
+                    except Exception as e:
+                        terminal_msg(1, "Exception {} occurred during processing json data".format(e))
+                        raise e
+                writer.flush()
+            finally:
+                writer.close()
+
+def roll_back_version(conn, vers_id):
+    '''
+    Delete everything uploaded for a version. Errors from the database are raised.
+    '''
+    with conn:
+        with conn.cursor() as curs:
+            curs.execute(version_contents_str, (vers_id,))
+            content_ids = [row[0] for row in curs.fetchall()]
+            curs.execute(rollback_str, (vers_id,))
+    # the contents only this version had, which would otherwise stay forever
+    drop_contents(conn, content_ids)
+
+def roll_back(conn, versions):
+    '''
+    Delete everything uploaded for the versions, after an upload of them failed
+
+    @param
+    versions    dict of (product, version) -> vers_id, of the versions hold_version() added
+    '''
+    for (product, version), vers_id in versions.items():
+        utility.terminal_msg(1, "Rolling back all changes with version {} {}".format(product, version))
+        try:
+            roll_back_version(conn, vers_id)
+        except (Exception, KeyboardInterrupt) as e2:
+            terminal_msg(0, "Failed to rollback database change. Version {} within database may be corrupted. \n\t Error message: {}".format(version, e2))
+
+def upload_shard(conn, filename, vers_id, symbols, bulk = False):
+    '''
+    Add the rpms of one JSON file under vers_id, see upload_rpms()
+    '''
+    time_upload_start = time.time()
+    # the symbol names and contents go in first, committed on their own
+    with open(filename, "r") as f:
+        contents = prepare_rpms(conn, (rpm_data for rpm, rpm_data in json_stream.ContainerReader(f)), symbols)
+
+    # the rpms are read one at a time as they're added, so the file stays open for the transaction
+    with open(filename, "r") as f:
+        upload_rpms(conn, json_stream.ContainerReader(f), vers_id, symbols, contents, bulk)
+    time_upload_end = time.time()
+    terminal_msg(2, "Time upload of {}: {}".format(filename, time_upload_end - time_upload_start))
+
+# each process of a parallel upload keeps one connection, and the symbol ids it's seen, for all of the shards it's given
+worker_conn = None
+worker_symbols = None
+
+def start_worker():
+    global worker_conn, worker_symbols
+    worker_conn = connect()
+    worker_symbols = symbol_cache.SymbolCache()
+
+def upload_shard_worker(task):
+    '''
+    upload_shard in a process of the pool, on the process' own connection
+
+    @return
+    tuple (filename, None), or (filename, the error) if the shard's rows were rolled back
+    '''
+    filename, vers_id, bulk = task
+    try:
+        upload_shard(worker_conn, filename, vers_id, worker_symbols, bulk)
+    except (Exception, KeyboardInterrupt) as e:
+        return (filename, "{}: {}".format(type(e).__name__, e))
+    return (filename, None)
+
+def upload(filedir, conn = None, bulk = False, jobs = 1, add_to_existing = False):
+    '''
+    Upload every JSON file in filedir. The versions they're for are only visible to readers
+    (versions.ready) once every file has been uploaded.
+
+    @param
+    conn    the connection to upload through, e.g. a sqlite_db stand-in. By default the database in the config.
+    bulk    add the rows with COPY (see rpm_bulk_loader) instead of an INSERT for each. Needs postgres.
+    jobs    upload this many files at once, each process of the pool with a connection of its own
+            to the database in the config. The product and version rows are only made once, through conn.
+    add_to_existing     add the files to versions that are already in the database, see hold_version().
+                        Those stay as they are if an upload fails, except for the files that failed.
+    '''
+    close_conn = False
+    if conn is None:
+        conn = connect()
+        close_conn = True
+
+    if bulk:
+        bulk = can_copy(conn)
 
     json_files = [path.join(filedir, x) for x in listdir(filedir) if x.endswith(".json")]
 
+    tasks = []
+    vers_ids = {}
+    # the versions added by this upload, published once it's done
+    held = {}
     for filename in json_files:
         terminal_msg(2, "Examining %s" % filename)
-        time_import_start = time.time()
-        with open(filename, "r") as f:
-            json_data = load(f)
-        time_import_end = time.time()
-        terminal_msg(2, "File import time: {}".format(time_import_end - time_import_start))
-
-        time_upload_start = time.time()
-        for x in json_data:
-            # Expecting a version string like <prod>:<vers>
-            split = x.split(":")
-            product = split[0]
-            version = split[1]
-            json_data = json_data[x]
-            break
-        with conn:
-            with conn.cursor() as curs:
-                try:
-                    #debug
-                    #print("inserting product cur id %d" % prod_id)
-                    prod_id = existing_index(curs, "products", "prod_id", "product", product)
-                    if prod_id == False:
-                        prod_id = insert_row(curs, prod_str, (product,))
-
-                    vers_id = existing_index(curs, "versions", "vers_id", "version", version)
-                    if vers_id == False:
-                        vers_id = insert_row(curs, vers_str, (prod_id, version))
-
-                    for rpm in json_data:
-                        try:
-                            package = json_data[rpm]["package"]
-                            release = json_data[rpm]["release"]
-                            version = json_data[rpm]["version"]
-                            x86_64 = json_data[rpm]["x86_64"]
-                            i686 = json_data[rpm]["i686"]
-                            ppc = json_data[rpm]["ppc"]
-                            noarch = json_data[rpm]["noarch"]
-                            otherarch = json_data[rpm]["other_arch"]
-                            #print("inserting rpm")
-                            rpm_id = insert_row(curs, rpm_sql_str, (vers_id, rpm, release, version, x86_64, i686, ppc, noarch, otherarch))
-
-                            execs = json_data[rpm]["executables"]
-
-                            alias_table = [] # aliases [{target_exec:blah, exec_:blah}...]
-                            exist_dict = {} # [{<exec_name>: exec_id}]
-
-                            for exe in execs:
-                                #print("inserting exec")
-                                try:
-                                    target_exec = execs[exe]["Symlink Target"]
-                                    if target_exec != "" and target_exec != exe:
-                                        # Make alias table pairing the executable
-                                        # and the executable it symlinks to.
-                                        alias_table.append({"target_exec": target_exec, "exec": exe})
-                                        continue
-                                except:
-                                    pass
-
-                                exec_id = insert_row(curs, exec_sql_str, (rpm_id, exe))
-
-                                exist_dict[exe] = exec_id; #Add real exec to existing_dict
-                                
-                                dep_list = execs[exe]["dependencies"]
-                                for dep in dep_list:
-                                    #print ("inserting dep")
-                                    dep_id = insert_row(curs, dep_sql_str, (exec_id, dep, False))
-                                #print("deps inserted")
-                                rpath_list = execs[exe]["rpath"]
-                                for rpath in rpath_list:
-                                    #print ("inserting rpath")
-                                    if rpath:
-                                        rpath_id = insert_row(curs, rpath_sql_str, (exec_id, rpath))
-                                #print ("rpaths inserted")
-                                symbol_list = execs[exe]["symbols"]
-
-                            # getting around extra callees
-                                callee_funcs = set()
-
-                                for symbol in symbol_list:
-                                    symbol_data = symbol_list[symbol]
-                                    #print ("inserting symbol")
-                                    sym_id = insert_row(curs, decl_str, (exec_id, symbol))
-                                    try:
-                                        #print ("inserting at")
-                                        at = symbol_data["at"]
-                                        if at:
-                                            insert_row(curs, at_version_str, (sym_id, at))
-                                    except:
-                                        pass
-
-                                    binding = symbol_data["binding"]
-                                    defined = symbol_data["defined"]
-                                    #print ("inserting definition")
-
-                                    if defined == "YES":
-                                        #print("inserted definition now")
-                                        def_func_id = insert_row(curs, def_str, (sym_id, binding))
-                                        #print("inserted definition %d" % def_func_id)
-
-                                    try:
-                                        #print("got here")
-                                        called_funcs = symbol_data["called_functions"]
-                                        for x in called_funcs:
-                                            callee = x["function"]
-                                            if callee == symbol:
-                                                #Don't record self-references
-                                                continue
-                                            callee_id = insert_row(curs, callee_str, (sym_id, callee))
-                                    except:
-                                        pass
-                            
-                            alias_passes = 0
-                            while alias_table and alias_passes <= len(alias_table):
-                                alias_candidate = alias_table.pop()
-                                try:
-                                    alias_exec_id = exist_dict[alias_candidate["target_exec"]]
-                                    insert_row(curs, alias_sql_str, (alias_exec_id, alias_candidate["exec"]))
-                                    exist_dict[alias_candidate["exec"]] = alias_exec_id
-                                    #Reset the number of times we've looked through alias_table
-                                    #Why? We might have added the right exec into the table
-                                    alias_passes = 0
-                                except KeyError:
-                                    alias_passes += 1
-                                    alias_table.insert(0, alias_candidate)
-                                    #Try again, we're working with a chain of aliases it seems
-                                    #print("passed through loop")
-                            
-                        except Exception as e:
-                            terminal_msg(1, "Exception {} occurred during processing json data".format(e))
-                            raise e
-
-                # Overall Exception handler for database access
-                except (Exception, KeyboardInterrupt) as e:
-                    utility.terminal_msg(1, "Exception/Interrupt {} caught during database processing static dependencies. Rolling back all changes with version {}".format(e, version))
-                    try:
-                        # rollback database changes
-                        curs.execute(rollback_str, (version,))
-                        utility.terminal_msg(2, "Database rollback complete. Program terminated.")
-                        sys.exit(0)
-                    except (Exception, KeyboardInterrupt) as e2:
-                        terminal_msg(0, "Failed to rollback database change. Version {} within database may be corrupted. \n\t Error message: {}".format(version, e2))
-
-        time_upload_end = time.time()
-        terminal_msg(2, "Time upload: {}".format(time_upload_end - time_upload_start))
-
-    conn.close()
+        prod_vers = version_of(filename)
+        if prod_vers is None:
+            terminal_msg(1, "%s has no <prod>:<vers> entry, skipping it." % filename)
+            continue
+        if prod_vers not in vers_ids:
+            try:
+                vers_ids[prod_vers], added = hold_version(conn, *prod_vers, add_to_existing = add_to_existing)
+            except Exception as e:
+                roll_back(conn, held)
+                if close_conn:
+                    conn.close()
+                # an ordinary exception, so a caller going through several isos carries on with the next
+                raise Exception("{} Nothing was uploaded.".format(e))
+            if added:
+                held[prod_vers] = vers_ids[prod_vers]
+        tasks.append((filename, vers_ids[prod_vers], bulk))
+
+    failures = []
+    if jobs > 1 and len(tasks) > 1:
+        with Pool(min(jobs, len(tasks)), initializer = start_worker) as pool:
+            for x in pool.imap_unordered(upload_shard_worker, tasks):
+                if x[1] is not None:
+                    failures.append(x)
+                else:
+                    renew_hold(conn, held.values())
+    else:
+        symbols = symbol_cache.SymbolCache()
+        for filename, vers_id, bulk in tasks:
+            try:
+                upload_shard(conn, filename, vers_id, symbols, bulk)
+                renew_hold(conn, held.values())
+            except (Exception, KeyboardInterrupt) as e:
+                failures.append((filename, e))
+                break
+
+    if failures:
+        for filename, e in failures:
+            utility.terminal_msg(1, "Exception/Interrupt {} caught uploading {}.".format(e, filename))
+        roll_back(conn, held)
+        utility.terminal_msg(2, "Database rollback complete.")
+        if close_conn:
+            conn.close()
+        # so a caller, or the exit code of a process running this, tells it from an upload that went in
+        raise Exception("Uploading {} failed on {} of its JSON files, it was rolled back.".format(filedir, len(failures)))
+
+    publish(conn, held.values())
+
+    if close_conn:
+        conn.close()
 
 if __name__ == "__main__":
     p = ArgumentParser(description=__doc__)
 
     p.add_argument("-j", "--json_directory", type=str, required=True,
                    help="The root directory JSON RPMDB files will be found.")
+    p.add_argument("-b", "--bulk", action="store_true",
+                   help="Add the rows with COPY, reserving their ids in blocks, instead of inserting them one at a time.")
+    p.add_argument("-J", "--jobs", type=int, default=1,
+                   help="Upload this many JSON files at once, each over a connection of its own.")
+    p.add_argument("-a", "--add-to-existing", action="store_true",
+                   help="Add the JSON files to their version if it's already in the database, instead of refusing to upload them.")
 
     args = p.parse_args()
 
-    upload(args.json_directory)
+    try:
+        upload(args.json_directory, bulk = args.bulk, jobs = args.jobs, add_to_existing = args.add_to_existing)
+    except Exception as e:
+        terminal_msg(0, str(e))
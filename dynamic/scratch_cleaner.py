@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+scratch_cleaner removes the directories rpms were unpacked into on a
+background thread, so a worker can go on to its next rpm right away. A
+directory is renamed into a trash directory first, which is quick and frees
+its name for the next rpm, and deleted from there. Each one goes in a
+directory of its own there, named by mkdtemp so a restarted run's discards
+can't collide with the leftovers of the run before.
+"""
+from os import chmod, listdir, mkdir, path, rename
+from queue import Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import monotonic
+
+
+def remove_tree(top):
+    '''
+    rmtree that also gets rid of directories unpacked without write or
+    search permission for us, as rpms sometimes install them.
+    '''
+    def fix_permissions(func, p, exc_info):
+        parent = path.dirname(p)
+        chmod(parent, 0o777)
+        if path.isdir(p) and not path.islink(p):
+            chmod(p, 0o777)
+        func(p)
+
+    rmtree(top, onerror = fix_permissions)
+
+
+class ScratchCleaner:
+    def __init__(self, trash_dir, log):
+        '''
+        @param
+        trash_dir   where discarded directories wait to be removed. It has to be on the same filesystem as them.
+        log         a callable taking a message string, called from the cleaner thread
+        '''
+        self.trash_dir = trash_dir
+        self.log = log
+        self.discarded = 0
+        self.cleanup_time = 0.0
+        self.queue = Queue()
+
+        if not path.exists(trash_dir):
+            mkdir(trash_dir)
+
+        self.thread = Thread(target = self._clean, daemon = True)
+        self.thread.start()
+
+        # left behind by a run that didn't get to finish
+        for leftover in listdir(trash_dir):
+            self.queue.put((path.join(trash_dir, leftover), leftover))
+
+    def discard(self, scratch, label = None):
+        '''
+        Move scratch into the trash and have it removed in the background.
+
+        @param
+        label       what the removal is logged as, e.g. the rpm that was unpacked in scratch
+        '''
+        self.discarded += 1
+        trashed = mkdtemp(prefix = path.basename(scratch) + "-", dir = self.trash_dir)
+        rename(scratch, path.join(trashed, path.basename(scratch)))
+        self.queue.put((trashed, label or path.basename(scratch)))
+
+    def _clean(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            trashed, label = item
+            start = monotonic()
+            try:
+                remove_tree(trashed)
+            except Exception as e:
+                self.log("Unable to remove %s: %s" % (trashed, str(e)))
+                continue
+            elapsed = monotonic() - start
+            self.cleanup_time += elapsed
+            self.log("Cleaned up after %s in %.3f seconds" % (label, elapsed))
+
+    def close(self):
+        '''
+        Wait for everything discarded so far to be removed.
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.log("Spent %.3f seconds cleaning up %d scratch directories" % (self.cleanup_time, self.discarded))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+symbol_cache hands out the ids of the symbols table, where every symbol name
+decl_funcs and callee_funcs refer to is stored once. Names already looked up
+are kept in memory, the rest are looked up and the missing ones added a batch
+of statements at a time.
+"""
+
+# names in each statement, under the number of parameters sqlite takes in one
+BATCH = 500
+
+# names kept before the cache starts over
+MAX_CACHED = 2 ** 21
+
+# SQL format strings, for a batch of names
+select_sql = "SELECT symbol_id, name FROM symbols WHERE name IN ({});"
+
+# names added meanwhile by another upload are already there
+upsert_sql = "INSERT INTO symbols (name) VALUES {} ON CONFLICT (name) DO NOTHING;"
+
+
+def rpm_symbol_names(rpm_data):
+    '''
+    @return
+    set of the names of the symbols of an rpm in a JSON file, and the functions they call
+    '''
+    names = set()
+    for exe_data in rpm_data["executables"].values():
+        for symbol, symbol_data in exe_data.get("symbols", {}).items():
+            names.add(symbol)
+            for x in symbol_data.get("called_functions", []):
+                if x.get("function") is not None:
+                    names.add(x["function"])
+    return names
+
+
+class SymbolCache:
+    def __init__(self, max_cached = MAX_CACHED):
+        self.ids = {}
+        self.max_cached = max_cached
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def get(self, name):
+        return self.ids.get(name)
+
+    def lookup(self, curs, names):
+        for i in range(0, len(names), BATCH):
+            batch = names[i:i + BATCH]
+            curs.execute(select_sql.format(", ".join(["%s"] * len(batch))), batch)
+            self.ids.update((name, symbol_id) for symbol_id, name in curs.fetchall())
+
+    def intern(self, conn, names):
+        '''
+        Make sure every name has a row in the symbols table and an id in the cache.
+
+        The rows are committed in a transaction of their own, so uploads running at
+        the same time don't wait for each other's transactions to end to add a name
+        they both have. Names whose upload is rolled back afterwards stay, unused.
+
+        @param
+        conn    the connection to the database, not in a transaction
+        names   an iterable of symbol names
+        '''
+        missing = [x for x in names if x not in self.ids]
+        if len(self.ids) + len(missing) > self.max_cached:
+            self.ids = {}
+            missing = list(names)
+        if not missing:
+            return
+        # in the same order everywhere, so two uploads adding the same names can't deadlock
+        missing.sort()
+
+        with conn:
+            with conn.cursor() as curs:
+                # most names are in the table already, looking them up first doesn't use up ids of the sequence
+                self.lookup(curs, missing)
+                missing = [x for x in missing if x not in self.ids]
+                for i in range(0, len(missing), BATCH):
+                    batch = missing[i:i + BATCH]
+                    curs.execute(upsert_sql.format(", ".join(["(%s)"] * len(batch))), batch)
+                self.lookup(curs, missing)
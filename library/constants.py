@@ -6,6 +6,7 @@ A collection of constant strings for column names, architectures, etc.
 SEPARATOR = "*****"
 D_SEPARATOR = ".*****."
 FPATH = "filepath"
+DEBUGINFO = "debuginfo"
 D_X86_64 = ".x86_64."
 D_I686 = ".i686."
 D_NOARCH = ".noarch."
@@ -21,6 +22,8 @@ PROD = "product"
 VERSIONS = "versions"
 VERS_ID = "vers_id"
 VERS = "version"
+READY = "ready"
+HELD_UNTIL = "held_until"
 ## RPM table columns / rpm_db_builder constants
 RPMS = "rpms"
 RPM_ID = "rpm_id"
@@ -36,14 +39,20 @@ OTHERARCH = "other_arch"
 EXECS = "execs"
 EXEC_ID = "exec_id"
 EXEC = "exec"
+BUILD_ID = "build_id"
+EXEC_PATH = "path"
+SONAME = "soname"
+ELF_CLASS = "elf_class"
 ## Alias table columns
 ALIASES = "aliases"
 ALIAS_ID = "alias_id"
 ALIAS = "alias"
+ALIAS_PATH = "path"
 ## Rpath table columns
 RPATHS = "rpaths"
 RPATH_ID = "rpath_id"
 RPATH = "rpath"
+RUNPATH = "runpath"
 ## Dependency table columns
 DEPENDENCIES = "deps"
 DEP_ID = "dep_id"
@@ -53,6 +62,15 @@ STATIC = "static"
 R_DEPS_EXECS = "resolved_deps_execs"
 DEP_ID = "dep_id"
 R_EXEC_ID = "r_exec_id"
+## Executable content table columns
+EXEC_CONTENTS = "exec_contents"
+CONTENT_ID = "content_id"
+CONTENT_KEY = "content_key"
+COMPLETE = "complete"
+## Symbol table columns
+SYMBOLS = "symbols"
+SYMBOL_ID = "symbol_id"
+SYMBOL_NAME = "name"
 ## Function table columns
 DECL_FUNCS = "decl_funcs"
 DECL_ID = "func_id"
@@ -69,3 +87,12 @@ AT = "at"
 CALLEE_FUNCS = "callee_funcs"
 CALLEE_ID = "callee_func_id"
 C_FUNC = "callee_func"
+C_SYMBOL_ID = "callee_symbol_id"
+## ISO fingerprint table columns
+ISO_FINGERPRINTS = "iso_fingerprints"
+FINGERPRINT = "fingerprint"
+ISO_NAME = "iso_name"
+ISO_SIZE = "iso_size"
+PVD_HASH = "pvd_hash"
+METADATA_HASH = "metadata_hash"
+SAMPLE_HASH = "sample_hash"
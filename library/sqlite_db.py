@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+A stand-in for a psycopg2 connection to the database, backed by a sqlite file.
+It takes the SQL the scripts already send to postgres: %s placeholders,
+"public." table names, SERIAL columns, ILIKE, RETURNING and
+"ADD COLUMN IF NOT EXISTS" are translated on the way through. It's meant for
+benchmarks and trying the scripts out without a database server, not for
+keeping data in.
+
+Needs sqlite 3.35 or later for RETURNING.
+"""
+import re
+import sqlite3
+
+
+table_prefix_match = re.compile(r"\bpublic\.")
+serial_match = re.compile(r"\bSERIAL\b", re.IGNORECASE)
+ilike_match = re.compile(r"\bILIKE\b", re.IGNORECASE)
+add_column_match = re.compile(r"^\s*ALTER TABLE (?P<table>\w+) ADD COLUMN IF NOT EXISTS (?P<column>\w+)", re.IGNORECASE)
+
+
+def translate(sql):
+    '''
+    Rewrite a statement written for postgres and psycopg2 for sqlite3.
+    sqlite's LIKE already ignores case (for ASCII), so ILIKE becomes LIKE.
+    '''
+    sql = table_prefix_match.sub("", sql)
+    sql = serial_match.sub("INTEGER", sql)
+    sql = ilike_match.sub("LIKE", sql)
+    return sql.replace("%s", "?").replace("%%", "%")
+
+
+class SqliteCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = conn.cursor()
+        self.query = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _skip(self, sql):
+        # sqlite has no "ADD COLUMN IF NOT EXISTS"
+        match = add_column_match.match(sql)
+        if not match:
+            return sql, False
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(%s)" % match.group("table"))]
+        return re.sub(r"\s+IF NOT EXISTS", "", sql, count = 1, flags = re.IGNORECASE), match.group("column") in columns
+
+    def execute(self, sql, args = ()):
+        self.query = sql
+        sql, skip = self._skip(translate(sql))
+        if not skip:
+            self._cursor.execute(sql, args or ())
+
+    def executemany(self, sql, arg_list):
+        self.query = sql
+        self._cursor.executemany(translate(sql), arg_list)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size = None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    def __init__(self, filename):
+        '''
+        @param
+        filename    the sqlite file, created if it doesn't exist
+        '''
+        self.filename = filename
+        self._conn = sqlite3.connect(filename)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # like psycopg2, "with conn" ends the transaction but leaves the connection open
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def cursor(self):
+        return SqliteCursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(filename):
+    '''
+    @return
+    a SqliteConnection to filename, which takes the place of psycopg2.connect(utility.get_conn_str())
+    '''
+    return SqliteConnection(filename)
@@ -70,6 +70,17 @@ def get_fullversion_str(dynamic_path, version):
         
 
 
+# the version itself, or any release of it, e.g. 13.1.1-0.0.4 for 13.1.1 but not 13.1.10
+version_exist_sql = ("SELECT count(*) FROM versions JOIN products ON versions.prod_id = products.prod_id "
+                     "WHERE products.product = %s AND (versions.version = %s OR versions.version LIKE %s || '-%%') AND versions.ready;")
+
+def like_escape(s):
+    '''
+    @return
+    s with the LIKE metacharacters escaped, to be matched as is
+    '''
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 def version_exist(prod, vers):
     # establish connection
     conn = psycopg2.connect(utility.get_conn_str())
@@ -80,8 +91,7 @@ def version_exist(prod, vers):
     # with connect enables auto-commit. (otherwise do conn.commit() manually)
     with conn:
         with conn.cursor() as cur:
-            sql = "SELECT count(*) FROM versions JOIN products ON versions.prod_id = products.prod_id WHERE products.product = '{}' AND versions.version = '{}';".format(prod, vers + "%")
-            cur.execute(sql)
+            cur.execute(version_exist_sql, (prod, vers, like_escape(vers)))
             
             # print real query generated by psycopg2
             print(cur.query)
@@ -96,13 +106,13 @@ def version_exist(prod, vers):
 
     try:
         if res[0] > 0:
-            utility.terminal_msg(2, "Product %s %s is already parsed into database.".format(prod, vers))
+            utility.terminal_msg(2, "Product {} {} is already parsed into database.".format(prod, vers))
             return True
         # when certain version not found in database
         else:
             return False
     except Exception as e:
-        utility.terminal_msg(0, "Error occurred during querying product %s %s with error message: %s".format(prod, vers, e))
+        utility.terminal_msg(0, "Error occurred during querying product {} {} with error message: {}".format(prod, vers, e))
                     
     
 
@@ -168,8 +178,14 @@ def iterate_seadev(args):
                             utility.terminal_msg(2, "Processing {} {} from seadev path.".format(args.product_name, args.version_number))
                             # run parser
                             args = dynamic_parser.wrapper(args, 2)
+                            if args.already_ingested:
+                                # the same iso as a version already in the database, under another name
+                                isos_uploaded -= 1
+                                continue
                             static_parser.wrapper(args, 2)
-                            dependency_resolver.resolve_deps(args.product_name, args.version_number)
+                            if dependency_resolver.resolve_deps_exact(args.product_name, args.version_number):
+                                # executables uploaded without install paths, matched by name instead
+                                dependency_resolver.resolve_deps(args.product_name, args.version_number, unrecorded_only = True)
                     except Exception as e:
                         with open("~/parser_exception_log", "a") as f:
                             f.write("************FOUND EXCEPTION**********\n")